@@ -0,0 +1,82 @@
+"""
+Chat batch throughput: the same batch of prompts through ChatAsync (threads over the sync client) and through the
+pooled ChatClientAsync, at several concurrency levels, against the fake OpenAI server. From the repo root:
+    python benchmarks/bench_chat.py --requests 200 --concurrency 10 50 100
+
+--latency and --tokens-per-second shape the fake responses, --error-rate injects 429s to measure the cost of retries.
+"""
+import argparse
+import asyncio
+import time
+
+from common import add_common_args, finish, maybe_fake_openai, quiet, summarize
+
+from benlp.llms import ChatAsync, ChatClientAsync
+
+SYSTEM_MESSAGE = "You are a helpful assistant."
+
+
+def run_chat_async(prompts, max_tokens):
+    # ChatAsync runs every prompt at once on the default thread pool
+    responses = []
+    start = time.perf_counter()
+    with quiet():
+        ChatAsync(model="gpt-3.5-turbo")(prompts, responses, max_tokens=max_tokens)
+    elapsed = time.perf_counter() - start
+    return {"requests_per_second": len(responses) / elapsed, "errors": len(prompts) - len(responses)}
+
+
+async def run_client(prompts, concurrency, max_tokens):
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with ChatClientAsync(max_connections=concurrency) as llm:
+        async def one(prompt):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await llm.create([{"role": "system", "content": SYSTEM_MESSAGE},
+                                      {"role": "user", "content": prompt}], max_tokens=max_tokens)
+                    latencies.append(time.perf_counter() - start)
+                except Exception:
+                    errors += 1
+
+        start = time.perf_counter()
+        with quiet():
+            await asyncio.gather(*(one(prompt) for prompt in prompts))
+        elapsed = time.perf_counter() - start
+
+    return {"requests_per_second": len(latencies) / elapsed, "errors": errors, **summarize(latencies)}
+
+
+def main(args):
+    prompts = [f"Write a haiku about benchmark number {idx}." for idx in range(args.requests)]
+    metrics = {}
+    with maybe_fake_openai(args, latency=args.latency, tokens_per_second=args.tokens_per_second, tokens=args.tokens,
+                           error_rate=args.error_rate, retry_after=0):
+        result = run_chat_async(prompts, args.tokens)
+        print(f"ChatAsync: {result['requests_per_second']:.1f} req/s, {result['errors']} errors")
+        metrics.update({f"chat_async_{key}": value for key, value in result.items()})
+
+        for concurrency in args.concurrency:
+            result = asyncio.run(run_client(prompts, concurrency, args.tokens))
+            print(f"ChatClientAsync x{concurrency}: {result['requests_per_second']:.1f} req/s, "
+                  f"p50 {result['latency_p50']:.3f}s, p99 {result['latency_p99']:.3f}s, {result['errors']} errors")
+            metrics.update({f"client_c{concurrency}_{key}": value for key, value in result.items()})
+
+    params = {"requests": args.requests, "concurrency": args.concurrency, "latency": args.latency,
+              "tokens_per_second": args.tokens_per_second, "tokens": args.tokens, "error_rate": args.error_rate}
+    finish(args, "chat", params, metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=500)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    add_common_args(parser)
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+"""
+Index write throughput: adding documents one at a time with the old full-rewrite sync (append to a list, pickle the
+whole index) vs the write-ahead logged IndexStore, with one or more worker processes feeding the same index, and
+how long reopening (checkpoint load + log replay) takes. From the repo root:
+    python benchmarks/bench_index_writes.py --documents 200 --workers 1 4 --sync-every 1 64
+
+No API calls, the documents have random embeddings.
+"""
+import argparse
+import os
+import pickle
+import random
+import tempfile
+import time
+from multiprocessing import Process
+
+from common import add_common_args, finish, quiet
+
+from benlp.wal import IndexStore
+
+
+def make_document(idx, num_chunks, dim, seed=0):
+    rng = random.Random(seed * 1000003 + idx)
+    doc_id = f"{seed:04x}{idx:012x}"
+    return {
+        "id": doc_id, "fpath": f"doc_{seed}_{idx}.csv", "ext": ".csv", "fname": f"doc_{seed}_{idx}.csv",
+        "metadata": None,
+        "data": [{"id": f"{doc_id}-{position + 1}", "text": f"chunk {position} of document {idx}",
+                  "embedding": [rng.gauss(0, 1) for _ in range(dim)]} for position in range(num_chunks)],
+    }
+
+
+def run_rewrite(path, documents):
+    # what BaseAgent.sync_index used to do after every document
+    index = []
+    start = time.perf_counter()
+    for doc_dict in documents:
+        index.append(doc_dict)
+        with open(path, "wb") as f:
+            pickle.dump(index, f)
+    return time.perf_counter() - start
+
+
+def feed(path, documents, sync_every):
+    with quiet():
+        store = IndexStore(path, sync_every=sync_every)
+        for doc_dict in documents:
+            store.add_document(doc_dict)
+        store.close()
+
+
+def run_wal(path, documents, workers, sync_every):
+    with quiet():
+        IndexStore(path, sync_every=sync_every).close()
+    shares = [documents[worker::workers] for worker in range(workers)]
+    start = time.perf_counter()
+    if workers == 1:
+        feed(path, shares[0], sync_every)
+    else:
+        processes = [Process(target=feed, args=(path, share, sync_every)) for share in shares]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with quiet():
+        store = IndexStore(path)
+    reopen = time.perf_counter() - start
+    assert len(store.index) == len(documents), f"expected {len(documents)} documents, got {len(store.index)}"
+    store.close()
+    return elapsed, reopen
+
+
+def main(args):
+    documents = [make_document(idx, args.chunks, args.dim) for idx in range(args.documents)]
+    metrics = {}
+    with tempfile.TemporaryDirectory() as directory:
+        elapsed = run_rewrite(os.path.join(directory, "rewrite.pkl"), documents)
+        print(f"full rewrite: {args.documents / elapsed:.1f} docs/s")
+        metrics["rewrite_documents_per_second"] = args.documents / elapsed
+
+        for sync_every in args.sync_every:
+            for workers in args.workers:
+                path = os.path.join(directory, f"wal_{sync_every}_{workers}.pkl")
+                elapsed, reopen = run_wal(path, documents, workers, sync_every)
+                print(f"wal, fsync every {sync_every}, {workers} workers: {args.documents / elapsed:.1f} docs/s, "
+                      f"reopen {reopen:.3f}s")
+                metrics[f"wal_s{sync_every}_w{workers}_documents_per_second"] = args.documents / elapsed
+                metrics[f"wal_s{sync_every}_w{workers}_reopen_seconds"] = reopen
+
+    params = {"documents": args.documents, "chunks": args.chunks, "dim": args.dim, "workers": args.workers,
+              "sync_every": args.sync_every}
+    finish(args, "index_writes", params, metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--chunks", type=int, default=10, help="chunks per document")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--sync-every", type=int, nargs="+", default=[1, 64], help="records between fsyncs")
+    add_common_args(parser)
+    main(parser.parse_args())
@@ -0,0 +1,87 @@
+"""
+Ingestion throughput: parse, chunk and embed synthetic CSV documents with Document.process() against the fake
+OpenAI server. From the repo root:
+    python benchmarks/bench_ingestion.py --documents 50 --rows 200 --workers 1 4
+
+Reports documents, chunks and MB per second at each worker count. --embedding-latency sets the fake embedding
+endpoint's latency, 0 measures the local parsing/chunking cost alone.
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import add_common_args, finish, maybe_fake_openai, quiet, summarize
+
+from benlp.document import Document
+
+WORDS = ("gene variant protein expression pathway patient phenotype sequence model index embedding search "
+         "notebook cell function class return value error retry latency cache token stream chunk").split()
+
+
+def make_documents(directory, num_documents, num_rows, seed=0):
+    rng = random.Random(seed)
+    paths = []
+    for idx in range(num_documents):
+        path = os.path.join(directory, f"doc_{idx}.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["id", "title", "text"])
+            for row in range(num_rows):
+                writer.writerow([row, " ".join(rng.choices(WORDS, k=4)), " ".join(rng.choices(WORDS, k=40))])
+        paths.append(path)
+    return paths
+
+
+def ingest(path):
+    start = time.perf_counter()
+    data = Document(path).process().to_dict()
+    return time.perf_counter() - start, len(data["data"])
+
+
+def run(paths, workers):
+    start = time.perf_counter()
+    # redirect_stdout swaps the process-wide sys.stdout, so it wraps the threads instead of running in each of them
+    with quiet(), ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(ingest, paths))
+    elapsed = time.perf_counter() - start
+    latencies = [latency for latency, _ in results]
+    chunks = sum(num_chunks for _, num_chunks in results)
+    size = sum(os.path.getsize(path) for path in paths) / 1e6
+    return {
+        "documents_per_second": len(paths) / elapsed,
+        "chunks_per_second": chunks / elapsed,
+        "mb_per_second": size / elapsed,
+        **summarize(latencies, prefix="document_latency"),
+    }
+
+
+def main(args):
+    metrics = {}
+    with tempfile.TemporaryDirectory() as directory, maybe_fake_openai(args, embedding_latency=args.embedding_latency):
+        paths = make_documents(directory, args.documents, args.rows)
+        with quiet():
+            ingest(paths[0])  # warm up imports and connections
+        for workers in args.workers:
+            result = run(paths, workers)
+            print(f"{workers:>3} workers: {result['documents_per_second']:.1f} docs/s, "
+                  f"{result['chunks_per_second']:.1f} chunks/s, {result['mb_per_second']:.2f} MB/s, "
+                  f"p50 {result['document_latency_p50']:.3f}s")
+            metrics.update({f"w{workers}_{key}": value for key, value in result.items()})
+
+    params = {"documents": args.documents, "rows": args.rows, "workers": args.workers,
+              "embedding_latency": args.embedding_latency}
+    finish(args, "ingestion", params, metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=200, help="rows per csv document")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    add_common_args(parser)
+    main(parser.parse_args())
@@ -0,0 +1,85 @@
+"""
+Search QPS: BaseAgent.get_top_k over synthetic indexes of increasing size, with query embeddings from the fake
+OpenAI server. From the repo root:
+    python benchmarks/bench_search.py --chunks 1000 10000 --queries 200
+
+The fake embedding latency defaults to 0 so the numbers are the local scoring and ranking cost.
+"""
+import argparse
+import os
+import pickle
+import random
+import tempfile
+import time
+
+from common import add_common_args, finish, maybe_fake_openai, quiet, summarize
+
+from benlp.agent import BaseAgent
+
+DIM = 1536
+
+
+def make_index(num_chunks, chunks_per_document=50, seed=0):
+    rng = random.Random(seed)
+    index = []
+    for doc_idx in range(0, num_chunks, chunks_per_document):
+        doc_id = f"doc{doc_idx}"
+        data = []
+        for idx in range(min(chunks_per_document, num_chunks - doc_idx)):
+            vector = [rng.gauss(0, 1) for _ in range(DIM)]
+            norm = sum(value * value for value in vector) ** 0.5
+            data.append({"id": f"{doc_id}-{idx + 1}", "text": f"chunk {idx} of {doc_id}",
+                         "embedding": [value / norm for value in vector]})
+        index.append({"id": doc_id, "fpath": f"{doc_id}.csv", "ext": ".csv", "fname": f"{doc_id}.csv",
+                      "metadata": None, "data": data})
+    return index
+
+
+def run(agent, num_queries, top_k):
+    latencies = []
+    start = time.perf_counter()
+    for idx in range(num_queries):
+        query_start = time.perf_counter()
+        agent.get_top_k(f"benchmark query {idx}", top_k=top_k)
+        latencies.append(time.perf_counter() - query_start)
+    elapsed = time.perf_counter() - start
+    return {"qps": num_queries / elapsed, **summarize(latencies)}
+
+
+def main(args):
+    metrics = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory, maybe_fake_openai(args, embedding_latency=args.embedding_latency):
+        # the agent keeps its indexes in ../data/indexes relative to the working directory
+        workdir = os.path.join(directory, "work")
+        os.makedirs(os.path.join(directory, "data", "indexes"))
+        os.makedirs(workdir)
+        os.chdir(workdir)
+        try:
+            for num_chunks in args.chunks:
+                index_path = os.path.join(directory, "data", "indexes", f"bench{num_chunks}.pkl")
+                with open(index_path, "wb") as f:
+                    pickle.dump(make_index(num_chunks), f)
+                with quiet():
+                    agent = BaseAgent("benchmark", index_path=index_path)
+                    agent.get_top_k("warm up", top_k=args.top_k)
+                    result = run(agent, args.queries, args.top_k)
+                print(f"{num_chunks:>8} chunks: {result['qps']:.1f} qps, p50 {result['latency_p50'] * 1000:.1f}ms, "
+                      f"p99 {result['latency_p99'] * 1000:.1f}ms")
+                metrics.update({f"n{num_chunks}_{key}": value for key, value in result.items()})
+        finally:
+            os.chdir(cwd)
+
+    params = {"chunks": args.chunks, "queries": args.queries, "top_k": args.top_k,
+              "embedding_latency": args.embedding_latency}
+    finish(args, "search", params, metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    add_common_args(parser)
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""
+Similarity kernel microbenchmark: queries per second of the old get_top_k loop (np.dot per chunk over lists of
+float64) against the blocked kernels in benlp/similarity.py for each metric and storage dtype. From the repo root:
+    python benchmarks/bench_similarity.py --chunks 10000 100000 --dim 1536
+
+No API calls, the vectors are random. The old loop only runs up to --legacy-max chunks, it keeps every embedding as
+a list of Python floats.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common import add_common_args, finish
+
+from benlp.similarity import DTYPES, METRICS, prepare, prepare_query, top_k_rows
+
+
+def legacy_top_k(chunks, embedding, top_k):
+    # the loop get_top_k used to run
+    results = []
+    for chunk in chunks:
+        similarity = np.dot(embedding, chunk["embedding"])
+        results.append({"id": chunk["id"], "similarity": similarity})
+    results = sorted(results, key=lambda x: x["similarity"], reverse=True)
+    return results[:top_k]
+
+
+def measure(fn, queries):
+    fn(queries[0])  # warm up
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    metrics = {}
+    for num_chunks in args.chunks:
+        embeddings = rng.standard_normal((num_chunks, args.dim), dtype=np.float32)
+        queries = list(rng.standard_normal((args.queries, args.dim), dtype=np.float32))
+
+        if num_chunks <= args.legacy_max:
+            chunks = [{"id": idx, "embedding": embedding.tolist()} for idx, embedding in enumerate(embeddings)]
+            legacy_queries = [query.tolist() for query in queries[:max(1, args.queries // 10)]]
+            qps = measure(lambda query: legacy_top_k(chunks, query, args.top_k), legacy_queries)
+            print(f"{num_chunks:>8} chunks, legacy loop:        {qps:>10.1f} qps")
+            metrics[f"n{num_chunks}_legacy_qps"] = qps
+            del chunks
+
+        for metric in METRICS:
+            for dtype in args.dtypes:
+                vectors, norms = prepare(embeddings, metric, dtype)
+                prepared = [prepare_query(query, metric, dtype) for query in queries]
+                qps = measure(lambda query: top_k_rows(vectors, query, args.top_k, metric, norms), prepared)
+                print(f"{num_chunks:>8} chunks, {metric:>6} {dtype:<8}:      {qps:>10.1f} qps")
+                metrics[f"n{num_chunks}_{metric}_{dtype}_qps"] = qps
+
+        # one matmul over everything, to see what the cache-sized blocks buy
+        vectors, _ = prepare(embeddings, "cosine", "float32")
+        prepared = [prepare_query(query, "cosine", "float32") for query in queries]
+        qps = measure(lambda query: top_k_rows(vectors, query, args.top_k, rows_per_block=num_chunks), prepared)
+        print(f"{num_chunks:>8} chunks, cosine float32 unblocked: {qps:>6.1f} qps")
+        metrics[f"n{num_chunks}_cosine_float32_unblocked_qps"] = qps
+
+    params = {"chunks": args.chunks, "dim": args.dim, "queries": args.queries, "top_k": args.top_k,
+              "dtypes": args.dtypes, "legacy_max": args.legacy_max}
+    finish(args, "similarity", params, metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--dtypes", nargs="+", default=["float32", "float16"], choices=list(DTYPES))
+    parser.add_argument("--legacy-max", type=int, default=20000, help="largest index the legacy loop runs on")
+    add_common_args(parser)
+    main(parser.parse_args())
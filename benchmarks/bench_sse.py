@@ -0,0 +1,65 @@
+"""
+SSE stream capacity: start the fake OpenAI server and the API server, then drive /chat/stream with the load test
+in server/loadtest.py at increasing concurrency. From the repo root:
+    python benchmarks/bench_sse.py --concurrency 1 10 50 100 200 --workers 1
+
+The capacity is the highest concurrency with no errors and p99 time to first token under --slo.
+"""
+import argparse
+import asyncio
+import os
+
+from common import add_common_args, finish, maybe_fake_openai, run_server
+
+from loadtest import run_level
+
+API_KEY = "benchmark-key"
+
+
+async def run_levels(url, args):
+    payload = {"messages": [{"role": "user", "content": "Hello!"}], "max_tokens": args.tokens}
+    headers = {"X-API-KEY": API_KEY}
+    results = []
+    for concurrency in args.concurrency:
+        result = await run_level(url, concurrency, max(args.requests, concurrency), payload, headers)
+        print(f"{concurrency:>5} streams: {result['errors']} errors, ttft p99 {result['ttft_p99']:.3f}s, "
+              f"latency p99 {result['latency_p99']:.3f}s, {result['streams_per_second']:.1f} streams/s")
+        results.append(result)
+    return results
+
+
+def main(args):
+    env = {"OPENAI_API_BASE": os.environ["OPENAI_API_BASE"], "MY_API_KEY": API_KEY}
+    with maybe_fake_openai(args, latency=args.latency, tokens_per_second=args.tokens_per_second, tokens=args.tokens):
+        with run_server("main:app", args.port, "/", env=env, workers=args.workers) as server_url:
+            results = asyncio.run(run_levels(f"{server_url}/chat/stream", args))
+
+    metrics = {}
+    capacity = 0
+    for result in results:
+        concurrency = result["concurrency"]
+        if result["errors"] == 0 and result["ttft_p99"] <= args.slo:
+            capacity = max(capacity, concurrency)
+        metrics.update({f"c{concurrency}_{key}": value for key, value in result.items()
+                        if key not in ("concurrency", "requests")})
+    metrics["capacity"] = capacity
+    print(f"Concurrent stream capacity (p99 ttft <= {args.slo}s, no errors): {capacity}")
+
+    params = {"concurrency": args.concurrency, "requests": args.requests, "workers": args.workers,
+              "latency": args.latency, "tokens_per_second": args.tokens_per_second, "tokens": args.tokens,
+              "slo": args.slo}
+    finish(args, "sse", params, metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the API server")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--slo", type=float, default=1.0, help="p99 time to first token target in seconds")
+    add_common_args(parser)
+    main(parser.parse_args())
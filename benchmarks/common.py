@@ -0,0 +1,226 @@
+"""
+Shared helpers for the benchmarks: starting the fake OpenAI server, timing, and saving results to compare against
+the previous run (or the committed baseline). Import this before benlp, it points OPENAI_API_BASE at the fake server (override with
+BENCH_FAKE_PORT, or set OPENAI_API_BASE yourself to benchmark against something else).
+"""
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(ROOT, "server")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+# committed reference runs, compared against when there's no local run with the same params
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+
+FAKE_PORT = int(os.environ.get("BENCH_FAKE_PORT", 8001))
+FAKE_URL = f"http://127.0.0.1:{FAKE_PORT}"
+
+# openai and benlp read these at import time
+os.environ.setdefault("OPENAI_API_BASE", f"{FAKE_URL}/v1")
+os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+sys.path.insert(0, ROOT)
+sys.path.insert(1, SERVER_DIR)
+
+# ! Servers ===================================================================
+
+
+def wait_for(url: str, timeout=15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{url} didn't come up within {timeout}s")
+            time.sleep(0.1)
+
+
+@contextlib.contextmanager
+def run_server(app: str, port: int, health_path: str, env: Optional[Dict] = None, workers=1):
+    """
+    Run an app from the server folder with uvicorn in a subprocess, for the duration of the block.
+    """
+    command = [sys.executable, "-m", "uvicorn", app, "--app-dir", SERVER_DIR, "--port", str(port),
+               "--log-level", "warning", "--workers", str(workers)]
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env={**os.environ, **(env or {})})
+    try:
+        wait_for(f"http://127.0.0.1:{port}{health_path}")
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def set_fake_config(**config) -> Dict:
+    """
+    Change the running fake server's settings, e.g. set_fake_config(latency=0.5, error_rate=0.1).
+    """
+    request = urllib.request.Request(f"{FAKE_URL}/fake/config", data=json.dumps(config).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.loads(response.read())
+
+
+@contextlib.contextmanager
+def fake_openai(**config):
+    """
+    Start the fake OpenAI server (server/fake_openai.py) with the given settings, see its docstring for the keys.
+    """
+    with run_server("fake_openai:app", FAKE_PORT, "/fake/config") as url:
+        if config:
+            set_fake_config(**config)
+        yield url
+
+# ! Measuring =================================================================
+
+
+@contextlib.contextmanager
+def quiet():
+    # benlp prints progress per document/request, which would dominate the timings
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    idx = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[idx]
+
+
+def summarize(latencies: List[float], prefix="latency") -> Dict:
+    return {
+        f"{prefix}_mean": statistics.fmean(latencies) if latencies else float("nan"),
+        f"{prefix}_p50": percentile(latencies, 50),
+        f"{prefix}_p95": percentile(latencies, 95),
+        f"{prefix}_p99": percentile(latencies, 99),
+    }
+
+# ! Results ===================================================================
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_second") or metric in ("qps", "capacity")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def compare(previous: Dict, current: Dict, threshold: float) -> List[str]:
+    """
+    Print each metric against the previous run and return the ones that got worse by more than threshold.
+    """
+    regressions = []
+    print(f"{'metric':<40} {'previous':>12} {'current':>12} {'change':>8}")
+    for metric, value in current.items():
+        old = previous.get(metric)
+        if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+            print(f"{metric:<40} {'-':>12} {value:>12.4g}")
+            continue
+        change = (value - old) / abs(old)
+        worse = -change if higher_is_better(metric) else change
+        flag = " REGRESSION" if worse > threshold else ""
+        if flag:
+            regressions.append(metric)
+        print(f"{metric:<40} {old:>12.4g} {value:>12.4g} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def load_runs(directory: str, name: str) -> List[Dict]:
+    path = os.path.join(directory, f"{name}.json")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_run(runs: List[Dict], params: Dict) -> Optional[Dict]:
+    return next((run for run in reversed(runs) if run["params"] == params), None)
+
+
+def make_run(params: Dict, metrics: Dict) -> Dict:
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(), "params": params,
+            "metrics": metrics}
+
+
+def save_baseline(name: str, params: Dict, metrics: Dict) -> None:
+    """
+    Make this run the committed baseline for its params in benchmarks/baselines/<name>.json.
+    """
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    runs = [run for run in load_runs(BASELINE_DIR, name) if run["params"] != params]
+    runs.append(make_run(params, metrics))
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, "w") as f:
+        json.dump(runs, f, indent=2)
+    print(f"Baseline saved to {path}")
+
+
+def save_results(name: str, params: Dict, metrics: Dict, threshold=0.1) -> List[str]:
+    """
+    Append a run to benchmarks/results/<name>.json and compare it with the previous run with the same params, or
+    with the baseline in benchmarks/baselines/<name>.json when there is no such run yet.
+
+    :param name: str, the benchmark name
+    :param params: dict, the settings of the run, only runs with equal params are compared
+    :param metrics: dict, the measured values, names ending in _per_second (and qps, capacity) are higher-is-better
+    :param threshold: float, relative change that counts as a regression
+    :return: list, the regressed metric names
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{name}.json")
+    runs = load_runs(RESULTS_DIR, name)
+
+    previous, source = find_run(runs, params), "previous run"
+    if previous is None:
+        previous, source = find_run(load_runs(BASELINE_DIR, name), params), "baseline"
+    regressions = []
+    if previous is not None:
+        print(f"Compared with the {source} at {previous['revision'] or 'unknown revision'} ({previous['time']}):")
+        regressions = compare(previous["metrics"], metrics, threshold)
+    else:
+        print("No previous run or baseline with these params to compare with:")
+        compare({}, metrics, threshold)
+
+    runs.append(make_run(params, metrics))
+    with open(path, "w") as f:
+        json.dump(runs, f, indent=2)
+    print(f"Results saved to {path}")
+    return regressions
+
+
+def add_common_args(parser) -> None:
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change flagged as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on a regression")
+    parser.add_argument("--no-fake", action="store_true", help="don't start the fake server, use OPENAI_API_BASE as is")
+    parser.add_argument("--update-baseline", action="store_true", help="save this run as the committed baseline")
+
+
+def finish(args, name: str, params: Dict, metrics: Dict) -> None:
+    regressions = save_results(name, params, metrics, threshold=args.threshold)
+    if args.update_baseline:
+        save_baseline(name, params, metrics)
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+def maybe_fake_openai(args, **config):
+    return contextlib.nullcontext() if args.no_fake else fake_openai(**config)
@@ -1,19 +1,58 @@
 from operator import itemgetter
 import os
-import pickle
-from .utils import random_6_digit_id
-from .llms import Completion, Chat, embed_ada
+import time
+import asyncio
+import threading
+from .catalog import new_index_id
+from .wal import IndexStore
+from .llms import Completion, Chat, ChatAsync, embed_ada, stream_text
 from .document import Document
+from .context import AgentContext
+from .tasks import TaskGraph
+from .parsers import JSONArrayStreamParser, OutputParserError, parse_json, parse_bool
+from .react import ReActRuntime, search_tool, code_tool, omim_tool
 from .prompts.react import REACT_EXAMPLES
+from .metrics import span, SEARCH_LATENCY
+from .rerank import get_reranker
 from typing import Dict, List, Tuple
-import numpy as np
 import random
 
+TASK_LIST_FUNCTION = {
+    "name": "create_tasks",
+    "description": "Create the list of tasks needed to achieve the objective.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "tasks": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string", "description": "the name of the task"},
+                        "instruction": {"type": "string", "description": "the instruction for the task"},
+                        "tools_needed": {"type": "string", "description": "comma separated names of the tools needed, if any"},
+                        "depends_on": {"type": "array", "items": {"type": "string"}, "description": "names of earlier tasks whose results this task needs"},
+                    },
+                    "required": ["name", "instruction"],
+                },
+            },
+        },
+        "required": ["tasks"],
+    },
+}
+
 
 class BaseAgent:
     def __init__(self, objective, config=None, index_path=None):
         # config
-        self.config = config
+        # eval_every: evaluate the objective after every n completed tasks (0 disables evaluation)
+        # max_concurrency: max number of independent tasks run at once
+        # metric, vector_dtype: how a new index scores and stores vectors (cosine/dot/l2, float32, or float16 to
+        # halve the memory at the cost of slower searches)
+        # rerank: re-score search results with "llm" or "cross_encoder" (None to keep the similarity order)
+        # rerank_candidates: search results the re-ranker picks the top_k from
+        # rerank_budget: seconds retrieval for a task may take, the re-ranker is skipped when it wouldn't fit
+        self.config = config or {}
         self.objective = objective
 
         # llm stuff
@@ -22,12 +61,18 @@ class BaseAgent:
         self.task_list = []
         self.code_executions = []
         self.token_counter = 0
+        self.run_stats = None
+        self.chat_async = ChatAsync(model="gpt-3.5-turbo")
+
+        # memory / context stuff
+        self.working_memory = []
+        self.context = AgentContext(model="gpt-3.5-turbo")
 
         # DB stuff
-        self.index = self.init_index(index_path)
         self.index_id = None
-        self.index_path = self.get_index_path(self.index_id)
-        self.working_memory = []
+        self.index_path = None
+        self.index_store = self.init_index(index_path)
+        self.reranker = get_reranker(self.config.get("rerank"))
 
     # ! CONFIG methods ==========================================================
 
@@ -43,6 +88,22 @@ class BaseAgent:
         self.tools.remove(tool)
         print(f"Tool removed: {tool}")
 
+    def add_default_tools(self):
+        """
+        Add the built in Search, Code and OMIM tools.
+        """
+        for tool in [search_tool(self), code_tool(), omim_tool()]:
+            self.add_tool(tool)
+        return self
+
+    def get_runtime(self):
+        """
+        Create a ReAct runtime that can dispatch every tool with a function.
+        """
+        tools = {tool['name']: tool['function'] for tool in self.tools if 'function' in tool}
+        descriptions = {tool['name'].lower(): tool['instruction'] for tool in self.tools if 'function' in tool}
+        return ReActRuntime(tools=tools, tool_descriptions=descriptions, model='gpt-3.5-turbo', max_tokens=1000)
+
     def get_tools(self):
         tools_prompt = "Tools Availible:" + \
             "\n".join(
@@ -57,7 +118,7 @@ class BaseAgent:
 
     # ! Models =============================================================
 
-    def generate_tasks(self):
+    def get_task_prompt(self):
         tools_prompt = self.get_tools()
         base_prompt = f"""
             You are a task generator. You are given a list of tools and an objective, {self.objective}. Generate a list of tasks that will help you achieve your objective as efficiently as possible using only the tools provided.
@@ -67,6 +128,7 @@ class BaseAgent:
             "name": str, the name of the task
             "instruction": str, the instruction for the task
             "tools_needed": str, the name of the tools needed for the task, if any. You can only use tools included in the list above. separate multiple tools with commas. ex: "tool1, tool2, tool3"
+            "depends_on": list, the names of earlier tasks whose results this task needs. Use an empty list if the task can run independently.
             
             Example Output:
 
@@ -74,32 +136,125 @@ class BaseAgent:
                 {
                     "name": "task1",
                     "instruction": "do this",
-                    "tools_needed": "tool1, tool2"
+                    "tools_needed": "tool1, tool2",
+                    "depends_on": []
                 },
                 {
                     "name": "task2",
                     "instruction": "do that",
-                    "tools_needed": "tool3"
+                    "tools_needed": "tool3",
+                    "depends_on": []
+                },
+                {
+                    "name": "task3",
+                    "instruction": "combine the results of task1 and task2",
+                    "tools_needed": "",
+                    "depends_on": ["task1", "task2"]
                 }, ...
             ]
 
-            Output only a valid python list with valid python dictionaries."""
+            Call create_tasks with the complete task list."""
 
-        chat = Chat()
-        res = chat(base_prompt)['response'].strip()
-        print(f"Task List:\n\n{res}")
-        self.task_list = eval(res)
+        return base_prompt
 
-    def evaluate_objective(self):
-        memory_string = "\n\n".join(self.working_memory)
+    def iter_tasks(self, max_retries=2, stop=None):
+        """
+        Stream the task list from the model with function calling, yielding each task as soon as it is complete.
+
+        Malformed output is repaired locally, and if that fails the model is re-asked in the same conversation
+        instead of restarting the run.
+
+        :param stop: threading.Event, checked between streamed chunks, once it's set the stream is closed and no more
+            tasks are yielded
+        """
+        chat = Chat(model='gpt-3.5-turbo-0613', stream=True, functions=[TASK_LIST_FUNCTION], function_call={"name": "create_tasks"})
+        message = self.get_task_prompt()
+        yielded = 0
+
+        for attempt in range(max_retries + 1):
+            parser = JSONArrayStreamParser()
+            text = ""
+            error = None
+            count = 0
+
+            response = chat(message)
+            try:
+                for chunk in stream_text(response):
+                    if stop is not None and stop.is_set():
+                        print("Task generation stopped.")
+                        return
+                    text += chunk
+                    for task in parser.feed(chunk):
+                        count += 1
+                        # on a re-ask the model repeats the list, so skip the tasks we already yielded
+                        if count > yielded and isinstance(task, dict):
+                            yielded += 1
+                            yield self.normalize_task(task)
+                if not parser.finished:
+                    # the stream ended early or never contained a list, try to repair the whole thing
+                    tasks = parse_json(text)
+                    if isinstance(tasks, dict):
+                        tasks = tasks.get("tasks", [])
+                    for task in tasks[yielded:]:
+                        if isinstance(task, dict):
+                            yielded += 1
+                            yield self.normalize_task(task)
+            except OutputParserError as e:
+                error = e
+            finally:
+                response.close()
+
+            self.token_counter += self.context.count(message) + self.context.count(text)
+            print(f"Task List:\n\n{text}")
+            if error is None:
+                return
+
+            print(f"Could not parse task list (attempt {attempt + 1}), re-asking...")
+            message = f"Your output could not be parsed: {error}. Call create_tasks again with the complete task list as valid JSON."
+
+        raise OutputParserError(f"Could not parse the task list after {max_retries + 1} attempts.")
+
+    @staticmethod
+    def normalize_task(task):
+        task.setdefault("instruction", task.get("description", ""))
+        task.setdefault("tools_needed", "")
+        task.setdefault("depends_on", [])
+        return task
+
+    def generate_tasks(self):
+        self.task_list = list(self.iter_tasks())
+
+    def get_evaluation_prompt(self):
+        memory_string = "\n\n".join(self.context.build(self.working_memory)["memory"])
         evaluation_prompt = f"""
             You are tasked with evaluating if an objective, {self.objective}, has been sufficiently completed. You are given a history of tasks completed as follows: {memory_string}. Evaluate if the objective has been completed. If it has, output only "True", if it has not, output only "False".
         """
+        return evaluation_prompt
+
+    def evaluate_objective(self):
+        evaluation_prompt = self.get_evaluation_prompt()
         chat = Chat()
-        res = chat(evaluation_prompt)['response'].strip()
+        res = chat(evaluation_prompt)
+        self.token_counter += res['tokens']
+        res = res['response'].strip()
+        print(f"Objective Evaluation:\n\n{res}")
+        try:
+            return parse_bool(res)
+        except OutputParserError:
+            # an unclear answer means we keep going
+            return False
+
+    async def evaluate_objective_async(self):
+        evaluation_prompt = await asyncio.to_thread(self.get_evaluation_prompt)
+        res = await self.chat_async.chat_response_wrapped(0.7, evaluation_prompt, 1000, "You are a helpful assistant.")
+        self.token_counter += res['tokens']
+        res = res['response'].strip()
         print(f"Objective Evaluation:\n\n{res}")
-        _bool = eval(res)
-        return _bool
+        try:
+            return parse_bool(res)
+        except OutputParserError:
+            # an unclear answer means we keep going
+            return False
 
 
     # ! DB methods ==============================================================
@@ -121,104 +276,257 @@ class BaseAgent:
         # load index if it exists
         if fpath is not None:
             if os.path.exists(fpath):
-                with open(fpath, "rb") as f:
-                    index = pickle.load(f)
-                print("Index loaded from file.")
                 index_id = os.path.basename(fpath).split(".")[0]
                 self.index_id = index_id
                 self.index_path = fpath
-                return index
+                return IndexStore(fpath, index_options=self.get_index_options())
             else:
                 print(f"Index at {fpath} does not exist.")
                 print("Initializing empty index.")
-        self.index_id = random_6_digit_id()
+        self.index_id = new_index_id()
         self.index_path = self.get_index_path(self.index_id)
-        index = []
+        store = IndexStore(self.index_path, index_options=self.get_index_options())
         # save empty index
-        with open(self.index_path, "wb") as f:
-            pickle.dump(index, f)
+        store.checkpoint()
         print("Empty Index initialized.")
-        return self
+        return store
+
+    def get_index_options(self):
+        return {"metric": self.config.get("metric", "cosine"), "dtype": self.config.get("vector_dtype", "float32")}
+
+    @property
+    def index(self):
+        return self.index_store.index
 
     def sync_index(self):
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index, f)
+        # every change is already in the write-ahead log, this folds the log into a fresh checkpoint
+        self.index_store.checkpoint()
         print("Index synced locally.")
         return self
 
     def load_index(self):
-        with open(self.index_path, "rb") as f:
-            index = pickle.load(f)
-        self.index = index
+        self.index_store.close()
+        self.index_store = IndexStore(self.index_path, index_options=self.get_index_options())
         self.index_id = os.path.basename(self.index_path).split(".")[0]
         self.index_path = self.get_index_path(self.index_id)
         print("Index loaded from file.")
         return self
 
     def add_document_to_index(self, fpath: str):
-        data = Document(fpath).process().to_dict()
-        self.index.append(data)
-        self.sync_index()
+        document = Document(fpath)
+        # ids are content hashes, so a file that's already indexed (by any worker) is skipped before paying to
+        # embed it again
+        self.index_store.refresh()
+        if document.id in self.index:
+            print(f"Document already in index: {fpath}")
+            return self
+        data = document.process().to_dict()
+        self.index_store.add_document(data)
         print(f"Document added to index: {fpath}")
         return self
 
-    # ! Semantic Search =========================================================
+    def upsert_document_in_index(self, fpath: str):
+        """
+        Add a file, replacing the previously indexed version of it (matched by path).
+        """
+        document = Document(fpath)
+        if not self.index_store.upsert_document(document.process().to_dict()):
+            print(f"Document unchanged: {fpath}")
+            return self
+        print(f"Document updated in index: {fpath}")
+        return self
 
-    def get_top_k(self, text, top_k=5):
-        embedding = embed_ada(text)
-        results = []
-        for doc_dict in self.index:
-            for chunk_dict in doc_dict["data"]:
-                similarity = np.dot(embedding, chunk_dict["embedding"])
-                chunk_dict["similarity"] = similarity
-                results.append({
-                    "id": chunk_dict["id"],
-                    "text": chunk_dict["text"],
-                    "similarity": similarity
-                })
-        results = sorted(results, key=lambda x: x["similarity"], reverse=True)
-        return results[:top_k]
+    def delete_document_from_index(self, doc_id):
+        if not self.index_store.delete_document(doc_id):
+            print(f"Document {doc_id} not in index.")
+            return self
+        print(f"Document deleted from index: {doc_id}")
+        return self
 
-    # ! RUN =====================================================================
+    # ! Semantic Search =========================================================
 
-    def run(self):
-        print("Running...")
-        print("Generating Tasks...")
-        self.generate_tasks()
+    def get_top_k(self, text, top_k=5, deadline=None):
+        """
+        :param deadline: float, time.monotonic() by which results are needed, the re-ranker is skipped if it can't
+            finish by then
+        """
+        num_candidates = max(top_k, self.config.get("rerank_candidates", 20)) if self.reranker else top_k
+        with span("search", kind="semantic", top_k=top_k):
+            embedding = embed_ada(text)
+            with SEARCH_LATENCY.time(kind="semantic"):
+                results = self.index.search(embedding, top_k=num_candidates)
+            if self.reranker:
+                results = self.reranker.rerank(text, results, top_k=top_k, deadline=deadline)
+        return results
+
+    # ! Context ================================================================
+
+    def build_context(self, task):
+        """
+        Assemble the memory, retrieved chunks and examples for a task within the model's token budget.
+        """
+        chunks = []
+        if self.index:
+            budget = self.config.get("rerank_budget")
+            deadline = time.monotonic() + budget if budget is not None else None
+            chunks = [result["text"] for result in self.get_top_k(task['instruction'], deadline=deadline)]
+        examples = random.sample(REACT_EXAMPLES, len(REACT_EXAMPLES))
+        return self.context.build(self.working_memory, chunks=chunks, examples=examples)
 
-        # While objective is not completed
-        for task in self.task_list:
-            # eval - are we done?
-            if self.evaluate_objective():
-                print("Objective Completed!")
-                break
+    # ! RUN =====================================================================
 
-            # debug so we can see what's going on
-            print(f"Task: {task['name']}")
-            print(f"Description: {task['description']}")
+    def build_prompt(self, task):
+        # pack memory, retrieved chunks and examples into the model's token budget
+        context = self.build_context(task)
+        memory_string = "\n\n".join(context["memory"])
+        chunks_string = "\n\n".join(context["chunks"])
+        examples_string = "\n\n".join(context["examples"])
 
-            # create prompt
-            prompt = f"""
+        prompt = f"""
             OBJECTIVE: {self.objective}
             TASK: {task['name']}
-            TASK DESCRIPTION: {task['description']}
+            TASK DESCRIPTION: {task['instruction']}
             TOOLS NEEDED: {task['tools_needed']}
 
-            CONTEXT: {self.working_memory}
+            CONTEXT: {memory_string}
+
+            RELEVANT DOCUMENTS: {chunks_string}
 
             EXAMPLE OUTPUT: 
-            {random.sample(REACT_EXAMPLES, 3)}
+            {examples_string}
 
             YOUR OUTPUT:
             """
-            chat = Chat(model='gpt-3.5-turbo', max_tokens=1000)
-            res = chat(prompt)['response'].strip()
+        return prompt
 
-            # TODO parser goes here 
-            # tools: search, code_execute
-            # TODO update REACT_EXAMPLES to use my syntax
+    async def run_task_async(self, task, stop=None):
+        """
+        :param stop: threading.Event, once it's set the task's ReAct loop returns at its next step
+        """
+        # debug so we can see what's going on
+        print(f"Task: {task['name']}")
+        print(f"Description: {task['instruction']}")
+
+        # building the context can embed and summarize, so keep it off the event loop
+        prompt = await asyncio.to_thread(self.build_prompt, task)
+
+        # stream the ReAct loop, dispatching tools as soon as an action arrives
+        result = await asyncio.to_thread(self.get_runtime().run, prompt, stop)
+        self.token_counter += result['tokens']
+        res = result['answer'] or ""
+        self.code_executions += [step for step in result['steps'] if step['tool'].lower() == 'code']
 
-            # take any action needed
-            # add all results to working memory
-            # TODO create working memory with recursive summarization once we exceed a token limit
-            # potentially embed working memory into a separate index?? using the exact same methods as the main index? or store working memory and data in the same index as separate data structures?
\ No newline at end of file
+        # add all results to working memory (compacted into summaries by self.context once it gets too big)
+        self.working_memory.append(f"TASK: {task['name']}\n{result['transcript']}\nRESULT: {res}")
+        # potentially embed working memory into a separate index?? using the exact same methods as the main index? or store working memory and data in the same index as separate data structures?
+        return res
+
+    async def run_async(self):
+        """
+        Run the task list as a dependency DAG, executing independent tasks concurrently. Tasks start as soon as they
+        are parsed from the streamed task list.
+
+        The objective is evaluated after every `eval_every` completed tasks, in parallel with the tasks that are
+        still running, instead of blocking before each task. Once it's met (or a task fails) task generation and the
+        running tasks are stopped, and their threads are waited for before returning.
+        """
+        print("Running...")
+        start_time = time.perf_counter()
+        self.token_counter = 0
+        summary_tokens_start = self.context.summary_tokens
+
+        print("Generating Tasks...")
+        graph = TaskGraph()
+        self.task_list = []
+        eval_every = self.config.get("eval_every", 1)
+        max_concurrency = self.config.get("max_concurrency", 4)
+
+        # stream the task list in a thread so tasks can start as soon as they are parsed
+        loop = asyncio.get_running_loop()
+        task_queue = asyncio.Queue()
+        # threads can't be cancelled, the producer and the tasks' ReAct loops check this between chunks and steps
+        stop = threading.Event()
+
+        def produce_tasks():
+            tasks = self.iter_tasks(stop=stop)
+            try:
+                for task in tasks:
+                    loop.call_soon_threadsafe(task_queue.put_nowait, task)
+            finally:
+                tasks.close()
+                loop.call_soon_threadsafe(task_queue.put_nowait, None)
+
+        producer = asyncio.create_task(asyncio.to_thread(produce_tasks))
+        next_task = asyncio.create_task(task_queue.get())
+        generating = True
+
+        done, started = set(), set()
+        running = {}  # asyncio task -> task name
+        evaluation = None
+        completed = False
+        since_eval = 0
+
+        try:
+            while (generating or len(done) < len(graph)) and not completed:
+                for task in graph.ready(done, started):
+                    if len(running) >= max_concurrency:
+                        break
+                    started.add(task['name'])
+                    running[asyncio.create_task(self.run_task_async(task, stop))] = task['name']
+
+                waiting = set(running)
+                if evaluation is not None:
+                    waiting.add(evaluation)
+                if generating:
+                    waiting.add(next_task)
+                finished, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                for future in finished:
+                    if future is next_task:
+                        task = future.result()
+                        if task is None:
+                            generating = False
+                            graph.finish()  # release tasks waiting on dependencies that were never generated
+                            await producer  # raise any error from task generation
+                        else:
+                            self.task_list.append(graph.add(task))
+                            next_task = asyncio.create_task(task_queue.get())
+                        continue
+                    if future is evaluation:
+                        evaluation = None
+                        completed = future.result()
+                        continue
+                    future.result()  # raise any error from the task
+                    done.add(running.pop(future))
+                    since_eval += 1
+
+                if eval_every and since_eval >= eval_every and evaluation is None and not completed and (generating or len(done) < len(graph)):
+                    since_eval = 0
+                    evaluation = asyncio.create_task(self.evaluate_objective_async())
+        finally:
+            stop.set()
+            if evaluation is not None:
+                evaluation.cancel()
+            if generating:
+                next_task.cancel()
+            # running tasks return at their next step, wait for them (and the producer) so no thread outlives the run
+            outstanding = [*running, producer] + ([evaluation] if evaluation is not None else [])
+            await asyncio.gather(*outstanding, return_exceptions=True)
+
+        if completed:
+            print("Objective Completed!")
+
+        elapsed = time.perf_counter() - start_time
+        self.run_stats = {
+            "objective": self.objective,
+            "elapsed": elapsed,
+            "tokens": self.token_counter,
+            "summary_tokens": self.context.summary_tokens - summary_tokens_start,
+            "tasks_completed": len(done),
+            "tasks_total": len(graph),
+        }
+        print(f"Objective finished in {elapsed:0.2f} seconds. Tokens used: {self.token_counter} (+{self.run_stats['summary_tokens']} summarizing memory).")
+        return self.run_stats
+
+    def run(self):
+        return asyncio.run(self.run_async())
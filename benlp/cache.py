@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import record_cache
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "benlp")
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Hash any JSON-serializable parts into a stable cache key. Dict keys are sorted so param order doesn't matter.
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    A simple JSON file cache with a time-to-live. One file per key, written atomically.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None, name: str = "disk"):
+        """
+        :param path: str, the cache directory
+        :param ttl: float, seconds before an entry expires (None to never expire)
+        :param name: str, the cache label used in metrics
+        """
+        self.path = path
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        fpath = self.get_path(key)
+        try:
+            with open(fpath, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            record_cache(self.name, False)
+            return None
+
+        if self.ttl is not None and time.time() - entry["time"] > self.ttl:
+            self.misses += 1
+            record_cache(self.name, False)
+            return None
+        self.hits += 1
+        record_cache(self.name, True)
+        return entry["data"]
+
+    def set(self, key: str, data: Any) -> None:
+        fpath = self.get_path(key)
+        tmp_path = f"{fpath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"time": time.time(), "data": data}, f)
+        os.replace(tmp_path, fpath)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self) -> None:
+        for fname in os.listdir(self.path):
+            if fname.endswith(".json"):
+                os.remove(os.path.join(self.path, fname))
+
+
+class Coalescer:
+    """
+    Coalesces concurrent identical calls: the first caller for a key does the work and everyone else waiting on the
+    same key gets its result (or its exception).
+    """
+
+    def __init__(self):
+        self.inflight: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+
+    def run(self, key: str, function: Callable[[], Any]) -> Any:
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[key] = future
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = function()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
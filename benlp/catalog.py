@@ -0,0 +1,157 @@
+import hashlib
+import secrets
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 16 hex chars = 64 bits, a collision is unlikely before ~4 billion documents (random 6 digit ids collide after ~1000)
+ID_LENGTH = 16
+READ_BUFFER_SIZE = 1 << 20
+
+# ! IDs =======================================================================
+
+
+def content_hash(content) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()[:ID_LENGTH]
+
+
+def file_hash(fpath: str) -> str:
+    """
+    Hash a file's contents in 1MB reads, so big files are never fully in memory.
+    """
+    digest = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(READ_BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()[:ID_LENGTH]
+
+
+def chunk_id(doc_id: str, position: int) -> str:
+    # positions are 1-based, like the ids the index has always used
+    return f"{doc_id}-{position + 1}"
+
+
+def new_index_id() -> str:
+    # an index has no content to hash when it's created, so it gets a random id of the same size
+    return secrets.token_hex(ID_LENGTH // 2)
+
+# ! Catalog ===================================================================
+
+
+class Catalog:
+    """
+    Per-document metadata in a columnar table (one list or typed array per field, one row per document), plus a
+    chunk table mapping every chunk id to its document row and position in O(1).
+
+    Documents are identified by a hash of their contents, so the same file added twice (under any path) has the
+    same id and is only stored once.
+    """
+
+    def __init__(self):
+        self.doc_ids: List[str] = []
+        self.doc_rows: Dict[str, int] = {}
+        self.fpath: List[str] = []
+        self.fname: List[str] = []
+        self.ext: List[str] = []
+        self.metadata: List = []
+        self.num_chunks = array("I")
+        self.first_chunk = array("Q")  # row of the document's first chunk in the chunk table
+        self.added = array("d")
+
+        self.chunk_ids: List[str] = []
+        self.chunk_rows: Dict[str, int] = {}
+        self.chunk_doc = array("I")  # chunk row -> document row
+        self.chunk_position = array("I")
+
+    def __len__(self) -> int:
+        return len(self.doc_rows)
+
+    def __contains__(self, doc_id) -> bool:
+        return str(doc_id) in self.doc_rows
+
+    def add(self, doc_dict: Dict, added: Optional[float] = None) -> int:
+        """
+        Add a document (as returned by Document.to_dict), returning its row. A document already in the catalog
+        keeps its row.
+        """
+        doc_id = str(doc_dict["id"])
+        if doc_id in self.doc_rows:
+            return self.doc_rows[doc_id]
+
+        row = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        self.doc_rows[doc_id] = row
+        self.fpath.append(doc_dict.get("fpath"))
+        self.fname.append(doc_dict.get("fname"))
+        self.ext.append(doc_dict.get("ext"))
+        self.metadata.append(doc_dict.get("metadata"))
+        self.num_chunks.append(len(doc_dict["data"]))
+        self.first_chunk.append(len(self.chunk_ids))
+        self.added.append(time.time() if added is None else added)
+
+        for position, chunk in enumerate(doc_dict["data"]):
+            self.chunk_rows[str(chunk["id"])] = len(self.chunk_ids)
+            self.chunk_ids.append(str(chunk["id"]))
+            self.chunk_doc.append(row)
+            self.chunk_position.append(position)
+        return row
+
+    def get(self, doc_id) -> Optional[Dict]:
+        row = self.doc_rows.get(str(doc_id))
+        if row is None:
+            return None
+        return {
+            "id": self.doc_ids[row],
+            "fpath": self.fpath[row],
+            "fname": self.fname[row],
+            "ext": self.ext[row],
+            "metadata": self.metadata[row],
+            "num_chunks": self.num_chunks[row],
+            "added": self.added[row],
+        }
+
+    def locate(self, chunk_id) -> Tuple[str, int]:
+        """
+        :return: tuple, (document id, 0-based position of the chunk in the document)
+        :raises KeyError: if the chunk isn't in the catalog
+        """
+        row = self.chunk_rows[str(chunk_id)]
+        return self.doc_ids[self.chunk_doc[row]], self.chunk_position[row]
+
+    def chunk_range(self, doc_id) -> range:
+        # rows of a document's chunks in the chunk table, they are always contiguous
+        row = self.doc_rows[str(doc_id)]
+        start = self.first_chunk[row]
+        return range(start, start + self.num_chunks[row])
+
+    def remove(self, doc_id) -> bool:
+        """
+        Drop a document and its chunks from the lookups. Its row stays in the columns until compacted().
+        """
+        doc_id = str(doc_id)
+        if doc_id not in self.doc_rows:
+            return False
+        for row in self.chunk_range(doc_id):
+            self.chunk_rows.pop(self.chunk_ids[row], None)
+        del self.doc_rows[doc_id]
+        return True
+
+    def compacted(self) -> "Catalog":
+        """
+        A copy without the removed rows.
+        """
+        catalog = Catalog()
+        for doc_id, row in sorted(self.doc_rows.items(), key=lambda item: item[1]):
+            doc_dict = self.get(doc_id)
+            doc_dict["data"] = [{"id": self.chunk_ids[chunk_row]} for chunk_row in self.chunk_range(doc_id)]
+            catalog.add(doc_dict, added=self.added[row])
+        return catalog
+
+    @classmethod
+    def from_index(cls, index: Iterable[Dict]) -> "Catalog":
+        catalog = cls()
+        for doc_dict in index:
+            catalog.add(doc_dict)
+        return catalog
@@ -0,0 +1,177 @@
+import hashlib
+from typing import Dict, List, Optional
+
+from .utils import TokenUtil
+from .llms import Chat
+from .metrics import record_cache
+
+# ! Model Limits ==============================================================
+
+MODEL_CONTEXT_LIMITS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-3.5-turbo-0613": 4096,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-3.5-turbo-16k-0613": 16384,
+    "gpt-4": 8192,
+    "gpt-4-0613": 8192,
+    "gpt-4-32k": 32768,
+    "text-davinci-003": 4097,
+}
+
+
+def get_context_limit(model: str, default: int = 4096) -> int:
+    """
+    Return the context window size (in tokens) for the given model.
+    """
+    return MODEL_CONTEXT_LIMITS.get(model, default)
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+SUMMARY_PROMPT = """Summarize the following agent memory as concisely as possible. Keep every fact, number, name, tool result and decision that could matter for the objective. Drop pleasantries and repetition.
+
+MEMORY:
+{text}
+
+SUMMARY:"""
+
+
+class AgentContext:
+    """
+    Packs retrieved chunks, working memory and examples into a per-model token budget.
+
+    Older memory is compacted into summaries once it crosses a fraction of the memory budget. Summaries are cached by
+    content hash, so each memory item (or group of summaries) is only ever sent to the summarizer once.
+    """
+
+    def __init__(self, model="gpt-3.5-turbo", max_tokens=None, reserve_tokens=1200, shares=None,
+                 compaction_threshold=0.75, keep_recent=3, summary_model="gpt-3.5-turbo", summary_max_tokens=256):
+        """
+        :param model: str, the model the assembled prompt will be sent to (used for the token limit and the tokenizer)
+        :param max_tokens: int, the total prompt budget, defaults to the model's context limit minus reserve_tokens
+        :param reserve_tokens: int, tokens kept free for the instructions and the model's response
+        :param shares: dict, fraction of the budget for "memory", "chunks" and "examples" (unused share rolls over)
+        :param compaction_threshold: float, fraction of the memory budget above which older memory is summarized
+        :param keep_recent: int, number of most recent memory items that are never summarized
+        :param summary_model: str, the model used to summarize memory
+        :param summary_max_tokens: int, max tokens for each summary
+        """
+        self.model = model
+        self.token_util = TokenUtil(model)
+        self.max_tokens = max_tokens if max_tokens is not None else get_context_limit(model) - reserve_tokens
+        self.shares = shares or {"memory": 0.45, "chunks": 0.4, "examples": 0.15}
+        self.compaction_threshold = compaction_threshold
+        self.keep_recent = keep_recent
+        self.summary_model = summary_model
+        self.summary_max_tokens = summary_max_tokens
+
+        self.summaries: Dict[str, str] = {}  # content hash -> summary
+        self.token_counts: Dict[str, int] = {}  # content hash -> num tokens
+        self.summary_tokens = 0  # tokens spent on summarization
+
+    # ! Token counting =========================================================
+
+    def count(self, text: str) -> int:
+        key = hash_text(text)
+        if key not in self.token_counts:
+            self.token_counts[key] = self.token_util.get_tokens(text)
+        return self.token_counts[key]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.token_util.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.token_util.decode(tokens[:max_tokens])
+
+    # ! Summarization ==========================================================
+
+    def summarize(self, text: str) -> str:
+        """
+        Summarize a piece of memory, returning the cached summary if it has been summarized before.
+        """
+        key = hash_text(text)
+        record_cache("summaries", key in self.summaries)
+        if key in self.summaries:
+            return self.summaries[key]
+
+        chat = Chat(model=self.summary_model, max_tokens=self.summary_max_tokens, temperature=0)
+        res = chat(SUMMARY_PROMPT.format(text=text))
+        summary = res["response"]
+        self.summary_tokens += res["tokens"]
+
+        self.summaries[key] = summary
+        # a summary is its own summary, so it is never re-summarized
+        self.summaries[hash_text(summary)] = summary
+        return summary
+
+    def compact_memory(self, memory: List[str], budget: Optional[int] = None) -> List[str]:
+        """
+        Return a view of memory that fits the memory budget.
+
+        Recent items are kept verbatim. Older items are replaced by their (cached) summaries, and if the summaries
+        still don't fit they are recursively merged into a single summary.
+        """
+        budget = budget if budget is not None else int(self.max_tokens * self.shares["memory"])
+        if sum(self.count(item) for item in memory) <= budget * self.compaction_threshold:
+            return list(memory)
+
+        recent = list(memory[-self.keep_recent:]) if self.keep_recent else []
+        older = list(memory[:len(memory) - len(recent)])
+        recent_tokens = sum(self.count(item) for item in recent)
+        older_budget = max(budget - recent_tokens, 0)
+
+        compacted = [self.summarize(item) for item in older]
+        while len(compacted) > 1 and sum(self.count(item) for item in compacted) > older_budget:
+            # merge summaries pairwise so each merge prompt stays small
+            compacted = [self.summarize("\n\n".join(compacted[i:i + 2])) for i in range(0, len(compacted), 2)]
+
+        return compacted + recent
+
+    # ! Packing ================================================================
+
+    def pack(self, items: List[str], budget: int) -> List[str]:
+        """
+        Greedily take items in order until the budget is used up. The item that crosses the budget is truncated.
+        """
+        packed = []
+        used = 0
+        for item in items:
+            n = self.count(item)
+            if used + n > budget:
+                remaining = budget - used
+                if remaining > 50:
+                    packed.append(self.truncate(item, remaining))
+                break
+            packed.append(item)
+            used += n
+        return packed
+
+    def build(self, memory: List[str], chunks: List[str] = None, examples: List[str] = None) -> Dict[str, List[str]]:
+        """
+        Assemble the context sections for a prompt.
+
+        :param memory: list, the agent's working memory, oldest first
+        :param chunks: list, retrieved text chunks, most relevant first
+        :param examples: list, few-shot examples, most preferred first
+        :return: dict, with keys "memory", "chunks" and "examples", each a list of strings that fit the budget
+        """
+        chunks = chunks or []
+        examples = examples or []
+        carry = 0
+
+        memory_budget = int(self.max_tokens * self.shares["memory"])
+        memory = self.compact_memory(memory, memory_budget)
+        # keep the newest memory when packing
+        packed_memory = list(reversed(self.pack(list(reversed(memory)), memory_budget)))
+        carry += memory_budget - sum(self.count(item) for item in packed_memory)
+
+        chunks_budget = int(self.max_tokens * self.shares["chunks"]) + carry
+        packed_chunks = self.pack(chunks, chunks_budget)
+        carry = chunks_budget - sum(self.count(item) for item in packed_chunks)
+
+        examples_budget = int(self.max_tokens * self.shares["examples"]) + carry
+        packed_examples = self.pack(examples, examples_budget)
+
+        return {"memory": packed_memory, "chunks": packed_chunks, "examples": packed_examples}
@@ -0,0 +1,265 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterator, List
+
+from .context import get_context_limit
+from .llms import ChatServer, stream_text
+from .utils import TokenUtil
+
+# ! Prompts ===================================================================
+
+DOC_INSTRUCTIONS = """Write detailed documentation explaining how the code below works.
+
+FORMATTING:
+
+- Use markdown to format your response.
+- Use the following markdown to indicate code blocks: ```code```
+- Use the following markdown to indicate code blocks with a language: ```python
+- rewrite the code, then write your docs
+
+EXAMPLE OUTPUT:
+
+```python
+def add(a, b):
+    return a + b
+```
+
+This function adds two numbers together.
+
+```python
+add(1, 2)
+```
+
+Here we call the function with 1 and 2 as arguments, which returns 3.
+
+..."""
+
+MAP_PROMPT = """INSTRUCTIONS: {instructions}
+
+This is part {part} of {total} of a notebook. Document only the code in this part, the parts are merged afterwards.
+
+SOURCE CODE:
+{source}
+
+OUTPUT:
+"""
+
+REDUCE_PROMPT = """Below is markdown documentation written separately for consecutive parts of the same notebook. Merge it into one coherent document: start with a short overview, keep every code block and explanation in order, and remove repeated introductions and duplicate explanations.
+
+{sections}
+
+OUTPUT:
+"""
+
+SYSTEM_MESSAGE = "You are a helpful assistant."
+
+# ! Batching ==================================================================
+
+
+def split_source(source: str, token_util: TokenUtil, max_tokens: int) -> List[str]:
+    """
+    Split a cell that is bigger than the batch budget on line boundaries.
+    """
+    if token_util.get_tokens(source) <= max_tokens:
+        return [source]
+    pieces, current, current_tokens = [], [], 0
+    for line in source.splitlines(keepends=True):
+        tokens = token_util.get_tokens(line)
+        if current and current_tokens + tokens > max_tokens:
+            pieces.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += tokens
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def batch_cells(sources: List[str], token_util: TokenUtil, max_tokens: int) -> List[List[str]]:
+    """
+    Group consecutive cell sources into batches of at most max_tokens, keeping notebook order.
+    """
+    batches, current, current_tokens = [], [], 0
+    for source in sources:
+        if not source.strip():
+            continue
+        for piece in split_source(source, token_util, max_tokens):
+            tokens = token_util.get_tokens(piece)
+            if current and current_tokens + tokens > max_tokens:
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def format_batch(batch: List[str]) -> str:
+    return "\n\n".join(f"```python\n{source}\n```" for source in batch)
+
+# ! Documenter ================================================================
+
+
+class NotebookDocumenter:
+    """
+    Map-reduce documentation for notebooks (or any list of code blocks) too big for one prompt.
+
+    Cells are grouped into token-budgeted batches and each batch is documented concurrently (map). The section docs
+    are then merged by one streamed call (reduce), merging in rounds first if they don't fit one context window.
+    A notebook that fits in one batch skips the reduce and streams its single call directly.
+    """
+
+    def __init__(self, model="gpt-3.5-turbo-16k", instructions=DOC_INSTRUCTIONS, batch_tokens=None,
+                 map_max_tokens=None, reduce_max_tokens=None, temperature=0.7, max_concurrency=8,
+                 api_key=os.getenv("OPENAI_API_KEY")):
+        """
+        The token budgets default to a share of the model's context window, capped at what a 16k model gets, so on a
+        16k model a notebook that fits one batch is documented with the same 2048 token output as a single call.
+
+        :param model: str, the chat model to use
+        :param instructions: str, the documentation instructions
+        :param batch_tokens: int, max source tokens per map call (default: a quarter of the context, at most 4000)
+        :param map_max_tokens: int, max tokens generated per batch (default: a quarter of the context, at most 2048)
+        :param reduce_max_tokens: int, max tokens generated by the merge (default: half the context, at most 4000)
+        :param temperature: float, sampling temperature
+        :param max_concurrency: int, max map calls in flight
+        :raises ValueError: if the budgets don't fit the model's context window
+        """
+        context_limit = get_context_limit(model)
+        self.model = model
+        self.instructions = instructions
+        self.batch_tokens = batch_tokens or min(4000, context_limit // 4)
+        self.map_max_tokens = map_max_tokens or min(2048, context_limit // 4)
+        self.reduce_max_tokens = reduce_max_tokens or min(4000, context_limit // 2)
+        self.temperature = temperature
+        self.max_concurrency = max_concurrency
+        self.token_util = TokenUtil(model)
+        self.chat = ChatServer(api_key=api_key)
+
+        map_overhead = self.token_util.get_tokens(MAP_PROMPT + instructions + SYSTEM_MESSAGE) + 100
+        if self.batch_tokens + self.map_max_tokens + map_overhead > context_limit:
+            raise ValueError(f"batch_tokens ({self.batch_tokens}) plus map_max_tokens ({self.map_max_tokens}) don't "
+                             f"fit the {context_limit} token context of {model} with the prompt")
+        # what the merge prompt can hold besides the section docs, at least one full section
+        overhead = self.token_util.get_tokens(REDUCE_PROMPT + SYSTEM_MESSAGE) + 100
+        self.reduce_input_tokens = context_limit - self.reduce_max_tokens - overhead
+        if self.reduce_input_tokens < self.map_max_tokens:
+            raise ValueError(f"reduce_max_tokens ({self.reduce_max_tokens}) leaves {self.reduce_input_tokens} tokens "
+                             f"of the {context_limit} token context of {model} for the sections to merge, "
+                             f"less than one section (map_max_tokens={self.map_max_tokens})")
+
+    def config(self) -> Dict:
+        # everything that changes the output, used in cache keys
+        return {"model": self.model, "instructions": self.instructions, "batch_tokens": self.batch_tokens,
+                "map_max_tokens": self.map_max_tokens, "reduce_max_tokens": self.reduce_max_tokens,
+                "temperature": self.temperature}
+
+    def get_messages(self, prompt: str) -> List[Dict]:
+        return [{"role": "system", "content": SYSTEM_MESSAGE}, {"role": "user", "content": prompt}]
+
+    def get_map_messages(self, sources: List[str]) -> List[List[Dict]]:
+        batches = batch_cells(sources, self.token_util, self.batch_tokens)
+        return [
+            self.get_messages(MAP_PROMPT.format(instructions=self.instructions, part=idx + 1, total=len(batches),
+                                                source=format_batch(batch)))
+            for idx, batch in enumerate(batches)
+        ]
+
+    def get_reduce_groups(self, sections: List[str], min_group_size=1) -> List[List[str]]:
+        """
+        Group consecutive section docs to fit the merge prompt. Merge rounds use min_group_size=2 so each round at
+        least halves the sections even when a group goes over the budget.
+        """
+        groups, current, current_tokens = [], [], 0
+        for section in sections:
+            tokens = self.token_util.get_tokens(section)
+            if len(current) >= min_group_size and current_tokens + tokens > self.reduce_input_tokens:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(section)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+
+    def get_reduce_messages(self, group: List[str]) -> List[Dict]:
+        return self.get_messages(REDUCE_PROMPT.format(sections="\n\n---\n\n".join(group)))
+
+    # ! Sync ==================================================================
+
+    def complete(self, messages: List[Dict], max_tokens: int) -> str:
+        raw_response = self.chat(messages, temperature=self.temperature, model=self.model, max_tokens=max_tokens,
+                                 stream=False)
+        return raw_response['choices'][0]['message']['content'].strip()
+
+    def parallel(self, messages_list: List[List[Dict]], max_tokens: int) -> List[str]:
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(lambda messages: self.complete(messages, max_tokens), messages_list))
+
+    def stream(self, sources: List[str]) -> Iterator[str]:
+        """
+        Document the sources, yielding the final markdown as it is generated.
+
+        :param sources: list, code cell sources in order
+        """
+        map_messages = self.get_map_messages(sources)
+        if not map_messages:
+            return
+        if len(map_messages) == 1:
+            final_messages, max_tokens = map_messages[0], self.map_max_tokens
+        else:
+            print(f"Documenting {len(map_messages)} batches...")
+            sections = self.parallel(map_messages, self.map_max_tokens)
+            groups = self.get_reduce_groups(sections)
+            while len(groups) > 1:
+                groups = self.get_reduce_groups(sections, min_group_size=2)
+                print(f"Merging {len(groups)} groups...")
+                sections = self.parallel([self.get_reduce_messages(group) for group in groups], self.reduce_max_tokens)
+                groups = self.get_reduce_groups(sections)
+            final_messages, max_tokens = self.get_reduce_messages(groups[0]), self.reduce_max_tokens
+
+        raw_response = self.chat(final_messages, temperature=self.temperature, model=self.model,
+                                 max_tokens=max_tokens, stream=True)
+        yield from stream_text(raw_response)
+
+    def document(self, sources: List[str]) -> str:
+        return "".join(self.stream(sources))
+
+    # ! Async =================================================================
+
+    async def acomplete(self, llm, messages: List[Dict], max_tokens: int, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            raw_response = await llm.create(messages, model=self.model, temperature=self.temperature,
+                                            max_tokens=max_tokens)
+        return raw_response['choices'][0]['message']['content'].strip()
+
+    async def aparallel(self, llm, messages_list: List[List[Dict]], max_tokens: int) -> List[str]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*(self.acomplete(llm, messages, max_tokens, semaphore) for messages in messages_list))
+
+    async def astream(self, llm, sources: List[str]) -> AsyncIterator[Dict]:
+        """
+        Async version of stream on a ChatClientAsync, yielding the raw chunks of the final streamed call.
+
+        :param llm: ChatClientAsync, the shared async client
+        """
+        map_messages = self.get_map_messages(sources)
+        if not map_messages:
+            return
+        if len(map_messages) == 1:
+            final_messages, max_tokens = map_messages[0], self.map_max_tokens
+        else:
+            sections = await self.aparallel(llm, map_messages, self.map_max_tokens)
+            groups = self.get_reduce_groups(sections)
+            while len(groups) > 1:
+                groups = self.get_reduce_groups(sections, min_group_size=2)
+                sections = await self.aparallel(llm, [self.get_reduce_messages(group) for group in groups],
+                                                self.reduce_max_tokens)
+                groups = self.get_reduce_groups(sections)
+            final_messages, max_tokens = self.get_reduce_messages(groups[0]), self.reduce_max_tokens
+
+        async for item in llm.stream(final_messages, model=self.model, temperature=self.temperature,
+                                     max_tokens=max_tokens):
+            yield item
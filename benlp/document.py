@@ -3,6 +3,8 @@ import os
 from .loaders import create_loader
 from .utils import random_6_digit_id, DefaultSplitter, PythonSplitter, TikTokenSplitter
 from .llms import embed_ada_list
+from .catalog import file_hash, chunk_id
+from .notebook import parse_notebook
 
 class Document:
     """
@@ -15,6 +17,7 @@ class Document:
 
         :param fpath: str, the file path of the document
         """
+        self.id = None
         self.fpath = None
         self.ext = None
         self.fname = None
@@ -47,6 +50,8 @@ class Document:
             self.fpath = fpath
             self.ext = file_path.suffix
             self.fname = file_path.name
+            # a hash of the contents, so the same file always gets the same id
+            self.id = file_hash(fpath)
             print(f"Document at {fpath} loaded.")
 
     def parse(self):
@@ -145,16 +150,15 @@ class Document:
         if any([self.chunks, self.embeddings]) is None:
             self.process()
         
-        doc_id = random_6_digit_id()
         doc_dict = {
-            "id": doc_id,
+            "id": self.id,
             "fpath": self.fpath,
             "ext": self.ext,
             "fname": self.fname,
             "metadata": self.metadata,
             "data" : [
                 {
-                    "id": f"{doc_id}-{idx + 1}",
+                    "id": chunk_id(self.id, idx),
                     "text": chunk,
                     "embedding": self.embeddings[idx],
                 } for idx, chunk in enumerate(self.chunks)
@@ -164,23 +168,19 @@ class Document:
         return doc_dict
     
 class JupyterSimple:
-    def __init__(self, fpath):
+    def __init__(self, fpath, strip_images=True):
+        """
+        :param fpath: str, the notebook path
+        :param strip_images: bool, drop base64 image outputs while parsing
+        """
         self.fpath = fpath
-
-        self.read_file(fpath)
+        self.strip_images = strip_images
+        self.docs = None
         self.parse_cells()
 
-    def read_file(self, fpath):
-        with open(fpath, "r") as f:
-            code = f.read()
-        self.code = code
-
     def parse_cells(self):
-        # replace null with empty string to avoid errors
-        self.code = self.code.replace('null', '""')
-
-        # parse the cells
-        cells = eval(self.code)['cells']
+        # streams the notebook from disk, sources are joined into strings
+        cells = parse_notebook(path=self.fpath, strip_images=self.strip_images)
         code_cells = [c for c in cells if c['cell_type'] == 'code']
         markdown_cells = [c for c in cells if c['cell_type'] == 'markdown']
 
@@ -227,24 +227,35 @@ class JupyterSimple:
         self.final_prompt = final_prompt
         return final_prompt
 
-    def document(self, prompt=None, model='gpt-3.5-turbo-16k-0613'):
+    def stream_docs(self, prompt=None, model='gpt-3.5-turbo-16k-0613'):
+        """
+        Generate the docs map-reduce style: cells are documented in token-budgeted batches concurrently, then merged.
+        Yields the merged markdown as it streams, self.docs is set once it's done.
+        """
         try:
-            from benlp.llms import Chat
+            from benlp.docgen import NotebookDocumenter, DOC_INSTRUCTIONS
         except:
-            raise Exception("benlp must be installed to use the document function since it relies on an import from benlp.llms")
+            raise Exception("benlp must be installed to use the document function since it relies on an import from benlp.docgen")
 
-        print("Generating docs...")
+        documenter = NotebookDocumenter(model=model, instructions=prompt if prompt else DOC_INSTRUCTIONS)
+        parts = []
+        for chunk in documenter.stream([c['source'] for c in self.code_cells]):
+            parts.append(chunk)
+            yield chunk
+        self.docs = "".join(parts)
 
-        self.create_prompt(prompt)
-        
-        chat = Chat(model=model, max_tokens=2048)
-        docs = chat(self.final_prompt)['response']
+    def document(self, prompt=None, model='gpt-3.5-turbo-16k-0613'):
+        print("Generating docs...")
+        for _ in self.stream_docs(prompt, model):
+            pass
         print("Complete.")
-        self.docs = docs
         return self
     
-    def export(self):
-        if self.docs is None:
+    def export(self, chunks=None):
+        """
+        :param chunks: iterable, optional streamed docs (e.g. stream_docs()) written to the file as they arrive
+        """
+        if chunks is None and self.docs is None:
             raise Exception("You must run the document method first. with obj.document()")
         
         print("Exporting docs...")
@@ -254,27 +265,33 @@ class JupyterSimple:
         new_file_name = f"{file_name}_docs_{random_6_digit_id()}.md"
         write_fpath = os.path.join(os.path.dirname(fpath), new_file_name)
         with open(write_fpath, 'w') as f:
-            f.write(self.docs)
+            if chunks is None:
+                f.write(self.docs)
+            else:
+                for chunk in chunks:
+                    f.write(chunk)
+                    f.flush()
 
         print(f"Docs exported to {write_fpath}")
 
     def run(self):
         print("Running...")
-        self.document()
-        self.export()
+        self.export(self.stream_docs())
         print("Complete.")
 
 class JupyterSimpleServer:
-    def __init__(self, file_contents):
-        self.code = file_contents
+    def __init__(self, file_contents, strip_images=True):
+        """
+        :param file_contents: bytes, str or file, the uploaded notebook's contents (never read as a path)
+        :param strip_images: bool, drop base64 image outputs while parsing
+        """
+        self.file_contents = file_contents
+        self.strip_images = strip_images
+        self.docs = None
         self.parse_cells()
 
     def parse_cells(self):
-        # replace null with empty string to avoid errors
-        self.code = self.code.replace('null', '""')
-
-        # parse the cells
-        cells = eval(self.code)['cells']
+        cells = parse_notebook(contents=self.file_contents, strip_images=self.strip_images)
         code_cells = [c for c in cells if c['cell_type'] == 'code']
         markdown_cells = [c for c in cells if c['cell_type'] == 'markdown']
 
@@ -321,20 +338,28 @@ class JupyterSimpleServer:
         self.final_prompt = final_prompt
         return final_prompt
 
-    def document(self, prompt=None, model='gpt-3.5-turbo-16k-0613'):
+    def stream_docs(self, prompt=None, model='gpt-3.5-turbo-16k-0613'):
+        """
+        Generate the docs map-reduce style: cells are documented in token-budgeted batches concurrently, then merged.
+        Yields the merged markdown as it streams, self.docs is set once it's done.
+        """
         try:
-            from benlp.llms import Chat
+            from benlp.docgen import NotebookDocumenter, DOC_INSTRUCTIONS
         except:
-            raise Exception("benlp must be installed to use the document function since it relies on an import from benlp.llms")
+            raise Exception("benlp must be installed to use the document function since it relies on an import from benlp.docgen")
 
-        print("Generating docs...")
+        documenter = NotebookDocumenter(model=model, instructions=prompt if prompt else DOC_INSTRUCTIONS)
+        parts = []
+        for chunk in documenter.stream([c['source'] for c in self.code_cells]):
+            parts.append(chunk)
+            yield chunk
+        self.docs = "".join(parts)
 
-        self.create_prompt(prompt)
-        
-        chat = Chat(model=model, max_tokens=2048)
-        docs = chat(self.final_prompt)['response']
+    def document(self, prompt=None, model='gpt-3.5-turbo-16k-0613'):
+        print("Generating docs...")
+        for _ in self.stream_docs(prompt, model):
+            pass
         print("Complete.")
-        self.docs = docs
         return self
     
     def export(self):
@@ -0,0 +1,327 @@
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .catalog import Catalog
+from .similarity import check_metric, merge_top_k, prepare, prepare_query, to_similarity, top_k_rows
+
+# ! Segments ==================================================================
+
+
+class Segment:
+    """
+    An immutable block of chunks (vectors, ids and texts) for one or more documents. Deleting a document only flips
+    its rows in the tombstone mask, the rows are dropped when segments are compacted.
+    """
+
+    def __init__(self, vectors: np.ndarray, chunk_ids: List[str], texts: List[str], spans: List[Tuple[str, int, int]],
+                 norms: Optional[np.ndarray] = None):
+        """
+        :param vectors: np.ndarray, (rows, dim) chunk embeddings, prepared for the index's metric and dtype
+        :param spans: list, (document id, start row, stop row) per document, a document's rows are contiguous
+        :param norms: np.ndarray, squared norms of the rows for the l2 metric
+        """
+        self.vectors = vectors
+        self.norms = norms
+        self.chunk_ids = chunk_ids
+        self.texts = texts
+        self.spans = spans
+        self.alive = np.ones(len(chunk_ids), dtype=bool)
+        self.dead = 0
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def kill(self, start: int, stop: int) -> None:
+        self.alive[start:stop] = False
+        self.dead += stop - start
+
+    @classmethod
+    def from_documents(cls, doc_dicts: Iterable[Dict], metric="cosine", dtype="float32") -> "Segment":
+        embeddings, chunk_ids, texts, spans = [], [], [], []
+        for doc_dict in doc_dicts:
+            start = len(chunk_ids)
+            for chunk in doc_dict["data"]:
+                embeddings.append(chunk["embedding"])
+                chunk_ids.append(str(chunk["id"]))
+                texts.append(chunk["text"])
+            spans.append((str(doc_dict["id"]), start, len(chunk_ids)))
+        vectors, norms = prepare(embeddings, metric, dtype) if embeddings else (np.zeros((0, 0)), None)
+        return cls(vectors, chunk_ids, texts, spans, norms)
+
+    @classmethod
+    def merge(cls, segments: Iterable["Segment"],
+              is_live: Optional[Callable[[str, "Segment"], bool]] = None) -> Tuple["Segment", List["Segment"]]:
+        """
+        Copy the live documents of segments into one new segment.
+
+        :param is_live: function(document id, segment) -> bool, defaults to checking the tombstone mask
+        :return: tuple, (the merged segment, the segment each of its spans came from)
+        """
+        blocks, norm_blocks, chunk_ids, texts, spans, origins = [], [], [], [], [], []
+        for segment in segments:
+            for doc_id, start, stop in segment.spans:
+                # documents are deleted whole, so a span is live if its first row is
+                live = is_live(doc_id, segment) if is_live is not None else stop == start or segment.alive[start]
+                if not live:
+                    continue
+                spans.append((doc_id, len(chunk_ids), len(chunk_ids) + stop - start))
+                origins.append(segment)
+                chunk_ids.extend(segment.chunk_ids[start:stop])
+                texts.extend(segment.texts[start:stop])
+                if stop > start:
+                    blocks.append(segment.vectors[start:stop])
+                    if segment.norms is not None:
+                        norm_blocks.append(segment.norms[start:stop])
+        vectors = np.concatenate(blocks) if blocks else np.zeros((0, 0))
+        norms = np.concatenate(norm_blocks) if norm_blocks else None
+        return cls(vectors, chunk_ids, texts, spans, norms), origins
+
+# ! Index =====================================================================
+
+
+class VectorIndex:
+    """
+    The agent's document index: chunk vectors in append-only segments plus a Catalog of the documents.
+
+    Adding a document appends a segment, deleting one tombstones its rows. Once tombstones pass compaction_threshold
+    of the rows (or there are more than max_segments segments) a background thread copies the live rows into a new
+    segment and swaps it in. Searches read whichever tuple of segments is current when they start and never take
+    the lock, so they stay consistent and don't wait while compaction runs.
+    """
+
+    def __init__(self, documents: Iterable[Dict] = (), compaction_threshold=0.25, max_segments=16, metric="cosine",
+                 dtype="float32"):
+        """
+        :param documents: iterable, document dicts (as returned by Document.to_dict) to load
+        :param compaction_threshold: float, fraction of tombstoned rows that triggers a compaction
+        :param max_segments: int, segment count that triggers merging the small ones
+        :param metric: str, cosine, dot or l2
+        :param dtype: str, vector storage type, float32, float64 or float16. float16 is storage only: it halves the
+            memory, but numpy has no float16 matmul, so blocks are upcast to float32 to be scored and searches are
+            several times slower than with float32
+        """
+        check_metric(metric, dtype)
+        self.metric = metric
+        self.dtype = dtype
+        self.compaction_threshold = compaction_threshold
+        self.max_segments = max_segments
+        self.catalog = Catalog()
+        self.segments: Tuple[Segment, ...] = ()
+        self.locations: Dict[str, Tuple[Segment, int, int]] = {}  # document id -> (segment, start, stop)
+        self.lock = threading.RLock()
+        self.compaction_thread: Optional[threading.Thread] = None
+
+        unique = []
+        for doc_dict in documents:
+            if str(doc_dict["id"]) not in self.catalog:
+                self.catalog.add(doc_dict)
+                unique.append(doc_dict)
+        if unique:
+            self.append_segment(Segment.from_documents(unique, metric, dtype))
+
+    def __len__(self) -> int:
+        return len(self.catalog)
+
+    def __contains__(self, doc_id) -> bool:
+        return str(doc_id) in self.locations
+
+    def __getstate__(self) -> Dict:
+        # the lock and compaction thread aren't picklable, and a pickled index is always compacted
+        self.wait_for_compaction()
+        with self.lock:
+            segments = self.segments
+            if any(segment.dead for segment in segments) or len(segments) > 1:
+                segments = (Segment.merge(segments, self.is_live)[0],)
+            return {"compaction_threshold": self.compaction_threshold, "max_segments": self.max_segments,
+                    "metric": self.metric, "dtype": self.dtype, "catalog": self.catalog.compacted(),
+                    "segments": segments}
+
+    def __setstate__(self, state: Dict) -> None:
+        # released indexes were pickled as lists of document dicts, IndexStore loads those through __init__
+        self.__init__(compaction_threshold=state["compaction_threshold"], max_segments=state["max_segments"],
+                      metric=state["metric"], dtype=state["dtype"])
+        self.catalog = state["catalog"]
+        for segment in state["segments"]:
+            self.append_segment(segment)
+
+    def is_live(self, doc_id: str, segment: Segment) -> bool:
+        location = self.locations.get(doc_id)
+        return location is not None and location[0] is segment
+
+    def append_segment(self, segment: Segment) -> None:
+        for doc_id, start, stop in segment.spans:
+            self.locations[doc_id] = (segment, start, stop)
+        self.segments = self.segments + (segment,)
+
+    # ! Mutations =============================================================
+
+    def add_document(self, doc_dict: Dict) -> bool:
+        """
+        :return: bool, False if a document with the same id is already in the index
+        """
+        with self.lock:
+            if str(doc_dict["id"]) in self.catalog:
+                return False
+            self.catalog.add(doc_dict)
+            self.append_segment(Segment.from_documents([doc_dict], self.metric, self.dtype))
+        self.maybe_compact()
+        return True
+
+    def delete_document(self, doc_id) -> bool:
+        """
+        Tombstone a document's chunks, they stop showing up in searches right away.
+
+        :return: bool, False if the document isn't in the index
+        """
+        with self.lock:
+            location = self.locations.pop(str(doc_id), None)
+            if location is None:
+                return False
+            segment, start, stop = location
+            segment.kill(start, stop)
+            self.catalog.remove(doc_id)
+        self.maybe_compact()
+        return True
+
+    def upsert_document(self, doc_dict: Dict) -> bool:
+        """
+        Add a document, replacing the one with the same file path (an edited file gets a new content hash id).
+
+        :return: bool, False if the same document was already indexed under the same path
+        """
+        doc_id = str(doc_dict["id"])
+        with self.lock:
+            if self.is_indexed_at(doc_dict):
+                return False
+            replaced = [other for other, row in self.catalog.doc_rows.items()
+                        if self.catalog.fpath[row] == doc_dict.get("fpath") or other == doc_id]
+            for other in replaced:
+                self.delete_document(other)
+            return self.add_document(doc_dict)
+
+    def is_indexed_at(self, doc_dict: Dict) -> bool:
+        """
+        :return: bool, True if the same document (same content hash id) is indexed under the same file path
+        """
+        current = self.catalog.get(doc_dict["id"])
+        return current is not None and current["fpath"] == doc_dict.get("fpath")
+
+    # ! Compaction ============================================================
+
+    def stats(self) -> Dict:
+        segments = self.segments
+        rows = sum(len(segment) for segment in segments)
+        dead = sum(segment.dead for segment in segments)
+        return {"documents": len(self), "segments": len(segments), "rows": rows, "tombstones": dead,
+                "compacting": self.compacting}
+
+    @property
+    def compacting(self) -> bool:
+        return self.compaction_thread is not None
+
+    def maybe_compact(self) -> None:
+        stats = self.stats()
+        if stats["compacting"]:
+            return
+        if stats["rows"] and stats["tombstones"] / stats["rows"] > self.compaction_threshold:
+            self.compact()
+        elif stats["segments"] > self.max_segments:
+            self.compact(merge_all=False)
+
+    def compact(self, merge_all=True, wait=False) -> None:
+        """
+        Rewrite segments without their tombstoned rows in a background thread.
+
+        :param merge_all: bool, merge every segment, otherwise only the segments after the first one, unless the
+            first is smaller than the rest together (so each row is copied O(log n) times as the index grows)
+        :param wait: bool, block until the compaction is done
+        """
+        if wait:
+            # a compaction that is already running may not cover everything asked for, let it finish first
+            self.wait_for_compaction()
+        with self.lock:
+            if self.compacting:
+                return
+            base = self.segments
+            start = 0
+            if not merge_all and len(base) > 1 and len(base[0]) >= sum(len(segment) for segment in base[1:]):
+                start = 1
+            self.compaction_thread = threading.Thread(target=self.run_compaction, args=(base, start), daemon=True,
+                                                      name="index-compaction")
+            self.compaction_thread.start()
+        if wait:
+            self.wait_for_compaction()
+
+    def wait_for_compaction(self) -> None:
+        # a compaction can start another one when it finishes, wait for that too
+        thread = self.compaction_thread
+        while thread is not None and thread is not threading.current_thread():
+            thread.join()
+            thread = self.compaction_thread
+
+    def run_compaction(self, base: Tuple[Segment, ...], start: int) -> None:
+        started = time.perf_counter()
+        try:
+            # copying runs without the lock, searches and writes carry on against the current segments
+            merged, origins = Segment.merge(base[start:], self.is_live)
+        except Exception:
+            self.compaction_thread = None
+            raise
+        with self.lock:
+            # documents deleted (or deleted and re-added) while merging are tombstoned in the merged segment too
+            for (doc_id, span_start, span_stop), origin in zip(merged.spans, origins):
+                location = self.locations.get(doc_id)
+                if location is not None and location[0] is origin:
+                    self.locations[doc_id] = (merged, span_start, span_stop)
+                else:
+                    merged.kill(span_start, span_stop)
+            # segments appended meanwhile are kept as they are
+            self.segments = self.segments[:start] + (merged,) + self.segments[len(base):]
+            self.catalog = self.catalog.compacted()
+            self.compaction_thread = None
+        print(f"Index compacted {len(base) - start} segments into {len(merged)} rows in "
+              f"{time.perf_counter() - started:.2f}s")
+        # deletes that came in while merging may have crossed the threshold again
+        self.maybe_compact()
+
+    # ! Search ================================================================
+
+    def search(self, embedding, top_k=5) -> List[Dict]:
+        """
+        The top_k chunks for the embedding by the index's metric (for l2 the similarity is the negated distance).
+
+        :return: list, dicts with the chunk id, text and similarity, best first
+        """
+        query = prepare_query(embedding, self.metric, self.dtype)
+        results = []
+        for segment in self.segments:
+            if len(segment) == 0 or segment.dead == len(segment):
+                continue
+            alive = segment.alive if segment.dead else None
+            results.append([(score, row, segment) for score, row in
+                            top_k_rows(segment.vectors, query, top_k, self.metric, segment.norms, alive)])
+        return [{"id": segment.chunk_ids[row], "text": segment.texts[row],
+                 "similarity": to_similarity(score, self.metric)}
+                for score, row, segment in merge_top_k(results, top_k)]
+
+    def documents(self) -> Iterator[Dict]:
+        """
+        The live documents as dicts, in the format Document.to_dict returns (with the stored, i.e. normalized for
+        cosine and possibly float16, embeddings).
+        """
+        catalog = self.catalog
+        for segment in self.segments:
+            for doc_id, start, stop in segment.spans:
+                if not self.is_live(doc_id, segment):
+                    continue
+                doc_dict = catalog.get(doc_id)
+                doc_dict.pop("num_chunks")
+                doc_dict.pop("added")
+                doc_dict["data"] = [
+                    {"id": segment.chunk_ids[row], "text": segment.texts[row], "embedding": segment.vectors[row].tolist()}
+                    for row in range(start, stop)
+                ]
+                yield doc_dict
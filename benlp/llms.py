@@ -2,11 +2,21 @@ from typing import Any, List, Dict
 import openai
 from functools import partial, wraps
 import time
+import json
 import asyncio
 import os
+import contextvars
+import itertools
+import threading
+import aiohttp
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Any, Union
 from dotenv import load_dotenv
 from .utils import sanitize_text
+from .sessions import HISTORY_SUMMARY_PROMPT, get_default_store
+from .resilience import Policy
+from .metrics import span, record_span, LLM_LATENCY, LLM_TTFT, LLM_TOKENS, LLM_ERRORS, EMBEDDING_BATCH_SIZE, EMBEDDING_LATENCY, ROUTER_EVENTS
 
 
 try:
@@ -18,6 +28,47 @@ except ImportError:
 
 load_dotenv(".env")
 
+# retries, per-attempt timeouts and a circuit breaker for every sync call to OpenAI
+OPENAI_POLICY = Policy("openai", attempts=4, deadline=300, timeout=120, timeout_arg="request_timeout")
+
+# ! Instrumentation -----------------------------------------------------
+
+
+def record_usage(model, raw_response):
+    usage = raw_response.get('usage') or {}
+    LLM_TOKENS.inc(usage.get('prompt_tokens', 0), model=model, direction="in")
+    LLM_TOKENS.inc(usage.get('completion_tokens', 0), model=model, direction="out")
+
+
+def instrument_stream(raw_response, model, kind="chat"):
+    """
+    Wrap a streamed response to record time to first token, streamed chunks (~tokens) and total latency.
+    """
+    start_time = time.time()
+    start = time.perf_counter()
+    first_token = None
+    chunks = 0
+    error = None
+    try:
+        for item in raw_response:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+                LLM_TTFT.observe(first_token, model=model)
+            chunks += 1
+            yield item
+    except Exception as e:
+        error = repr(e)
+        LLM_ERRORS.inc(model=model, kind=kind)
+        raise
+    finally:
+        # closing the wrapper early (e.g. to stop generation) closes the underlying stream too
+        if hasattr(raw_response, "close"):
+            raw_response.close()
+        elapsed = time.perf_counter() - start
+        LLM_LATENCY.observe(elapsed, model=model, kind=kind)
+        LLM_TOKENS.inc(chunks, model=model, direction="out")
+        record_span(f"llm.{kind}.stream", start_time, elapsed, error=error, model=model, ttft=first_token, chunks=chunks)
+
 
 class Completion:
     def __init__(self, temperature=0.7, max_tokens=1000, stream=False, model="text-davinci-003", api_key=os.getenv("OPENAI_API_KEY")):
@@ -34,12 +85,15 @@ class Completion:
 
         openai.api_key = self.api_key
 
-        raw_response = openai.Completion.create(
-            model=self.model,
-            prompt=text,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-        )
+        with span("llm.completion", model=self.model), LLM_LATENCY.time(model=self.model, kind="completion"):
+            raw_response = OPENAI_POLICY.call(
+                openai.Completion.create,
+                model=self.model,
+                prompt=text,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+            )
+        record_usage(self.model, raw_response)
 
         if self.stream:
             return raw_response
@@ -62,72 +116,353 @@ class ChatServer:
     A class to interact with the OpenAI Chat API.
     """
 
-    def __init__(self, api_key=os.getenv("OPENAI_API_KEY")):
+    def __init__(self, api_key=os.getenv("OPENAI_API_KEY"), router=None):
         """
         Initialize the Chat class with the given parameters.
+
+        :param router: ModelRouter, optional, route calls over its endpoints instead of the single given model
         """
+        # passed per request so instances with different keys don't fight over the global openai.api_key
         self.api_key = api_key
-        openai.api_key = self.api_key
+        self.router = router
+
+    def __call__(self, messages, temperature=0, model='gpt-3.5-turbo-16k', max_tokens=2048, stream=True, stop=None):
+        if self.router is not None:
+            # the router picks the endpoint (and so the model)
+            if stream:
+                return self.router.stream(messages, temperature=temperature, max_tokens=max_tokens, stop=stop)
+            return self.router.create(messages, temperature=temperature, max_tokens=max_tokens, stop=stop)
+        with span("llm.chat", model=model, stream=stream):
+            raw_response = OPENAI_POLICY.call(
+                openai.ChatCompletion.create,
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=stream,
+                stop=stop,
+                api_key=self.api_key,
+            )
+        if stream:
+            return instrument_stream(raw_response, model)
+        record_usage(model, raw_response)
+        return raw_response
 
-    def __call__(self, messages, temperature=0, model='gpt-3.5-turbo-16k', max_tokens=2048, stream=True):
-        raw_response = openai.ChatCompletion.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            stream=stream,
-        )
+
+class ChatClientAsync:
+    """
+    An async client for the OpenAI Chat API with a pooled keep-alive connection.
+
+    Create one per process (e.g. in the server's lifespan) and share it, instead of creating a client per request.
+    """
+
+    def __init__(self, api_key=os.getenv("OPENAI_API_KEY"), api_base=os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1"), max_connections=100, timeout=600, policy=None):
+        """
+        :param api_key: str, OpenAI API key
+        :param api_base: str, the API base url (point it at a local fake server for load tests)
+        :param max_connections: int, max pooled connections
+        :param timeout: float, total timeout per request in seconds
+        :param policy: Policy, retries and circuit breaking (defaults to one per api_base)
+        """
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.policy = policy or Policy(self.api_base, attempts=4, deadline=timeout, timeout=120)
+        self.session = None
+
+    async def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+            )
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def create(self, messages, model='gpt-3.5-turbo', temperature=0, max_tokens=2048, **kwargs):
+        """
+        Create a chat completion, returning the raw response dict.
+        """
+        await self.start()
+        payload = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens, **kwargs}
+        with span("llm.chat", model=model), LLM_LATENCY.time(model=model, kind="chat"):
+            raw_response = await self.policy.acall(self.post, payload)
+        record_usage(model, raw_response)
         return raw_response
 
+    async def post(self, payload):
+        async with self.session.post(f"{self.api_base}/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def open_stream(self, payload):
+        response = await self.session.post(f"{self.api_base}/chat/completions", json=payload)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.release()
+            raise
+        return response
+
+    async def stream(self, messages, model='gpt-3.5-turbo', temperature=0, max_tokens=2048, **kwargs):
+        """
+        Stream a chat completion, yielding each chunk dict as it arrives.
+        """
+        await self.start()
+        payload = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens, "stream": True, **kwargs}
+        start_time = time.time()
+        start = time.perf_counter()
+        first_token = None
+        chunks = 0
+        error = None
+        try:
+            # only opening the stream is retried, once tokens flow a failure is the caller's to handle
+            response = await self.policy.acall(self.open_stream, payload)
+            async with response:
+                async for line in response.content:
+                    line = line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        LLM_TTFT.observe(first_token, model=model)
+                    chunks += 1
+                    yield json.loads(data)
+        except Exception as e:
+            error = repr(e)
+            LLM_ERRORS.inc(model=model, kind="chat")
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            LLM_LATENCY.observe(elapsed, model=model, kind="chat")
+            LLM_TOKENS.inc(chunks, model=model, direction="out")
+            record_span("llm.chat.stream", start_time, elapsed, error=error, model=model, ttft=first_token, chunks=chunks)
+
 
 class Chat:
     """
     A class to interact with the OpenAI Chat API.
     """
 
-    def __init__(self, temperature=0.7, system_message="You are a helpful assistant.", messages=None, model='gpt-3.5-turbo', max_tokens=2000, stream=False, api_key=os.getenv("OPENAI_API_KEY")):
+    def __init__(self, temperature=0.7, system_message="You are a helpful assistant.", messages=None, model='gpt-3.5-turbo', max_tokens=2000, stream=False, api_key=os.getenv("OPENAI_API_KEY"), functions=None, function_call=None,
+                 session_id=None, store=None, max_history_tokens=None, truncation="window", summary_model="gpt-3.5-turbo", router=None):
         """
         Initialize the Chat class with the given parameters.
+
+        :param functions: list, optional function schemas for function calling (requires a -0613 or later model)
+        :param function_call: str or dict, optional, "auto", "none" or {"name": ...} to force a function
+        :param messages: list, user messages to start the history with (not allowed when resuming a session that
+            already has messages, they would be added twice)
+        :param session_id: str, optional, continue (or start) a stored session, see benlp.sessions
+        :param store: SessionStore, where sessions live (defaults to a shared in-memory store)
+        :param max_history_tokens: int, optional token budget for the sent history, e.g. the model context minus
+            max_tokens. The history is only trimmed when it's set, trimmed messages also leave self.messages
+        :param truncation: str, "window" drops the oldest messages when over budget, "summary" folds them into a summary
+        :param summary_model: str, the model used for "summary" truncation
+        :param router: ModelRouter, optional, route calls over its endpoints instead of the single given model
         """
-        self.messages = []
-        self.messages.append({"role": "system", "content": system_message})
+        self.store = store if store is not None else get_default_store()
+        if session_id is not None:
+            self.session = self.store.get(session_id, system_message)
+            if messages is not None and self.session.messages:
+                raise ValueError(f"Session {session_id} already has a history, pass messages only to start one")
+        else:
+            self.session = self.store.new_session(system_message=system_message)
         if messages is not None:
-            self.messages += [{"role": "user", "content": message}
-                              for message in messages]
+            self.session.messages += [self.store.make_message("user", message) for message in messages]
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
         self.api_key = api_key
         self.stream = stream
+        self.functions = functions
+        self.function_call = function_call
+        self.max_history_tokens = max_history_tokens
+        self.truncation = truncation
+        self.summary_model = summary_model
+        self.router = router
+        # the history as a plain list of dicts, like before sessions. Edits to it are applied to the session before
+        # the next request
+        self.messages = []
+        self.synced = []
+        self.load_messages()
+
+    @property
+    def session_id(self):
+        return self.session.id
+
+    def load_messages(self):
+        # update self.messages in place so references to the list stay current
+        session = self.session
+        self.messages[:] = [message.to_dict() for message in ([session.system] if session.system else []) + session.messages]
+        self.synced = [dict(message) for message in self.messages]
+
+    def sync_messages(self):
+        """
+        Apply direct edits of self.messages (appended, removed, replaced or edited dicts) to the session. Unchanged
+        messages keep their cached token counts.
+        """
+        if self.messages == self.synced:
+            return
+        session = self.session
+        previous = ([session.system] if session.system else []) + session.messages
+        known = {json.dumps(message.to_dict(), sort_keys=True): message for message in previous}
+        rebuilt = []
+        for message_dict in self.messages:
+            key = json.dumps(message_dict, sort_keys=True)
+            if key not in known:
+                extra = {name: value for name, value in message_dict.items() if name not in ("role", "content")}
+                known[key] = self.store.make_message(message_dict["role"], message_dict.get("content"), **extra)
+            rebuilt.append(known[key])
+        if rebuilt and rebuilt[0].role == "system":
+            session.system, rebuilt = rebuilt[0], rebuilt[1:]
+        else:
+            session.system = None
+
+        # messages after the first changed one are written to the store again
+        unchanged = 0
+        for old, new in zip(session.messages, rebuilt):
+            if old is not new:
+                break
+            unchanged += 1
+        session.persisted = min(session.persisted, unchanged)
+        session.messages = rebuilt
+        self.synced = [dict(message) for message in self.messages]
+
+    def add_message(self, role, content, **extra):
+        self.sync_messages()
+        message = self.store.make_message(role, content, **extra)
+        self.session.messages.append(message)
+        message_dict = message.to_dict()
+        self.messages.append(message_dict)
+        self.synced.append(dict(message_dict))
+        return message_dict
+
+    def summarize_history(self, summary, text):
+        raw_response = OPENAI_POLICY.call(
+            openai.ChatCompletion.create,
+            model=self.summary_model,
+            messages=[{"role": "user", "content": HISTORY_SUMMARY_PROMPT.format(summary=summary, text=text)}],
+            temperature=0,
+            max_tokens=256,
+            api_key=self.api_key,
+        )
+        record_usage(self.summary_model, raw_response)
+        return raw_response['choices'][0]['message']['content'].strip()
+
+    def record_stream(self, raw_response):
+        """
+        Pass a streamed response through, adding the assistant message to the session once it ends.
+        """
+        parts, name, arguments = [], None, []
+        try:
+            for item in raw_response:
+                delta = item['choices'][0]['delta']
+                if delta.get('content'):
+                    parts.append(delta['content'])
+                function_call = delta.get('function_call')
+                if function_call:
+                    name = function_call.get('name') or name
+                    arguments.append(function_call.get('arguments') or "")
+                yield item
+        finally:
+            if hasattr(raw_response, "close"):
+                raw_response.close()
+            if name is not None:
+                self.add_message("assistant", None, function_call={"name": name, "arguments": "".join(arguments)})
+            else:
+                self.add_message("assistant", "".join(parts))
+            self.store.save(self.session)
 
     def __call__(self, user_message: str):
         """
         Process the user message and return the assistant's response.
+
+        The result's "messages" are only this turn's user and assistant messages, the history is in the session.
         """
         openai.api_key = self.api_key
 
-        user_message = {"role": "user", "content": user_message}
-        self.messages.append(user_message)
-        raw_response = openai.ChatCompletion.create(
-            model=self.model,
-            messages=self.messages,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            stream=self.stream,
-        )
-
-        if self.stream is True:
-            return raw_response
+        user_message = self.add_message("user", user_message)
+        if self.max_history_tokens is not None:
+            summarize = self.summarize_history if self.truncation == "summary" else None
+            if self.store.trim(self.session, self.max_history_tokens, summarize=summarize):
+                self.load_messages()
+        messages = self.session.get_messages()
+        # only send the function params when they're set, older models reject them
+        function_kwargs = {}
+        if self.functions is not None:
+            function_kwargs["functions"] = self.functions
+        if self.function_call is not None:
+            function_kwargs["function_call"] = self.function_call
+
+        if self.router is not None:
+            # the router records its own latency and usage per endpoint
+            if self.stream is True:
+                return self.record_stream(self.router.stream(messages, temperature=self.temperature, max_tokens=self.max_tokens, **function_kwargs))
+            raw_response = self.router.create(messages, temperature=self.temperature, max_tokens=self.max_tokens, **function_kwargs)
+        else:
+            with span("llm.chat", model=self.model, stream=self.stream), LLM_LATENCY.time(model=self.model, kind="chat"):
+                raw_response = OPENAI_POLICY.call(
+                    openai.ChatCompletion.create,
+                    model=self.model,
+                    messages=messages,
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    stream=self.stream,
+                    **function_kwargs,
+                )
+
+            if self.stream is True:
+                return self.record_stream(instrument_stream(raw_response, self.model))
+            record_usage(self.model, raw_response)
         
-        text = raw_response['choices'][0]['message']['content'].strip()
+        message = raw_response['choices'][0]['message']
         tokens = raw_response['usage']['total_tokens']
-        res_message = {"role": "assistant", "content": text}
-        self.messages.append(res_message)
-        res_dict = {"response": text, "messages": self.messages,
-                    "model": self.model, "temperature": self.temperature, "tokens": tokens}
+        if message.get('function_call'):
+            # the function arguments are the response when the model calls a function
+            function_call = {"name": message['function_call']['name'], "arguments": message['function_call']['arguments']}
+            text = function_call['arguments']
+            res_message = self.add_message("assistant", None, function_call=function_call)
+        else:
+            function_call = None
+            text = message['content'].strip()
+            res_message = self.add_message("assistant", text)
+        self.store.save(self.session)
+        res_dict = {"response": text, "messages": [user_message, res_message], "function_call": function_call,
+                    "model": self.model, "temperature": self.temperature, "tokens": tokens,
+                    "session_id": self.session.id, "prefix_tokens": self.session.last_prefix_tokens}
         return res_dict
 
 
+def stream_text(raw_response):
+    """
+    Yield the text of a streamed chat response as it arrives, including streamed function call arguments.
+    """
+    for item in raw_response:
+        delta = item['choices'][0]['delta']
+        content = delta.get('content')  # use get method to avoid key error on empty deltas
+        if content:
+            yield content
+        function_call = delta.get('function_call')
+        if function_call and function_call.get('arguments'):
+            yield function_call['arguments']
+
+
 # ! ASYNC CHAT --------------------------------------------------------
 
 
@@ -136,7 +471,8 @@ def async_wrap(func):
     async def run(*args, loop=None, executor=None, **kwargs):
         if loop is None:
             loop = asyncio.get_event_loop()
-        pfunc = partial(func, *args, **kwargs)
+        # run_in_executor doesn't copy contextvars, copy them so spans in func join the caller's trace
+        pfunc = partial(contextvars.copy_context().run, func, *args, **kwargs)
         return await loop.run_in_executor(executor, pfunc)
     return run
 
@@ -170,12 +506,15 @@ class ChatAsync:
             {"role": "system", "content": system_message},
             {"role": "user", "content": message}
         ]
-        raw_response = openai.ChatCompletion.create(
-            model=self.model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
+        with span("llm.chat", model=self.model), LLM_LATENCY.time(model=self.model, kind="chat"):
+            raw_response = OPENAI_POLICY.call(
+                openai.ChatCompletion.create,
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        record_usage(self.model, raw_response)
         text = raw_response['choices'][0]['message']['content'].strip()
         tokens = raw_response['usage']['total_tokens']
         res_message = {"role": "assistant", "content": text}
@@ -222,6 +561,321 @@ class ChatAsync:
     def __call__(self, *args: Any, **kwargs: Any) -> Any:
         asyncio.run(self.run_chat_async(*args, **kwargs))
 
+# ! MODEL ROUTER ------------------------------------------------------
+
+
+class RouterError(Exception):
+    pass
+
+
+class LatencyStats:
+    """
+    Rolling latency and error samples for one endpoint.
+    """
+
+    def __init__(self, window=256):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True for errors
+        self.lock = threading.Lock()
+
+    def record(self, latency=None, error=False):
+        with self.lock:
+            if latency is not None:
+                self.latencies.append(latency)
+            self.outcomes.append(error)
+
+    def percentile(self, p):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)]
+
+    def error_rate(self):
+        with self.lock:
+            return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def count(self):
+        return len(self.outcomes)
+
+
+class Endpoint:
+    """
+    One model behind an OpenAI compatible API. Local stand-ins are endpoints with a local api_base (e.g. the fake
+    server in server/fake_openai.py, or any OpenAI compatible local model server).
+    """
+
+    def __init__(self, model, name=None, api_base=os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1"),
+                 api_key=os.getenv("OPENAI_API_KEY"), timeout=600):
+        """
+        :param model: str, the model name sent to the API
+        :param name: str, label for stats and metrics (defaults to the model)
+        :param api_base: str, the API base url
+        :param api_key: str, the API key
+        :param timeout: float, request timeout in seconds
+        """
+        self.model = model
+        self.name = name or model
+        self.api_base = api_base
+        self.api_key = api_key
+        self.timeout = timeout
+        self.stats = LatencyStats()
+        self.client = None
+        # a single attempt, the router falls back to the next endpoint instead of retrying this one
+        self.policy = Policy(self.name, attempts=1, deadline=timeout, timeout=timeout, timeout_arg="request_timeout")
+
+    def create(self, messages, stream=False, **kwargs):
+        return self.policy.call(openai.ChatCompletion.create, model=self.model, messages=messages, stream=stream,
+                                api_key=self.api_key, api_base=self.api_base, **kwargs)
+
+    def get_client(self):
+        # one pooled async client per endpoint, created on first async use
+        if self.client is None:
+            self.client = ChatClientAsync(api_key=self.api_key, api_base=self.api_base, timeout=self.timeout,
+                                          policy=self.policy)
+        return self.client
+
+    def to_dict(self):
+        return {"name": self.name, "model": self.model, "p50": self.stats.percentile(50),
+                "p95": self.stats.percentile(95), "error_rate": self.stats.error_rate(), "samples": self.stats.count()}
+
+
+class ModelRouter:
+    """
+    Routes chat calls over an ordered pool of endpoints using their live latency and error rates.
+
+    Endpoints are tried best first and a failed call falls back to the next one. With hedging, a backup request goes
+    to the next endpoint if the first hasn't answered within its p95 latency, and whichever finishes first wins (the
+    async loser is cancelled, which closes its connection).
+    """
+
+    def __init__(self, endpoints: List[Endpoint], hedge=False, hedge_percentile=95, default_hedge_delay=2.0,
+                 min_samples=20, max_error_rate=0.5, max_workers=32):
+        """
+        :param endpoints: list, Endpoints in order of preference
+        :param hedge: bool, hedge calls by default
+        :param hedge_percentile: float, the primary's latency percentile to wait before sending the backup
+        :param default_hedge_delay: float, seconds to wait before hedging while an endpoint has too few samples
+        :param min_samples: int, samples needed before an endpoint's stats are trusted
+        :param max_error_rate: float, endpoints above this error rate are only used as a last resort
+        :param max_workers: int, threads for sync hedged calls
+        """
+        assert endpoints, "The router needs at least one endpoint"
+        self.endpoints = endpoints
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def measured(self, endpoint: Endpoint) -> bool:
+        return endpoint.stats.count() >= self.min_samples
+
+    def unhealthy(self, endpoint: Endpoint) -> bool:
+        if endpoint.policy.breaker.state == "open":
+            return True
+        return self.measured(endpoint) and endpoint.stats.error_rate() > self.max_error_rate
+
+    def expected_latency(self, endpoint: Endpoint) -> float:
+        # p50 inflated by the error rate, since an error costs a fallback
+        return (endpoint.stats.percentile(50) or 0) * (1 + 4 * endpoint.stats.error_rate())
+
+    def ranked(self) -> List[Endpoint]:
+        """
+        Endpoints best first: healthy before unhealthy, then by expected latency. Endpoints without enough samples
+        keep their configured position (measured ones are reordered around them), so adding a cold fallback doesn't
+        send it primary traffic before it's been measured through fallbacks and hedges.
+        """
+        # stats change under concurrent calls, so they're read once
+        snapshot = [(endpoint, self.measured(endpoint), self.unhealthy(endpoint), self.expected_latency(endpoint))
+                    for endpoint in self.endpoints]
+
+        def order(items):
+            measured = iter(sorted((item for item in items if item[1]), key=lambda item: item[3]))
+            return [(next(measured) if item[1] else item)[0] for item in items]
+
+        return order([item for item in snapshot if not item[2]]) + order([item for item in snapshot if item[2]])
+
+    def hedge_delay(self, endpoint: Endpoint) -> float:
+        delay = endpoint.stats.percentile(self.hedge_percentile) if self.measured(endpoint) else None
+        # no latency samples yet, or only errors
+        return self.default_hedge_delay if delay is None else delay
+
+    def stats(self) -> List[Dict]:
+        return [endpoint.to_dict() for endpoint in self.endpoints]
+
+    # ! Sync ==================================================================
+
+    def timed_create(self, endpoint: Endpoint, messages, **kwargs):
+        start = time.perf_counter()
+        try:
+            with span("llm.router", endpoint=endpoint.name, model=endpoint.model):
+                raw_response = endpoint.create(messages, **kwargs)
+        except Exception:
+            endpoint.stats.record(error=True)
+            ROUTER_EVENTS.inc(endpoint=endpoint.name, event="error")
+            raise
+        elapsed = time.perf_counter() - start
+        endpoint.stats.record(elapsed)
+        LLM_LATENCY.observe(elapsed, model=endpoint.model, kind="chat")
+        record_usage(endpoint.model, raw_response)
+        return raw_response
+
+    def create(self, messages, hedge=None, **kwargs):
+        """
+        Create a (non streamed) chat completion on the best endpoint, falling back (and optionally hedging).
+
+        :return: dict, the raw response, with the endpoint that answered under "endpoint"
+        """
+        hedge = self.hedge if hedge is None else hedge
+        endpoints = self.ranked()
+        errors = []
+        pending = {}
+        idx = 0
+
+        def launch():
+            nonlocal idx
+            endpoint = endpoints[idx]
+            idx += 1
+            pending[self.executor.submit(self.timed_create, endpoint, messages, **kwargs)] = endpoint
+            return endpoint
+
+        current = launch()
+        while pending:
+            timeout = self.hedge_delay(current) if hedge and idx < len(endpoints) else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                ROUTER_EVENTS.inc(endpoint=current.name, event="hedge")
+                current = launch()
+                continue
+            for future in done:
+                endpoint = pending.pop(future)
+                if future.exception() is None:
+                    # a sync request can't be interrupted, the loser (if any) finishes in the background unused
+                    for other in pending:
+                        other.cancel()
+                    raw_response = future.result()
+                    raw_response["endpoint"] = endpoint.name
+                    return raw_response
+                errors.append(f"{endpoint.name}: {future.exception()}")
+            if not pending and idx < len(endpoints):
+                ROUTER_EVENTS.inc(endpoint=endpoints[idx].name, event="fallback")
+                current = launch()
+        raise RouterError(f"Every endpoint failed: {errors}")
+
+    def stream(self, messages, **kwargs):
+        """
+        Stream a chat completion, falling back to the next endpoint if one fails before its first chunk.
+        """
+        errors = []
+        for endpoint in self.ranked():
+            start = time.perf_counter()
+            try:
+                raw_response = iter(endpoint.create(messages, stream=True, **kwargs))
+                first = next(raw_response)
+            except Exception as e:
+                endpoint.stats.record(error=True)
+                ROUTER_EVENTS.inc(endpoint=endpoint.name, event="error")
+                errors.append(f"{endpoint.name}: {e}")
+                continue
+            # time to first chunk is what matters for routing streams
+            endpoint.stats.record(time.perf_counter() - start)
+            return instrument_stream(itertools.chain([first], raw_response), endpoint.model)
+        raise RouterError(f"Every endpoint failed: {errors}")
+
+    # ! Async =================================================================
+
+    async def atimed_create(self, endpoint: Endpoint, messages, **kwargs):
+        start = time.perf_counter()
+        try:
+            raw_response = await endpoint.get_client().create(messages, model=endpoint.model, **kwargs)
+        except asyncio.CancelledError:
+            # a hedge loser, not an error
+            ROUTER_EVENTS.inc(endpoint=endpoint.name, event="cancelled")
+            raise
+        except Exception:
+            endpoint.stats.record(error=True)
+            ROUTER_EVENTS.inc(endpoint=endpoint.name, event="error")
+            raise
+        endpoint.stats.record(time.perf_counter() - start)
+        return raw_response
+
+    async def acreate(self, messages, hedge=None, **kwargs):
+        """
+        Async version of create. The losing hedged request is cancelled.
+        """
+        hedge = self.hedge if hedge is None else hedge
+        endpoints = self.ranked()
+        errors = []
+        pending = {}
+        idx = 0
+
+        def launch():
+            nonlocal idx
+            endpoint = endpoints[idx]
+            idx += 1
+            pending[asyncio.ensure_future(self.atimed_create(endpoint, messages, **kwargs))] = endpoint
+            return endpoint
+
+        current = launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay(current) if hedge and idx < len(endpoints) else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    ROUTER_EVENTS.inc(endpoint=current.name, event="hedge")
+                    current = launch()
+                    continue
+                for task in done:
+                    endpoint = pending.pop(task)
+                    if task.exception() is None:
+                        raw_response = task.result()
+                        raw_response["endpoint"] = endpoint.name
+                        return raw_response
+                    errors.append(f"{endpoint.name}: {task.exception()}")
+                if not pending and idx < len(endpoints):
+                    ROUTER_EVENTS.inc(endpoint=endpoints[idx].name, event="fallback")
+                    current = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise RouterError(f"Every endpoint failed: {errors}")
+
+    async def astream(self, messages, **kwargs):
+        """
+        Async version of stream, yielding the raw chunks.
+        """
+        errors = []
+        for endpoint in self.ranked():
+            start = time.perf_counter()
+            stream = endpoint.get_client().stream(messages, model=endpoint.model, **kwargs)
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                endpoint.stats.record(time.perf_counter() - start)
+                return
+            except Exception as e:
+                endpoint.stats.record(error=True)
+                ROUTER_EVENTS.inc(endpoint=endpoint.name, event="error")
+                errors.append(f"{endpoint.name}: {e}")
+                continue
+            endpoint.stats.record(time.perf_counter() - start)
+            yield first
+            async for item in stream:
+                yield item
+            return
+        raise RouterError(f"Every endpoint failed: {errors}")
+
+    async def aclose(self):
+        for endpoint in self.endpoints:
+            if endpoint.client is not None:
+                await endpoint.client.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
 # ! EMBEDDINGS --------------------------------------------------------
 
 
@@ -238,10 +892,14 @@ def embed_ada(text: str):
         raise ValueError("Empty text passed to embed_text()")
 
     # Embed the text
-    response = openai.Embedding.create(
-        input=sanitized_text,
-        model="text-embedding-ada-002",
-    )
+    EMBEDDING_BATCH_SIZE.observe(1)
+    with span("embedding", batch_size=1), EMBEDDING_LATENCY.time():
+        response = OPENAI_POLICY.call(
+            openai.Embedding.create,
+            input=sanitized_text,
+            model="text-embedding-ada-002",
+        )
+    LLM_TOKENS.inc(response["usage"]["total_tokens"], model="text-embedding-ada-002", direction="in")
     embedding = response["data"][0]["embedding"]
     return embedding
 
@@ -255,9 +913,13 @@ def embed_ada_list(text_list: List):
     if len(sanitized_list) == 0:
         raise ValueError("Empty list passed to embed_text()")
     # Embed the text
-    response = openai.Embedding.create(
-        input=sanitized_list,
-        model="text-embedding-ada-002",
-    )
+    EMBEDDING_BATCH_SIZE.observe(len(sanitized_list))
+    with span("embedding", batch_size=len(sanitized_list)), EMBEDDING_LATENCY.time():
+        response = OPENAI_POLICY.call(
+            openai.Embedding.create,
+            input=sanitized_list,
+            model="text-embedding-ada-002",
+        )
+    LLM_TOKENS.inc(response["usage"]["total_tokens"], model="text-embedding-ada-002", direction="in")
     embeddings = [item["embedding"] for item in response["data"]]
     return embeddings
\ No newline at end of file
@@ -0,0 +1,253 @@
+import bisect
+import contextvars
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ! Hooks =====================================================================
+
+_hooks: List[Callable[[Dict], None]] = []
+
+
+def add_hook(hook: Callable[[Dict], None]) -> None:
+    """
+    Register a function that receives every metric observation and finished span as a dict, e.g. to forward them to
+    a logger or another metrics backend. Observations look like
+    {"type": "metric", "name": ..., "value": ..., "labels": {...}, "trace_id": ...} and spans like
+    {"type": "span", "name": ..., "trace_id": ..., "span_id": ..., "parent_id": ..., "duration": ..., "attrs": {...}}.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[Dict], None]) -> None:
+    _hooks.remove(hook)
+
+
+def _emit(event: Dict) -> None:
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as e:
+            print(f"Metrics hook {hook} failed: {e}")
+
+# ! Metrics ===================================================================
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def label_key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def format_labels(self, key: Tuple, extra: str = "") -> str:
+        parts = [f'{label}="{value}"' for label, value in zip(self.labels, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def emit(self, value: float, labels: Dict) -> None:
+        if _hooks:
+            span = _current_span.get()
+            _emit({"type": "metric", "name": self.name, "value": value, "labels": labels,
+                   "trace_id": span.trace_id if span else None})
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+        self.emit(value, labels)
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{self.format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[Tuple, list] = {}  # label key -> [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.label_key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if idx < len(self.buckets):
+                entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+        self.emit(value, labels)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = 'le="%s"' % bucket
+                    lines.append(f"{self.name}_bucket{self.format_labels(key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{self.format_labels(key, le)} {count}")
+                lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+# metrics are per process, so with multiple server workers each worker exposes its own
+REGISTRY = Registry()
+
+LLM_LATENCY = Histogram("benlp_llm_latency_seconds", "Total LLM call latency", ("model", "kind"))
+LLM_TTFT = Histogram("benlp_llm_time_to_first_token_seconds", "Time to the first streamed token", ("model",))
+LLM_TOKENS = Counter("benlp_llm_tokens_total", "LLM tokens sent and received", ("model", "direction"))
+LLM_ERRORS = Counter("benlp_llm_errors_total", "Failed LLM calls", ("model", "kind"))
+EMBEDDING_BATCH_SIZE = Histogram("benlp_embedding_batch_size", "Texts per embedding request", (),
+                                 buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048))
+EMBEDDING_LATENCY = Histogram("benlp_embedding_latency_seconds", "Embedding request latency")
+CACHE_REQUESTS = Counter("benlp_cache_requests_total", "Cache lookups by result (hit/miss)", ("cache", "result"))
+ROUTER_EVENTS = Counter("benlp_llm_router_events_total", "Model router hedges, fallbacks, errors and cancelled hedge losers", ("endpoint", "event"))
+RESILIENCE_EVENTS = Counter("benlp_resilience_events_total", "Retries, deadlines, failures and circuit breaker transitions", ("endpoint", "event"))
+SEARCH_LATENCY = Histogram("benlp_search_latency_seconds", "Search latency", ("kind",))
+RERANK_EVENTS = Counter("benlp_rerank_events_total", "Re-ranker calls, fully cached results, budget skips and failures", ("reranker", "event"))
+HTTP_REQUESTS = Counter("benlp_http_requests_total", "Server requests", ("method", "path", "status"))
+HTTP_LATENCY = Histogram("benlp_http_request_duration_seconds", "Server request duration (until the response body is done)", ("method", "path"))
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+# ! Tracing ===================================================================
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict:
+        return {"type": "span", "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent_id, "start": self.start, "duration": self.duration,
+                "error": self.error, "attrs": self.attrs}
+
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("benlp_span", default=None)
+_recent_spans = deque(maxlen=10000)
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attrs):
+    """
+    Time a block as a span. Spans nest through contextvars, so LLM, embedding and search calls made while handling a
+    server request share the request's trace id (including across asyncio tasks and asyncio.to_thread).
+    """
+    parent = _current_span.get()
+    trace_id = trace_id or (parent.trace_id if parent else uuid.uuid4().hex)
+    current = Span(name, trace_id, parent.span_id if parent else None, attrs)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        _recent_spans.append(current)
+        if _hooks:
+            _emit(current.to_dict())
+
+
+def current_trace_id() -> Optional[str]:
+    current = _current_span.get()
+    return current.trace_id if current else None
+
+
+def get_trace(trace_id: str) -> List[Dict]:
+    """
+    Return the recently finished spans for a trace, oldest first.
+    """
+    return [s.to_dict() for s in list(_recent_spans) if s.trace_id == trace_id]
+
+
+def record_span(name: str, start: float, duration: float, error: Optional[str] = None, **attrs) -> Dict:
+    """
+    Record an already finished span as a child of the current one. Used for streams, where a `with span(...)` block
+    can't be held open across yields.
+
+    :param start: float, wall clock start time (time.time())
+    :param duration: float, seconds
+    """
+    parent = _current_span.get()
+    finished = Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None, attrs)
+    finished.start = start
+    finished.duration = duration
+    finished.error = error
+    _recent_spans.append(finished)
+    if _hooks:
+        _emit(finished.to_dict())
+    return finished.to_dict()
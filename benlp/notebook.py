@@ -0,0 +1,130 @@
+import io
+import json
+from typing import Dict, Iterator, List, Optional, Union
+
+try:
+    import ijson
+except ImportError:
+    ijson = None  # falls back to json, which loads the whole notebook
+
+NotebookContents = Union[str, bytes, io.IOBase]
+
+# large reads matter, base64 outputs are long single strings and small buffers make ijson rescan them many times
+READ_BUFFER_SIZE = 1 << 20
+
+# ! Cleaning ==================================================================
+
+
+def join_text(value) -> str:
+    # notebook sources and text outputs are stored either as a string or a list of lines
+    if isinstance(value, list):
+        return "".join(value)
+    return value or ""
+
+
+def is_image(mime_type: str) -> bool:
+    return mime_type.startswith("image/")
+
+
+def image_placeholder(mime_type: str) -> str:
+    return f"<{mime_type} output omitted>"
+
+
+def clean_output(output: Dict, strip_images=True) -> Dict:
+    if "text" in output:
+        output["text"] = join_text(output["text"])
+    data = output.get("data")
+    if data:
+        for mime_type, value in list(data.items()):
+            if strip_images and is_image(mime_type):
+                data[mime_type] = image_placeholder(mime_type)
+            elif isinstance(value, list):
+                data[mime_type] = join_text(value)
+    return output
+
+
+def clean_cell(cell: Dict, strip_images=True) -> Dict:
+    cell["source"] = join_text(cell.get("source"))
+    if "outputs" in cell:
+        cell["outputs"] = [clean_output(output, strip_images) for output in cell["outputs"]]
+    return cell
+
+# ! Parsing ===================================================================
+
+
+def open_source(path: Optional[str] = None, contents: Optional[NotebookContents] = None):
+    """
+    A binary file object for a notebook given by exactly one of path or contents. Contents are never taken for a
+    path, so a notebook uploaded to the server can't make it read a local file.
+
+    :param path: str, a notebook path
+    :param contents: str, bytes or file, the notebook json as text, bytes or an open file
+    :return: tuple, (file object, whether it was opened here and should be closed by the caller)
+    """
+    if (path is None) == (contents is None):
+        raise ValueError("Pass exactly one of path or contents")
+    if path is not None:
+        return open(path, "rb"), True
+    if isinstance(contents, str):
+        contents = contents.encode("utf-8")
+    if isinstance(contents, bytes):
+        return io.BytesIO(contents), True
+    return contents, False
+
+
+def iter_cells_streaming(f, strip_images=True) -> Iterator[Dict]:
+    """
+    Build one cell at a time from ijson events. Image outputs are skipped at the event level, so they're never
+    assembled into the cell and memory stays bounded by the largest single value rather than the notebook size.
+    """
+    builder = None
+    skip = None
+    for prefix, event, value in ijson.parse(f, buf_size=READ_BUFFER_SIZE, use_float=True):
+        if builder is None:
+            if prefix == "cells.item" and event == "start_map":
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            continue
+
+        if skip is not None:
+            if prefix == skip or prefix.startswith(skip + "."):
+                continue
+            skip = None
+
+        if strip_images and event == "map_key" and prefix.endswith(".outputs.item.data") and is_image(value):
+            skip = f"{prefix}.{value}"
+            builder.event(event, value)
+            builder.event("string", image_placeholder(value))
+            continue
+
+        builder.event(event, value)
+        if prefix == "cells.item" and event == "end_map":
+            yield clean_cell(builder.value, strip_images=False)
+            builder = None
+
+
+def iter_cells(path: Optional[str] = None, contents: Optional[NotebookContents] = None, strip_images=True,
+               streaming=True) -> Iterator[Dict]:
+    """
+    Iterate over the cells of a notebook with sources and text outputs joined into strings.
+
+    :param path: str, the notebook path
+    :param contents: str, bytes or file, the notebook contents (instead of a path)
+    :param strip_images: bool, replace image outputs (base64) with a short placeholder
+    :param streaming: bool, parse incrementally with ijson when it's installed
+    """
+    f, opened = open_source(path, contents)
+    try:
+        if streaming and ijson is not None:
+            yield from iter_cells_streaming(f, strip_images)
+        else:
+            for cell in json.load(f).get("cells", []):
+                yield clean_cell(cell, strip_images)
+    finally:
+        if opened:
+            f.close()
+
+
+def parse_notebook(path: Optional[str] = None, contents: Optional[NotebookContents] = None, strip_images=True,
+                   streaming=True) -> List[Dict]:
+    return list(iter_cells(path, contents, strip_images=strip_images, streaming=streaming))
@@ -0,0 +1,201 @@
+import ast
+import json
+import re
+from typing import Any, List
+
+
+class OutputParserError(ValueError):
+    """
+    Raised when model output can't be parsed, even after repair.
+    """
+    pass
+
+
+# ! Repair ====================================================================
+
+def strip_code_fences(text: str) -> str:
+    match = re.search(r"```(?:\w+)?\s(.*?)```", text, re.DOTALL)
+    return match.group(1) if match else text
+
+
+def extract_json_span(text: str) -> str:
+    """
+    Return the outermost [...] or {...} span in the text, dropping any prose the model put around it.
+    """
+    starts = [idx for idx in (text.find("["), text.find("{")) if idx != -1]
+    if not starts:
+        return text
+    start = min(starts)
+    end = text.rfind("]" if text[start] == "[" else "}")
+    if end <= start:
+        # truncated output, take everything after the start and let the closer fill in the rest
+        return text[start:]
+    return text[start:end + 1]
+
+
+def close_brackets(text: str) -> str:
+    """
+    Close any strings, objects and arrays left open by truncated output.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            stack.append("]" if char == "[" else "}")
+        elif char in "]}" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = re.sub(r",\s*$", "", text)
+    return text + "".join(reversed(stack))
+
+
+STRING_LITERAL = re.compile(r'"(?:\\.|[^"\\])*"')
+
+
+def sub_outside_strings(pattern: str, repl: str, text: str) -> str:
+    """
+    re.sub that leaves JSON string literals alone, so fixes to the structure don't rewrite the values.
+    """
+    parts = []
+    last = 0
+    for match in STRING_LITERAL.finditer(text):
+        parts.append(re.sub(pattern, repl, text[last:match.start()]))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(re.sub(pattern, repl, text[last:]))
+    return "".join(parts)
+
+
+def repair_json(text: str) -> str:
+    """
+    Apply cheap local fixes for the usual ways models break JSON.
+    """
+    text = strip_code_fences(text).strip()
+    text = extract_json_span(text)
+    text = close_brackets(text)
+    # python literals -> json literals
+    text = sub_outside_strings(r"\bTrue\b", "true", text)
+    text = sub_outside_strings(r"\bFalse\b", "false", text)
+    text = sub_outside_strings(r"\bNone\b", "null", text)
+    # trailing commas
+    text = sub_outside_strings(r",\s*([\]}])", r"\1", text)
+    return text
+
+
+def parse_json(text: str) -> Any:
+    """
+    Parse JSON (or a python literal) from model output, repairing it locally if needed.
+
+    :raises OutputParserError: if the output can't be parsed
+    """
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, TypeError, RecursionError):
+        pass
+
+    repaired = repair_json(text)
+    try:
+        return json.loads(repaired)
+    except (json.JSONDecodeError, RecursionError):
+        pass
+
+    # single quoted python dicts and lists
+    try:
+        return ast.literal_eval(extract_json_span(strip_code_fences(text).strip()))
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError) as e:
+        raise OutputParserError(f"Could not parse model output: {e}\n\n{text}")
+
+
+def parse_bool(text: str) -> bool:
+    """
+    Parse a True/False answer from the first boolean word in the output, so explanations after the answer ("True.
+    There are no further tasks.") don't change it.
+
+    :raises OutputParserError: if the output contains no boolean word
+    """
+    match = re.search(r"\b(true|false|yes|no)\b", text, re.IGNORECASE)
+    if match is None:
+        raise OutputParserError(f"Could not parse a boolean from model output: {text}")
+    return match.group(1).lower() in ("true", "yes")
+
+
+# ! Incremental parsing =======================================================
+
+class JSONArrayStreamParser:
+    """
+    Incrementally parse the elements of a JSON array from streamed text.
+
+    Feed it chunks as they arrive and it returns every element that completed in that chunk. Anything before the first
+    "[" is ignored, so it works on raw arrays, arrays wrapped in prose and function call arguments like {"tasks": [...]}.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0  # depth relative to the array, 0 = not in the array yet
+        self.in_string = False
+        self.escape = False
+        self.element_start = None
+        self.finished = False
+        self.items: List[Any] = []
+
+    def feed(self, chunk: str) -> List[Any]:
+        completed = []
+        self.buffer += chunk
+
+        while self.position < len(self.buffer) and not self.finished:
+            char = self.buffer[self.position]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+                if self.depth == 1 and self.element_start is None:
+                    self.element_start = self.position
+            elif char in "[{":
+                if self.depth == 0 and char == "[":
+                    self.depth = 1
+                elif self.depth >= 1:
+                    if self.depth == 1:
+                        self.element_start = self.position
+                    self.depth += 1
+            elif char in "]}" and self.depth >= 1:
+                self.depth -= 1
+                if self.depth == 1:
+                    completed.append(self.pop_element(self.position + 1))
+                elif self.depth == 0:
+                    self.finished = True
+                    if self.element_start is not None:
+                        completed.append(self.pop_element(self.position))
+            elif char == "," and self.depth == 1:
+                if self.element_start is not None:
+                    completed.append(self.pop_element(self.position))
+            elif self.depth == 1 and self.element_start is None and not char.isspace():
+                # scalar element (number, literal)
+                self.element_start = self.position
+
+            self.position += 1
+
+        self.items += completed
+        return completed
+
+    def pop_element(self, end: int) -> Any:
+        text = self.buffer[self.element_start:end].strip().rstrip(",")
+        self.element_start = None
+        return parse_json(text)
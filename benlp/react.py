@@ -0,0 +1,215 @@
+import json
+import os
+import re
+from typing import Callable, Dict, Optional, Tuple
+
+from .llms import ChatServer
+from .utils import TokenUtil
+
+REACT_INSTRUCTIONS = """Solve the task with interleaving Thought, Action and Observation steps.
+Thought reasons about the current situation. Action can be one of:
+{tools}
+Finish[answer], which returns the answer and finishes the task.
+
+Write exactly one Action per step, then stop. The Observation will be given to you."""
+
+ACTION_START = re.compile(r"^Action:\s*([A-Za-z_]+)\[", re.MULTILINE)
+
+
+def find_action(text: str) -> Optional[Tuple[str, str, int]]:
+    """
+    Find the first complete `Action: Tool[arg]` in text.
+
+    The argument may span multiple lines (e.g. code) and contain brackets, so the action is only complete once the
+    brackets balance.
+
+    :return: tuple, (tool name, argument, end index) or None if there is no complete action yet
+    """
+    match = ACTION_START.search(text)
+    if match is None:
+        return None
+
+    depth = 1
+    for idx in range(match.end(), len(text)):
+        char = text[idx]
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+            if depth == 0:
+                return match.group(1), text[match.end():idx].strip(), idx + 1
+    return None
+
+
+class ReActRuntime:
+    """
+    Runs a ReAct loop over a streamed completion.
+
+    Tokens are consumed as they arrive. As soon as a complete Action is seen, generation is stopped, the tool is
+    dispatched and the loop resumes with the Observation, so no tokens are generated (or waited on) after the action.
+    """
+
+    def __init__(self, tools: Dict[str, Callable[[str], str]] = None, tool_descriptions: Dict[str, str] = None,
+                 model="gpt-3.5-turbo", max_steps=8, max_tokens=1000, temperature=0, max_observation_chars=2000,
+                 api_key=os.getenv("OPENAI_API_KEY")):
+        """
+        :param tools: dict, tool name -> function taking the action argument and returning the observation
+        :param tool_descriptions: dict, tool name -> description shown to the model
+        :param model: str, the chat model to use
+        :param max_steps: int, the max number of actions before giving up
+        :param max_tokens: int, max tokens generated per step
+        :param temperature: float, sampling temperature
+        :param max_observation_chars: int, observations are truncated to this many characters
+        """
+        self.tools = {name.lower(): function for name, function in (tools or {}).items()}
+        self.tool_descriptions = tool_descriptions or {}
+        self.model = model
+        self.max_steps = max_steps
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.max_observation_chars = max_observation_chars
+        self.chat = ChatServer(api_key=api_key)
+        self.token_util = TokenUtil(model)
+
+    def get_system_message(self):
+        tools = "\n".join(
+            f"{name}[input], {self.tool_descriptions.get(name, '')}" for name in self.tools
+        )
+        return REACT_INSTRUCTIONS.format(tools=tools)
+
+    def dispatch(self, tool: str, arg: str) -> str:
+        function = self.tools.get(tool.lower())
+        if function is None:
+            return f"Unknown action {tool}. Valid actions are: {', '.join(list(self.tools) + ['finish'])}."
+        try:
+            observation = str(function(arg))
+        except Exception as e:
+            observation = f"Error: {e}"
+        if len(observation) > self.max_observation_chars:
+            observation = observation[:self.max_observation_chars] + "..."
+        return observation
+
+    def stream_step(self, messages, stop=None):
+        """
+        Stream one step, stopping generation as soon as a complete action arrives (or stop is set).
+
+        :return: tuple, (generated text up to and including the action, action tuple or None)
+        """
+        response = self.chat(messages, temperature=self.temperature, model=self.model,
+                             max_tokens=self.max_tokens, stream=True, stop=["\nObservation:"])
+        text = ""
+        action = None
+        try:
+            for item in response:
+                if stop is not None and stop.is_set():
+                    break
+                content = item['choices'][0]['delta'].get('content')
+                if not content:
+                    continue
+                text += content
+                action = find_action(text)
+                if action is not None:
+                    break
+        finally:
+            # stop the generation, we don't need anything after the action
+            if hasattr(response, "close"):
+                response.close()
+
+        if action is not None:
+            text = text[:action[2]]
+        return text, action
+
+    def run(self, prompt: str, stop=None) -> Dict:
+        """
+        Run the loop until the model finishes or max_steps is reached.
+
+        :param prompt: str, the task prompt
+        :param stop: threading.Event, checked between steps and streamed chunks, once it's set the loop returns what
+            it has so far (with no answer)
+        :return: dict, with the answer, the full transcript, each step's action and observation, and tokens used
+        """
+        transcript = ""
+        steps = []
+        tokens = 0
+        answer = None
+
+        for _ in range(self.max_steps):
+            if stop is not None and stop.is_set():
+                break
+            messages = [
+                {"role": "system", "content": self.get_system_message()},
+                {"role": "user", "content": f"{prompt}\n\n{transcript}".strip()},
+            ]
+            tokens += self.token_util.get_tokens(messages[0]["content"] + messages[1]["content"])
+
+            text, action = self.stream_step(messages, stop)
+            tokens += self.token_util.get_tokens(text)
+            transcript += text.strip() + "\n"
+            if stop is not None and stop.is_set():
+                break
+
+            if action is None:
+                # the model stopped without acting, treat what it wrote as the answer
+                answer = text.strip()
+                break
+
+            tool, arg, _ = action
+            if tool.lower() == "finish":
+                answer = arg
+                break
+
+            print(f"Action: {tool}[{arg[:100]}]")
+            observation = self.dispatch(tool, arg)
+            transcript += f"Observation: {observation}\n"
+            steps.append({"tool": tool, "input": arg, "observation": observation})
+
+        return {"answer": answer, "transcript": transcript, "steps": steps, "tokens": tokens}
+
+
+# ! Default Tools =============================================================
+
+def search_tool(agent, top_k=3):
+    """
+    Semantic search over the agent's index.
+    """
+    def search(query):
+        results = agent.get_top_k(query, top_k=top_k)
+        if not results:
+            return "No results."
+        return "\n\n".join(result["text"] for result in results)
+    return {"name": "Search", "instruction": "semantic search over the loaded documents", "function": search}
+
+
+def code_tool(session_id=None, pool=None, timeout=30):
+    """
+    Execute python code and return its output. Every call runs on the same warm worker pool.
+
+    :param session_id: str, keep variables between calls in this session (by default each call starts fresh)
+    :param pool: WorkerPool, defaults to the shared pool
+    :param timeout: float, wall-clock limit per execution in seconds
+    """
+    from .tools.code_executor import get_default_pool
+
+    def execute(code):
+        result = (pool or get_default_pool()).execute(session_id, code, timeout=timeout)
+        output = result["output"] + (f"Error: {result['error']}" if result["error"] else "")
+        return output or "Code executed with no output."
+    return {"name": "Code", "instruction": "execute python code and return what it prints", "function": execute}
+
+
+def omim_tool(client=None):
+    """
+    Search OMIM (Online Mendelian Inheritance in Man) entries.
+
+    :param client: OMIM, the client every search goes through (one is created with the tool by default, so its
+        connection pool, cache and rate limit are shared across calls)
+    """
+    from .tools.omim import OMIM, EntrySearchParams
+    client = client or OMIM()
+
+    def search(query):
+        res = client.search_entry(EntrySearchParams(search=query, limit=3, include=[]))
+        if res is None:
+            return "OMIM request failed."
+        return json.dumps(res)
+    return {"name": "OMIM", "instruction": "search the OMIM database of human genes and genetic disorders", "function": search}
@@ -0,0 +1,267 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import openai
+
+from .catalog import content_hash
+from .llms import LatencyStats, async_wrap, record_usage
+from .metrics import RERANK_EVENTS, SEARCH_LATENCY, record_cache, span
+from .parsers import OutputParserError, parse_json
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None  # only needed for CrossEncoderReranker
+
+RERANK_PROMPT = """Rate how relevant each passage is to the query, from 0 (unrelated) to 10 (answers it directly).
+
+QUERY: {query}
+
+PASSAGES:
+{passages}
+
+Respond with only a JSON array of {count} numbers, the score of each passage in order.
+
+SCORES:"""
+
+# ! Cache =====================================================================
+
+
+class ScoreCache:
+    """
+    An LRU of re-ranker scores by (query hash, chunk id). Chunk ids are content hashes, so a score stays valid for
+    as long as the chunk exists.
+    """
+
+    def __init__(self, max_entries=10000, name="rerank"):
+        self.max_entries = max_entries
+        self.name = name
+        self.scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, query_key: str, chunk_id: str) -> Optional[float]:
+        with self.lock:
+            score = self.scores.get((query_key, chunk_id))
+            if score is not None:
+                self.scores.move_to_end((query_key, chunk_id))
+        record_cache(self.name, score is not None)
+        return score
+
+    def set(self, query_key: str, chunk_id: str, score: float) -> None:
+        with self.lock:
+            self.scores[(query_key, chunk_id)] = score
+            self.scores.move_to_end((query_key, chunk_id))
+            while len(self.scores) > self.max_entries:
+                self.scores.popitem(last=False)
+
+# ! Rerankers =================================================================
+
+
+class Reranker:
+    """
+    A second retrieval stage: re-score the first stage's top candidates in one batched call and keep the best.
+
+    Only candidates without a cached score are sent. With a deadline, the call is skipped (keeping the first stage
+    order) when the time left is under the re-ranker's recent p95 latency, and it is cut off at the deadline where
+    the scorer allows it. Any failure also falls back to the first stage order.
+    """
+    name = "rerank"
+
+    def __init__(self, cache_size=10000, default_latency=2.0):
+        """
+        :param cache_size: int, cached (query, chunk) scores
+        :param default_latency: float, expected seconds per call until there are measurements
+        """
+        self.cache = ScoreCache(cache_size, name=self.name)
+        self.stats = LatencyStats()
+        self.default_latency = default_latency
+
+    def score(self, query: str, texts: List[str], timeout: Optional[float]) -> List[float]:
+        raise NotImplementedError
+
+    async def ascore(self, query: str, texts: List[str], timeout: Optional[float]) -> List[float]:
+        # scorers without an async client run in a thread
+        return await async_wrap(self.score)(query, texts, timeout)
+
+    def expected_latency(self) -> float:
+        latency = self.stats.percentile(95)
+        return self.default_latency if latency is None else latency
+
+    def plan(self, query: str, candidates: List[Dict], deadline: Optional[float]):
+        """
+        :return: tuple, (query key, cached scores by chunk id, candidates to score, timeout), or None to skip
+        """
+        query_key = content_hash(query)
+        scores, missing = {}, []
+        for candidate in candidates:
+            score = self.cache.get(query_key, candidate["id"])
+            if score is None:
+                missing.append(candidate)
+            else:
+                scores[candidate["id"]] = score
+        if not missing:
+            RERANK_EVENTS.inc(reranker=self.name, event="cached")
+            return query_key, scores, missing, None
+
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout < self.expected_latency():
+                RERANK_EVENTS.inc(reranker=self.name, event="skipped")
+                return None
+        return query_key, scores, missing, timeout
+
+    def merge(self, query_key: str, candidates: List[Dict], scores: Dict, missing: List[Dict],
+              new_scores: List[float], top_k: int) -> List[Dict]:
+        for candidate, score in zip(missing, new_scores):
+            scores[candidate["id"]] = score
+            self.cache.set(query_key, candidate["id"], score)
+        results = [{**candidate, "rerank_score": scores[candidate["id"]]} for candidate in candidates]
+        # ties keep the first stage order
+        results.sort(key=lambda result: (result["rerank_score"], result["similarity"]), reverse=True)
+        return results[:top_k]
+
+    def check(self, scores, expected: int) -> List[float]:
+        if not isinstance(scores, list) or len(scores) != expected:
+            raise OutputParserError(f"Expected {expected} scores, got {scores!r}")
+        return [float(score) for score in scores]
+
+    def rerank(self, query: str, candidates: List[Dict], top_k=5, deadline: Optional[float] = None) -> List[Dict]:
+        """
+        :param candidates: list, first stage results (dicts with id, text and similarity), best first
+        :param deadline: float, time.monotonic() by which results are needed
+        :return: list, the top_k candidates, re-ranked (with a rerank_score) unless the re-ranker was skipped
+        """
+        plan = self.plan(query, candidates, deadline)
+        if plan is None:
+            return candidates[:top_k]
+        query_key, scores, missing, timeout = plan
+        new_scores = []
+        if missing:
+            start = time.perf_counter()
+            try:
+                with span("rerank", reranker=self.name, candidates=len(missing)), SEARCH_LATENCY.time(kind=self.name):
+                    new_scores = self.check(self.score(query, [c["text"] for c in missing], timeout), len(missing))
+            except Exception as e:
+                self.stats.record(error=True)
+                RERANK_EVENTS.inc(reranker=self.name, event="failed")
+                print(f"Re-ranking failed ({e!r}), keeping the search order")
+                return candidates[:top_k]
+            self.stats.record(time.perf_counter() - start)
+            RERANK_EVENTS.inc(reranker=self.name, event="scored")
+        return self.merge(query_key, candidates, scores, missing, new_scores, top_k)
+
+    async def arerank(self, query: str, candidates: List[Dict], top_k=5,
+                      deadline: Optional[float] = None) -> List[Dict]:
+        """
+        Async version of rerank, the scoring call is cancelled at the deadline.
+        """
+        plan = self.plan(query, candidates, deadline)
+        if plan is None:
+            return candidates[:top_k]
+        query_key, scores, missing, timeout = plan
+        new_scores = []
+        if missing:
+            start = time.perf_counter()
+            try:
+                with span("rerank", reranker=self.name, candidates=len(missing)), SEARCH_LATENCY.time(kind=self.name):
+                    raw_scores = await asyncio.wait_for(self.ascore(query, [c["text"] for c in missing], timeout),
+                                                        timeout=timeout)
+                    new_scores = self.check(raw_scores, len(missing))
+            except Exception as e:
+                self.stats.record(error=True)
+                RERANK_EVENTS.inc(reranker=self.name, event="failed")
+                print(f"Re-ranking failed ({e!r}), keeping the search order")
+                return candidates[:top_k]
+            self.stats.record(time.perf_counter() - start)
+            RERANK_EVENTS.inc(reranker=self.name, event="scored")
+        return self.merge(query_key, candidates, scores, missing, new_scores, top_k)
+
+
+class LLMReranker(Reranker):
+    """
+    Scores all candidates in one chat completion that returns a JSON array of 0-10 relevance scores.
+    """
+    name = "llm_rerank"
+
+    def __init__(self, model="gpt-3.5-turbo", llm=None, max_chunk_chars=1000, cache_size=10000, default_latency=2.0,
+                 api_key=os.getenv("OPENAI_API_KEY")):
+        """
+        :param model: str, the chat model
+        :param llm: ChatClientAsync, used by arerank (the sync client runs in a thread without it)
+        :param max_chunk_chars: int, passages are cut to this length to bound the prompt
+        """
+        super().__init__(cache_size=cache_size, default_latency=default_latency)
+        self.model = model
+        self.llm = llm
+        self.max_chunk_chars = max_chunk_chars
+        self.api_key = api_key
+
+    def get_messages(self, query: str, texts: List[str]) -> List[Dict]:
+        passages = "\n\n".join(f"[{idx + 1}] {text[:self.max_chunk_chars]}" for idx, text in enumerate(texts))
+        prompt = RERANK_PROMPT.format(query=query, passages=passages, count=len(texts))
+        return [{"role": "system", "content": "You are a precise search relevance judge."},
+                {"role": "user", "content": prompt}]
+
+    def score(self, query: str, texts: List[str], timeout: Optional[float]) -> List[float]:
+        # a single attempt, bounded by the time left, retrying would blow the deadline anyway
+        raw_response = openai.ChatCompletion.create(
+            model=self.model,
+            messages=self.get_messages(query, texts),
+            temperature=0,
+            max_tokens=8 * len(texts) + 16,
+            api_key=self.api_key,
+            request_timeout=timeout,
+        )
+        record_usage(self.model, raw_response)
+        return parse_json(raw_response['choices'][0]['message']['content'])
+
+    async def ascore(self, query: str, texts: List[str], timeout: Optional[float]) -> List[float]:
+        if self.llm is None:
+            return await super().ascore(query, texts, timeout)
+        raw_response = await self.llm.create(self.get_messages(query, texts), model=self.model, temperature=0,
+                                             max_tokens=8 * len(texts) + 16)
+        return parse_json(raw_response['choices'][0]['message']['content'])
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Scores (query, passage) pairs with a local cross-encoder from sentence-transformers. Needs no API calls, a small
+    model like the default scores a few dozen passages in tens of milliseconds on a CPU.
+    """
+    name = "cross_encoder_rerank"
+
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size=32, device=None,
+                 cache_size=10000, default_latency=0.2):
+        """
+        :param model_name: str, a sentence-transformers cross-encoder
+        :param batch_size: int, pairs per forward pass
+        :param device: str, e.g. "cpu" or "cuda", picked automatically by default
+        """
+        if CrossEncoder is None:
+            raise ImportError("CrossEncoderReranker needs sentence-transformers, `pip install sentence-transformers`")
+        super().__init__(cache_size=cache_size, default_latency=default_latency)
+        self.model = CrossEncoder(model_name, device=device)
+        self.batch_size = batch_size
+
+    def score(self, query: str, texts: List[str], timeout: Optional[float]) -> List[float]:
+        # a local forward pass can't be interrupted, the budget check before it is what bounds it
+        scores = self.model.predict([(query, text) for text in texts], batch_size=self.batch_size)
+        return [float(score) for score in scores]
+
+
+def get_reranker(kind: Optional[str], **kwargs) -> Optional[Reranker]:
+    """
+    :param kind: str, "llm", "cross_encoder" or None for no re-ranking
+    """
+    if kind is None:
+        return None
+    if kind == "llm":
+        return LLMReranker(**kwargs)
+    if kind == "cross_encoder":
+        return CrossEncoderReranker(**kwargs)
+    raise ValueError(f"Unknown re-ranker {kind}, use 'llm' or 'cross_encoder'")
@@ -0,0 +1,291 @@
+import asyncio
+import email.utils
+import threading
+import time
+from typing import Dict, Optional
+
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, stop_after_delay
+from tenacity.wait import wait_base, wait_random_exponential
+
+from .metrics import RESILIENCE_EVENTS
+
+# ! Errors ====================================================================
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for {name} is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# matched by class name (anywhere in the mro) so this module doesn't import openai, requests or aiohttp
+RETRYABLE_ERRORS = {
+    # openai
+    "Timeout", "APIConnectionError", "ServiceUnavailableError", "TryAgain", "RateLimitError",
+    # requests
+    "ConnectionError", "ConnectTimeout", "ReadTimeout", "ChunkedEncodingError",
+    # aiohttp / asyncio
+    "ClientConnectionError", "ServerDisconnectedError", "ClientPayloadError", "TimeoutError",
+}
+
+
+def get_status(exception: BaseException) -> Optional[int]:
+    for attr in ("http_status", "status", "status_code"):
+        status = getattr(exception, attr, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(exception, "response", None)
+    status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def get_retry_after(exception: BaseException) -> Optional[float]:
+    """
+    Seconds from a Retry-After header on the exception (openai and aiohttp errors) or its response (requests).
+    """
+    if isinstance(exception, CircuitOpenError):
+        return exception.retry_after
+    headers = getattr(exception, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(exception, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_retryable(exception: BaseException) -> bool:
+    """
+    Transient failures: timeouts, dropped connections, 429s and 5xxs. Client errors (bad requests, auth) aren't.
+    """
+    if isinstance(exception, (CircuitOpenError, DeadlineExceeded)):
+        return False
+    status = get_status(exception)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    if isinstance(exception, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(exception).__mro__)
+
+# ! Circuit Breaker ===========================================================
+
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint after failure_threshold consecutive transient failures. After recovery_timeout a
+    single probe call is let through (half open), its result closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold=5, recovery_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> None:
+        """
+        :raises CircuitOpenError: if the call shouldn't go out
+        """
+        with self.lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.recovery_timeout - time.monotonic()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+                RESILIENCE_EVENTS.inc(endpoint=self.name, event="half_open")
+                return
+        RESILIENCE_EVENTS.inc(endpoint=self.name, event="rejected")
+        raise CircuitOpenError(self.name, max(remaining, 0.0))
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.state != "closed":
+                RESILIENCE_EVENTS.inc(endpoint=self.name, event="closed")
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                RESILIENCE_EVENTS.inc(endpoint=self.name, event="opened")
+                print(f"Circuit for {self.name} opened after {self.failures} failures")
+
+    def record_cancelled(self) -> None:
+        """
+        A cancelled call says nothing about the endpoint, but a cancelled probe has to give the half open slot back,
+        otherwise every later call is rejected. The circuit goes back to open with the recovery timeout already
+        spent, so the next call probes again.
+        """
+        with self.lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """
+    One breaker per endpoint name, shared by every client and policy calling it.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+# ! Policy ====================================================================
+
+
+class wait_retry_after(wait_base):
+    """
+    Honor the server's Retry-After when there is one, otherwise full jitter exponential backoff, never sleeping
+    past the call's deadline.
+    """
+
+    def __init__(self, policy, start: float):
+        self.policy = policy
+        self.start = start
+        self.backoff = wait_random_exponential(multiplier=policy.min_wait, max=policy.max_wait)
+
+    def __call__(self, retry_state) -> float:
+        retry_after = get_retry_after(retry_state.outcome.exception())
+        wait = retry_after if retry_after is not None else self.backoff(retry_state)
+        return max(0.0, min(wait, self.policy.remaining(self.start)))
+
+
+class Policy:
+    """
+    Retries, per-attempt timeouts, an overall deadline and a circuit breaker for calls to one endpoint.
+    """
+
+    def __init__(self, name: str, attempts=4, deadline=120.0, timeout=60.0, min_wait=0.5, max_wait=20.0,
+                 timeout_arg: Optional[str] = None, breaker=True, failure_threshold=5, recovery_timeout=30.0):
+        """
+        :param name: str, the endpoint name, used for the breaker and in metrics
+        :param attempts: int, max attempts per call
+        :param deadline: float, seconds for the whole call including retries
+        :param timeout: float, seconds per attempt
+        :param min_wait: float, backoff multiplier in seconds
+        :param max_wait: float, max seconds between attempts
+        :param timeout_arg: str, sync calls get the attempt timeout passed as this keyword (e.g. "timeout")
+        :param breaker: bool, use the endpoint's circuit breaker
+        """
+        self.name = name
+        self.attempts = attempts
+        self.deadline = deadline
+        self.timeout = timeout
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.timeout_arg = timeout_arg
+        self.breaker = get_breaker(name, failure_threshold=failure_threshold,
+                                   recovery_timeout=recovery_timeout) if breaker else None
+
+    def remaining(self, start: float) -> float:
+        return self.deadline - (time.monotonic() - start)
+
+    def attempt_timeout(self, start: float) -> float:
+        remaining = self.remaining(start)
+        if remaining <= 0:
+            RESILIENCE_EVENTS.inc(endpoint=self.name, event="deadline")
+            raise DeadlineExceeded(f"{self.name} call exceeded its {self.deadline}s deadline")
+        return min(self.timeout, remaining)
+
+    def record(self, exception: Optional[BaseException]) -> None:
+        if self.breaker is None:
+            return
+        if exception is not None and not isinstance(exception, Exception):
+            # cancelled (asyncio.CancelledError, KeyboardInterrupt)
+            self.breaker.record_cancelled()
+            return
+        # a client error means the endpoint is up, only transient failures count against it
+        if exception is None or not is_retryable(exception):
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def before_sleep(self, retry_state) -> None:
+        exception = retry_state.outcome.exception()
+        RESILIENCE_EVENTS.inc(endpoint=self.name, event="retry")
+        print(f"{self.name} attempt {retry_state.attempt_number} failed ({exception!r}), "
+              f"retrying in {retry_state.next_action.sleep:.1f}s")
+
+    def retry_kwargs(self, start: float) -> Dict:
+        return {
+            "stop": stop_after_attempt(self.attempts) | stop_after_delay(self.deadline),
+            "wait": wait_retry_after(self, start),
+            "retry": retry_if_exception(is_retryable),
+            "before_sleep": self.before_sleep,
+            "reraise": True,
+        }
+
+    def attempt(self, start, fn, args, kwargs):
+        # the deadline is checked before allow(), which can take the half open probe slot
+        timeout = self.attempt_timeout(start)
+        if self.breaker is not None:
+            self.breaker.allow()
+        if self.timeout_arg is not None:
+            kwargs = {**kwargs, self.timeout_arg: timeout}
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.record(e)
+            raise
+        self.record(None)
+        return result
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs) under the policy. Sync calls can't be interrupted, so set timeout_arg to pass the
+        attempt timeout to the underlying client.
+        """
+        start = time.monotonic()
+        try:
+            return Retrying(**self.retry_kwargs(start))(self.attempt, start, fn, args, kwargs)
+        except Exception:
+            RESILIENCE_EVENTS.inc(endpoint=self.name, event="failed")
+            raise
+
+    async def aattempt(self, start, fn, args, kwargs):
+        timeout = self.attempt_timeout(start)
+        if self.breaker is not None:
+            self.breaker.allow()
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), timeout=timeout)
+        except BaseException as e:
+            self.record(e)
+            raise
+        self.record(None)
+        return result
+
+    async def acall(self, fn, *args, **kwargs):
+        """
+        Await fn(*args, **kwargs) under the policy, each attempt is cancelled at its timeout.
+        """
+        start = time.monotonic()
+        try:
+            return await AsyncRetrying(**self.retry_kwargs(start))(self.aattempt, start, fn, args, kwargs)
+        except Exception:
+            RESILIENCE_EVENTS.inc(endpoint=self.name, event="failed")
+            raise
@@ -0,0 +1,271 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from .utils import TokenUtil
+
+# every message costs a few tokens of formatting on top of its content
+TOKENS_PER_MESSAGE = 4
+
+HISTORY_SUMMARY_PROMPT = """Summarize the earlier part of this conversation as concisely as possible. Keep every fact, name, number, decision and open question the assistant may need later.
+
+{summary}
+
+{text}
+
+SUMMARY:"""
+
+# ! Messages ==================================================================
+
+
+class Message:
+    """
+    One chat message with its token count cached, so budgeting the history never re-tokenizes it.
+    """
+    __slots__ = ("role", "content", "tokens", "extra")
+
+    def __init__(self, role: str, content: Optional[str], tokens: int, extra: Optional[Dict] = None):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+        self.extra = extra  # e.g. function_call or name, None for plain messages
+
+    def to_dict(self) -> Dict:
+        message = {"role": self.role, "content": self.content}
+        if self.extra:
+            message.update(self.extra)
+        return message
+
+
+class Session:
+    """
+    A chat history: the system message, an optional running summary of trimmed messages and the recent messages.
+    """
+
+    def __init__(self, session_id: str, system_message: Optional[Message] = None):
+        self.id = session_id
+        self.system = system_message
+        self.messages: List[Message] = []
+        self.summary: Optional[Message] = None
+        self.offset = 0  # position of messages[0] in the full history, everything before it is trimmed
+        self.persisted = 0  # messages[:persisted] are already in the store
+        self.last_sent: List[Message] = []
+        self.prefix_tokens = 0  # total prompt tokens that repeated the previous request's prefix
+        self.last_prefix_tokens = 0
+        self.sent_tokens = 0
+
+    def tokens(self) -> int:
+        total = sum(message.tokens for message in self.messages)
+        for message in (self.system, self.summary):
+            if message is not None:
+                total += message.tokens
+        return total
+
+    def trim(self, budget: int, low_water: float = 0.75, summarize: Optional[Callable[[str, str], str]] = None,
+             count: Optional[Callable[[str], int]] = None) -> List[Message]:
+        """
+        Drop the oldest messages once the history goes over budget. Trims down to low_water * budget rather than just
+        under it, so the prompt prefix stays the same for the next few turns instead of shifting every turn.
+
+        :param summarize: function(previous summary, dropped text) -> summary, fold dropped messages into a summary
+            instead of forgetting them
+        :return: list, the dropped messages
+        """
+        if self.tokens() <= budget or len(self.messages) <= 1:
+            return []
+
+        target = budget * low_water
+        total = self.tokens()
+        dropped = []
+        # always keep the newest message
+        while len(self.messages) > 1 and total > target:
+            message = self.messages.pop(0)
+            dropped.append(message)
+            total -= message.tokens
+            self.persisted = max(0, self.persisted - 1)
+        self.offset += len(dropped)
+
+        if summarize is not None and dropped:
+            text = "\n".join(f"{message.role}: {message.content}" for message in dropped if message.content)
+            previous = self.summary.content if self.summary is not None else ""
+            summary = summarize(previous, text)
+            content = f"Summary of the earlier conversation:\n{summary}"
+            self.summary = Message("system", content, count(content) + TOKENS_PER_MESSAGE)
+        return dropped
+
+    def get_messages(self) -> List[Dict]:
+        """
+        The messages to send, and account how much of it repeats the previous request's prefix (what a provider
+        side prompt cache could reuse).
+        """
+        sent = [message for message in (self.system, self.summary) if message is not None] + self.messages
+        prefix = 0
+        for previous, message in zip(self.last_sent, sent):
+            if previous is not message:
+                break
+            prefix += message.tokens
+        self.last_prefix_tokens = prefix
+        self.prefix_tokens += prefix
+        self.sent_tokens += sum(message.tokens for message in sent)
+        self.last_sent = sent
+        return [message.to_dict() for message in sent]
+
+    def history(self) -> List[Dict]:
+        # the in-memory history, trimmed messages are only kept in the sqlite store
+        return [message.to_dict() for message in self.messages]
+
+# ! Store =====================================================================
+
+
+class SessionStore:
+    """
+    Sessions by id, in an in-memory LRU and optionally persisted to SQLite. Messages are written through after each
+    turn, so an evicted session is reloaded from SQLite (only its untrimmed messages) when it's used again.
+    """
+
+    def __init__(self, max_sessions=1024, path: Optional[str] = None, model="gpt-3.5-turbo-0613"):
+        """
+        :param max_sessions: int, sessions kept in memory
+        :param path: str, optional SQLite database path
+        :param model: str, the model whose tokenizer counts message tokens
+        """
+        self.max_sessions = max_sessions
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.token_util = TokenUtil(model)
+        self.lock = threading.RLock()
+        self.conn = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY, system TEXT, summary TEXT, start_idx INTEGER, updated REAL
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    session_id TEXT, idx INTEGER, role TEXT, content TEXT, tokens INTEGER, extra TEXT,
+                    PRIMARY KEY (session_id, idx)
+                ) WITHOUT ROWID;
+            """)
+
+    def count(self, text: Optional[str]) -> int:
+        return self.token_util.get_tokens(text) if text else 0
+
+    def make_message(self, role: str, content: Optional[str], **extra) -> Message:
+        tokens = self.count(content) + TOKENS_PER_MESSAGE
+        if extra.get("function_call"):
+            tokens += self.count(json.dumps(extra["function_call"]))
+        return Message(role, content, tokens, extra or None)
+
+    def new_session(self, session_id: Optional[str] = None, system_message: Optional[str] = None) -> Session:
+        system = self.make_message("system", system_message) if system_message else None
+        return Session(session_id or uuid.uuid4().hex, system)
+
+    def get(self, session_id: str, system_message: Optional[str] = None) -> Session:
+        """
+        Get a session, loading it from SQLite or creating it (with system_message) if it doesn't exist.
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.load(session_id) or self.new_session(session_id, system_message)
+                self.sessions[session_id] = session
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def load(self, session_id: str) -> Optional[Session]:
+        if self.conn is None:
+            return None
+        row = self.conn.execute("SELECT system, summary, start_idx FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        system, summary, offset = row
+        session = self.new_session(session_id, system)
+        if summary:
+            session.summary = Message("system", summary, self.count(summary) + TOKENS_PER_MESSAGE)
+        session.offset = offset
+        rows = self.conn.execute(
+            "SELECT role, content, tokens, extra FROM messages WHERE session_id = ? AND idx >= ? ORDER BY idx",
+            (session_id, offset),
+        ).fetchall()
+        session.messages = [Message(role, content, tokens, json.loads(extra) if extra else None)
+                            for role, content, tokens, extra in rows]
+        session.persisted = len(session.messages)
+        return session
+
+    def save(self, session: Session) -> None:
+        """
+        Write the session's new messages and its summary/offset. A no-op without SQLite.
+        """
+        if self.conn is None:
+            return
+        with self.lock:
+            new = [
+                (session.id, session.offset + idx, message.role, message.content, message.tokens,
+                 json.dumps(message.extra) if message.extra else None)
+                for idx, message in enumerate(session.messages[session.persisted:], start=session.persisted)
+            ]
+            with self.conn:
+                # messages removed from the end of the history (by editing it) leave the store too
+                self.conn.execute("DELETE FROM messages WHERE session_id = ? AND idx >= ?",
+                                  (session.id, session.offset + len(session.messages)))
+                self.conn.executemany("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?)", new)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                    (session.id, session.system.content if session.system else None,
+                     session.summary.content if session.summary else None, session.offset, time.time()),
+                )
+            session.persisted = len(session.messages)
+
+    def trim(self, session: Session, budget: int, low_water: float = 0.75,
+             summarize: Optional[Callable[[str, str], str]] = None) -> List[Message]:
+        """
+        Trim a session to its token budget, saving it first so trimmed messages stay in the full history, and after
+        so a reload starts where the trimmed history does.
+        """
+        if session.tokens() <= budget:
+            return []
+        self.save(session)
+        dropped = session.trim(budget, low_water=low_water, summarize=summarize, count=self.count)
+        self.save(session)
+        return dropped
+
+    def full_history(self, session_id: str) -> List[Dict]:
+        """
+        Every message of a session including trimmed ones (needs SQLite for those).
+        """
+        if self.conn is None:
+            session = self.sessions.get(session_id)
+            return session.history() if session else []
+        rows = self.conn.execute(
+            "SELECT role, content, extra FROM messages WHERE session_id = ? ORDER BY idx", (session_id,)
+        ).fetchall()
+        return [Message(role, content, 0, json.loads(extra) if extra else None).to_dict() for role, content, extra in rows]
+
+    def delete(self, session_id: str) -> None:
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                    self.conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+_default_store = None
+
+
+def get_default_store() -> SessionStore:
+    """
+    The in-memory store used by Chat(session_id=...) when no store is passed.
+    """
+    global _default_store
+    if _default_store is None:
+        _default_store = SessionStore()
+    return _default_store
@@ -0,0 +1,117 @@
+import heapq
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+METRICS = ("cosine", "dot", "l2")
+DTYPES = {"float16": np.float16, "float32": np.float32, "float64": np.float64}
+
+# blocks of vectors are sized to stay in a typical per-core L2 cache while they're scored
+L2_CACHE_BYTES = 1 << 20
+MIN_BLOCK_ROWS = 64
+
+# ! Preparing vectors =========================================================
+
+
+def check_metric(metric: str, dtype: str) -> None:
+    if metric not in METRICS:
+        raise ValueError(f"Metric must be one of {METRICS}, got {metric}")
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype must be one of {list(DTYPES)}, got {dtype}")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale rows to unit length (zero rows stay zero).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def prepare(embeddings, metric="cosine", dtype="float32") -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert embeddings once at ingest: normalized for cosine, cast to the storage dtype, plus the squared norms l2
+    needs (computed before the cast, so float16 storage doesn't skew distances).
+
+    :return: tuple, (vectors, squared norms or None)
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if metric == "cosine":
+        vectors = normalize(vectors)
+    norms = np.einsum("ij,ij->i", vectors, vectors) if metric == "l2" else None
+    return vectors.astype(DTYPES[dtype], copy=False), norms
+
+
+def prepare_query(embedding, metric="cosine", dtype="float32") -> np.ndarray:
+    query = np.asarray(embedding, dtype=np.float32)
+    if metric == "cosine":
+        query = normalize(query)
+    # float16 is only a storage type, its blocks are upcast to float32 to be scored, so the query stays float32
+    return query.astype(np.float64) if dtype == "float64" else query
+
+# ! Scoring ===================================================================
+
+
+def block_rows(dim: int, itemsize: int, cache_bytes=L2_CACHE_BYTES) -> int:
+    return max(MIN_BLOCK_ROWS, cache_bytes // max(1, dim * max(itemsize, 4)))
+
+
+def score_block(block: np.ndarray, query: np.ndarray, metric: str, norms: Optional[np.ndarray]) -> np.ndarray:
+    """
+    Scores where higher is better: cosine and dot similarity, or the negated squared distance for l2.
+    """
+    if block.dtype == np.float16:
+        # numpy has no BLAS kernel for float16 (a float16 matmul, or einsum accumulating in float32, is slower still),
+        # so float16 only saves memory and each cache-sized block is upcast to be scored
+        block = block.astype(np.float32)
+    scores = block @ query
+    if metric == "l2":
+        scores = 2 * scores - norms - float(query @ query)
+    return scores
+
+
+def top_k_rows(vectors: np.ndarray, query: np.ndarray, k: int, metric="cosine", norms: Optional[np.ndarray] = None,
+               alive: Optional[np.ndarray] = None, rows_per_block: Optional[int] = None) -> List[Tuple[float, int]]:
+    """
+    The k best rows of vectors for the query, scored in L2-sized blocks with a heap keeping the best across blocks.
+
+    :param vectors: np.ndarray, (rows, dim) vectors from prepare()
+    :param query: np.ndarray, the query from prepare_query()
+    :param norms: np.ndarray, squared norms from prepare(), needed for l2
+    :param alive: np.ndarray, optional mask, rows that are False are skipped
+    :return: list, (score, row) best first
+    """
+    num_rows = len(vectors)
+    if num_rows == 0 or k <= 0:
+        return []
+    step = rows_per_block or block_rows(vectors.shape[1], vectors.dtype.itemsize)
+    heap: List[Tuple[float, int]] = []
+    for start in range(0, num_rows, step):
+        stop = min(start + step, num_rows)
+        scores = score_block(vectors[start:stop], query, metric, norms[start:stop] if norms is not None else None)
+        if alive is not None:
+            scores = np.where(alive[start:stop], scores, -np.inf)
+        block_k = min(k, stop - start)
+        best = np.argpartition(scores, -block_k)[-block_k:]
+        for row in best:
+            score = float(scores[row])
+            if score == -np.inf:
+                continue
+            if len(heap) < k:
+                heapq.heappush(heap, (score, start + int(row)))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, start + int(row)))
+    return sorted(heap, reverse=True)
+
+
+def merge_top_k(results: Iterable[Iterable[Tuple]], k: int) -> List[Tuple]:
+    """
+    Merge per-segment (score, ...) results into the overall k best.
+    """
+    return heapq.nlargest(k, (item for result in results for item in result), key=lambda item: item[0])
+
+
+def to_similarity(score: float, metric: str) -> float:
+    # l2 is scored by negated squared distance, report the negated distance
+    return -float(np.sqrt(max(-score, 0.0))) if metric == "l2" else score
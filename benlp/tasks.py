@@ -0,0 +1,146 @@
+from typing import Dict, List, Set
+
+
+def parse_dependencies(task: Dict) -> List[str]:
+    """
+    Return the names of the tasks a task depends on. Accepts a list or a comma separated string.
+    """
+    deps = task.get("depends_on") or []
+    if isinstance(deps, str):
+        deps = [dep.strip() for dep in deps.split(",")]
+    return [dep for dep in deps if dep]
+
+
+class TaskGraph:
+    """
+    A dependency DAG built from a task list (as produced by BaseAgent.generate_tasks).
+
+    Tasks are keyed by name, a repeated name gets a suffix ("name-2") instead of replacing the earlier task.
+    Dependencies on tasks that don't exist are dropped with a warning, since the model sometimes references tasks it
+    never generated. When tasks are streamed in with add(), a dependency on a task that hasn't arrived yet holds the
+    task back until it does, or until finish() once the whole list is in.
+    """
+
+    def __init__(self, tasks: List[Dict] = None):
+        self.tasks = {}
+        self.dependencies: Dict[str, Set[str]] = {}
+        self.unresolved: Dict[str, Set[str]] = {}  # task name -> dependencies that haven't arrived
+        for idx, task in enumerate(tasks or []):
+            self.register(task, idx)
+
+        for name, task in self.tasks.items():
+            deps = set(parse_dependencies(task)) - {name}
+            self.dependencies[name] = deps & self.tasks.keys()
+            if deps - self.tasks.keys():
+                self.unresolved[name] = deps - self.tasks.keys()
+        self.finish()
+        self.check_cycles()
+
+    def register(self, task: Dict, idx: int) -> str:
+        name = task.get("name") or f"task{idx + 1}"
+        if name in self.tasks:
+            suffix = 2
+            while f"{name}-{suffix}" in self.tasks:
+                suffix += 1
+            print(f"Task name {name} is repeated, renaming the later task to {name}-{suffix}")
+            name = f"{name}-{suffix}"
+        task["name"] = name
+        self.tasks[name] = task
+        return name
+
+    def add(self, task: Dict) -> Dict:
+        """
+        Add a task to the graph as it arrives (e.g. while the task list is still streaming).
+
+        Dependencies on tasks that haven't arrived yet are kept pending and resolved when they do. A resolved
+        dependency that would close a cycle is dropped instead.
+        """
+        name = self.register(task, len(self.tasks))
+        deps = set(parse_dependencies(task)) - {name}
+        self.dependencies[name] = deps & self.tasks.keys()
+        if deps - self.tasks.keys():
+            self.unresolved[name] = deps - self.tasks.keys()
+
+        # tasks that were waiting for this one
+        for waiting, missing in list(self.unresolved.items()):
+            if name not in missing:
+                continue
+            missing.discard(name)
+            if self.depends_on(name, waiting):
+                print(f"Dropping the dependency of {waiting} on {name}, it would create a cycle")
+            else:
+                self.dependencies[waiting].add(name)
+            if not missing:
+                del self.unresolved[waiting]
+        return task
+
+    def finish(self) -> None:
+        """
+        Call once every task has arrived. Dependencies on tasks that never did are dropped, releasing the tasks that
+        were waiting on them.
+        """
+        for name, missing in self.unresolved.items():
+            print(f"Task {name} depends on {', '.join(sorted(missing))}, which doesn't exist, ignoring it")
+        self.unresolved = {}
+
+    def depends_on(self, name: str, other: str) -> bool:
+        """
+        Whether a task depends on another, directly or transitively.
+        """
+        stack, seen = [name], set()
+        while stack:
+            current = stack.pop()
+            if current == other:
+                return True
+            if current not in seen:
+                seen.add(current)
+                stack.extend(self.dependencies.get(current, ()))
+        return False
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def check_cycles(self):
+        """
+        Raise a ValueError if the graph has a cycle.
+        """
+        visited = set()
+        visiting = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Task dependencies contain a cycle at: {name}")
+            visiting.add(name)
+            for dep in self.dependencies[name]:
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self.tasks:
+            visit(name)
+
+    def ready(self, done: Set[str], started: Set[str]) -> List[Dict]:
+        """
+        Return the tasks that haven't started and whose dependencies are all done (and have all arrived), in task
+        list order.
+        """
+        return [
+            task for name, task in self.tasks.items()
+            if name not in started and name not in self.unresolved and self.dependencies[name] <= done
+        ]
+
+    def levels(self) -> List[List[Dict]]:
+        """
+        Group the tasks into levels, where every task only depends on tasks in earlier levels.
+        """
+        levels = []
+        done = set()
+        while len(done) < len(self.tasks):
+            level = self.ready(done, done)
+            if not level:
+                raise ValueError(f"Tasks are waiting on dependencies that haven't arrived: {self.unresolved}")
+            levels.append(level)
+            done |= {task["name"] for task in level}
+        return levels
@@ -1,47 +1,642 @@
 import io
 import contextlib
+import hashlib
 import matplotlib.pyplot as plt
-import plotly.io as pio
 import os
+import sys
+import time
 import uuid
 import math
+import atexit
+import asyncio
+import threading
+import traceback
+import multiprocessing
+from collections import OrderedDict
+
+WARM_IMPORTS = ["numpy", "matplotlib", "matplotlib.pyplot"]
 
-from ..utils import random_6_digit_id
 
 def execute_code(code):
     buffer = io.StringIO()
     with contextlib.redirect_stdout(buffer):
         try:
-            # Bug fixed: https://stackoverflow.com/questions/29979313/python-weird-nameerror-name-is-not-defined-in-an-exec-environment
-            exec(code, globals())
+            # run in a fresh namespace so executions don't leak into (or read from) this module's globals
+            exec(code, {"__name__": "__main__"})
         except Exception as e:
             print(f"Error: {e}")
     output = buffer.getvalue()
     buffer.close()
     return output
 
+# ! Worker Process ============================================================
+
+
+def make_figure(kind, fmt, data, thumbnail=None):
+    return {
+        "kind": kind,
+        "format": fmt,
+        "data": data,
+        "hash": hashlib.sha256(data).hexdigest(),
+        "thumbnail": thumbnail,
+    }
+
+
+def capture_figures(namespace=None, formats=("png",), thumbnail_width=None, seen=None):
+    """
+    Render every figure produced by an execution, without executing anything again.
+
+    Open matplotlib figures (Agg backend) are rendered to in-memory buffers in each format and closed. Plotly figures
+    are picked up from the namespace and exported as HTML fragments; `seen` holds the ids of plotly figures that were
+    already returned so a figure kept in a variable isn't returned on every call.
+
+    :param namespace: dict, the execution namespace to look for plotly figures in
+    :param formats: tuple, matplotlib formats to render ("png", "svg")
+    :param thumbnail_width: int, also render a PNG thumbnail this many pixels wide (None to skip)
+    :param seen: set, ids of plotly figures already returned (updated in place)
+    :return: list, of figure dicts with the kind, format, bytes, content hash and optional thumbnail
+    """
+    figures = []
+    for num in plt.get_fignums():
+        fig = plt.figure(num)
+        thumbnail = None
+        if thumbnail_width:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format="png", dpi=thumbnail_width / fig.get_figwidth())
+            thumbnail = buffer.getvalue()
+        for fmt in formats:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format=fmt)
+            figures.append(make_figure("matplotlib", fmt, buffer.getvalue(), thumbnail))
+    plt.close("all")
+
+    # only look for plotly figures if the code imported plotly
+    if namespace is not None and "plotly" in sys.modules:
+        seen = seen if seen is not None else set()
+        for value in list(namespace.values()):
+            if type(value).__name__ == "Figure" and type(value).__module__.startswith("plotly") and id(value) not in seen:
+                seen.add(id(value))
+                html = value.to_html(full_html=False, include_plotlyjs="cdn")
+                figures.append(make_figure("plotly", "html", html.encode("utf-8")))
+    return figures
+
+
+class PipeWriter(io.TextIOBase):
+    """
+    A file-like object that streams complete lines back over the worker pipe while code is running.
+
+    Lines are sent right away unless one was sent in the last `interval` seconds, in which case they are batched and a
+    background thread flushes them, so print-heavy loops don't turn into one pipe message per line.
+    """
+
+    def __init__(self, conn, name, send_lock, interval=0.05):
+        self.conn = conn
+        self.name = name
+        self.send_lock = send_lock
+        self.interval = interval
+        self.buffer = ""
+        self.last_send = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.buffer += text
+        if "\n" in text and time.monotonic() - self.last_send >= self.interval:
+            self.send(complete_lines=True)
+        return len(text)
+
+    def flush(self):
+        self.send()
+
+    def send(self, complete_lines=False):
+        with self.send_lock:
+            end = self.buffer.rfind("\n") + 1 if complete_lines else len(self.buffer)
+            if end == 0:
+                return
+            text, self.buffer = self.buffer[:end], self.buffer[end:]
+            self.conn.send({"type": "stream", "name": self.name, "text": text})
+            self.last_send = time.monotonic()
+
+
+def worker_main(conn, memory_limit):
+    """
+    The loop run inside each worker process. Keeps one namespace per session and executes code sent over the pipe,
+    streaming stdout/stderr back as it is written and finishing each request with a "result" message. Requests can
+    carry session ids the pool expired ("drop"), and one-shot executions drop their namespace when they finish.
+    """
+    if memory_limit:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, ValueError):
+            pass
+
+    import matplotlib
+    matplotlib.use("Agg")
+    for module in WARM_IMPORTS:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+    namespaces = {}
+    seen_figures = {}  # session id -> ids of plotly figures already returned
+    send_lock = threading.Lock()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        for session_id in message.get("drop", ()):
+            namespaces.pop(session_id, None)
+            seen_figures.pop(session_id, None)
+
+        if message["type"] == "reset":
+            namespaces.pop(message["session_id"], None)
+            seen_figures.pop(message["session_id"], None)
+            conn.send({"type": "result", "error": None, "figures": []})
+            continue
+
+        namespace = namespaces.setdefault(message["session_id"], {"__name__": "__main__"})
+        stdout = PipeWriter(conn, "stdout", send_lock)
+        stderr = PipeWriter(conn, "stderr", send_lock)
+
+        # flush batched lines while long running code is still executing
+        running = threading.Event()
+        running.set()
+
+        def flush_periodically():
+            while running.is_set():
+                time.sleep(stdout.interval)
+                stdout.send(complete_lines=True)
+                stderr.send(complete_lines=True)
+
+        flusher = threading.Thread(target=flush_periodically, daemon=True)
+        flusher.start()
+
+        error = None
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                exec(compile(message["code"], "<session>", "exec"), namespace)
+            except MemoryError:
+                error = "MemoryError: memory limit exceeded"
+            except BaseException:
+                error = traceback.format_exc(limit=-3)
+
+        running.clear()
+        flusher.join()
+        stdout.send()
+        stderr.send()
+        options = message.get("options") or {}
+        try:
+            figures = capture_figures(
+                namespace,
+                formats=options.get("figure_formats", ("png",)),
+                thumbnail_width=options.get("thumbnail_width"),
+                seen=seen_figures.setdefault(message["session_id"], set()),
+            )
+        except Exception:
+            figures = []
+        if message.get("one_shot"):
+            namespaces.pop(message["session_id"], None)
+            seen_figures.pop(message["session_id"], None)
+        with send_lock:
+            conn.send({"type": "result", "error": error, "figures": figures})
+
+
+def collect(events):
+    """
+    Collect a stream of worker events into a single result dict with the combined "output".
+    """
+    output = ""
+    for event in events:
+        if event["type"] == "stream":
+            output += event["text"]
+        elif event["type"] == "result":
+            return {"output": output, "error": event["error"], "figures": event["figures"]}
+    return {"output": output, "error": None, "figures": []}
+
+
+async def iterate_in_thread(generator):
+    """
+    Iterate a blocking generator from async code without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    done = object()
+
+    def produce():
+        try:
+            for item in generator:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    producer = loop.run_in_executor(None, produce)
+    while True:
+        item = await queue.get()
+        if item is done:
+            break
+        yield item
+    await producer
+
+
+def get_context():
+    # forkserver preloads the warm imports once, so every worker (including restarts after a timeout) starts warm
+    if sys.platform != "win32" and "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(WARM_IMPORTS)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class Worker:
+    """
+    A single pre-started worker process and the pipe used to talk to it.
+    """
+
+    def __init__(self, context, memory_limit=None):
+        self.context = context
+        self.memory_limit = memory_limit
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=worker_main, args=(child_conn, self.memory_limit), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def restart(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        # namespaces lived in the old process
+        self.sessions = set()
+        self.start()
+
+    def stream(self, message, timeout=None):
+        """
+        Send a request and yield the worker's events as they arrive, ending with the "result" event.
+        """
+        with self.lock:
+            finished = False
+            try:
+                self.conn.send(message)
+                deadline = time.monotonic() + timeout if timeout else None
+                while True:
+                    remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                    if not self.conn.poll(remaining):
+                        self.restart()
+                        finished = True
+                        yield {"type": "result", "error": f"TimeoutError: execution exceeded {timeout} seconds", "figures": []}
+                        return
+                    event = self.conn.recv()
+                    finished = event["type"] == "result"
+                    yield event
+                    if finished:
+                        return
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                # the worker died, most likely from the memory limit
+                self.restart()
+                finished = True
+                yield {"type": "result", "error": "Worker crashed (memory limit exceeded?)", "figures": []}
+            finally:
+                if not finished:
+                    # the consumer stopped listening mid-execution, don't leave stale events on the pipe
+                    self.restart()
+
+    def request(self, message, timeout=None):
+        return collect(self.stream(message, timeout=timeout))
+
+    def memory_usage(self):
+        try:
+            import psutil
+            return psutil.Process(self.process.pid).memory_info().rss
+        except Exception:
+            return 0
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class WorkerPool:
+    """
+    A pool of warm worker processes for executing untrusted code.
+
+    Each session is pinned to one worker, which keeps an isolated namespace for it between executions. Executions are
+    limited by wall-clock time and memory; a worker that hits either limit is killed and replaced. Executions without
+    a session id are one-shot, their namespace is dropped when they finish. Sessions idle for longer than session_ttl
+    or beyond the max_sessions most recently used are expired.
+    """
+
+    def __init__(self, num_workers=2, memory_limit=1024 * 1024 * 1024, max_sessions=256, session_ttl=3600):
+        """
+        :param num_workers: int, number of worker processes
+        :param memory_limit: int, max address space per worker in bytes (None for no limit)
+        :param max_sessions: int, max live sessions, the least recently used are expired past it
+        :param session_ttl: float, seconds a session is kept after its last execution (None to keep it until reset)
+        """
+        context = get_context()
+        self.workers = [Worker(context, memory_limit) for _ in range(num_workers)]
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.session_workers = {}
+        self.last_used = OrderedDict()  # session id -> time of its last execution, least recently used first
+        self.pending_drops = {}  # worker -> expired session ids, sent along with the worker's next request
+        self.lock = threading.Lock()
+
+    def get_worker(self, session_id):
+        """
+        :return: tuple, (the session's worker, whether the session was just assigned to it)
+        """
+        with self.lock:
+            worker = self.session_workers.get(session_id)
+            fresh = worker is None or session_id not in worker.sessions
+            if fresh:
+                worker = min(self.workers, key=lambda w: len(w.sessions))
+                worker.sessions.add(session_id)
+                self.session_workers[session_id] = worker
+                # the worker may still hold the namespace from before the session expired, the request clears it
+                self.pending_drops.get(worker, set()).discard(session_id)
+            self.last_used[session_id] = time.monotonic()
+            self.last_used.move_to_end(session_id)
+            self.expire_sessions(keep=session_id)
+            return worker, fresh
+
+    def expire_sessions(self, keep=None):
+        """
+        Forget sessions idle for longer than session_ttl or beyond max_sessions, least recently used first. Call with
+        the lock held. The namespaces are dropped by the worker with its next request, so this never waits on a
+        running execution.
+        """
+        now = time.monotonic()
+        for session_id, last_used in list(self.last_used.items()):
+            idle = self.session_ttl is not None and now - last_used > self.session_ttl
+            if session_id == keep or not (idle or len(self.last_used) > self.max_sessions):
+                break
+            del self.last_used[session_id]
+            worker = self.session_workers.pop(session_id, None)
+            if worker is not None and session_id in worker.sessions:
+                worker.sessions.discard(session_id)
+                self.pending_drops.setdefault(worker, set()).add(session_id)
+
+    def checkout(self, session_id, code, options):
+        """
+        The worker to run code on and the request to send it. A session id of None is a one-shot execution on the
+        least loaded worker.
+        """
+        one_shot = session_id is None
+        if one_shot:
+            with self.lock:
+                worker = min(self.workers, key=lambda w: len(w.sessions))
+            session_id, fresh = uuid.uuid4().hex, True
+        else:
+            worker, fresh = self.get_worker(session_id)
+        with self.lock:
+            drop = list(self.pending_drops.pop(worker, ()))
+        if fresh:
+            drop.append(session_id)
+        message = {"type": "exec", "session_id": session_id, "code": code, "options": options, "one_shot": one_shot,
+                   "drop": drop}
+        return worker, message
+
+    def execute(self, session_id, code, timeout=30, options=None):
+        """
+        Execute code in the session's namespace.
+
+        :param session_id: str, the session (None for a one-shot execution)
+        :param options: dict, figure options ("figure_formats", "thumbnail_width")
+        :return: dict, with the captured "output", an "error" traceback (or None) and rendered "figures"
+        """
+        worker, message = self.checkout(session_id, code, options)
+        return worker.request(message, timeout=timeout)
+
+    def stream(self, session_id, code, timeout=30, options=None):
+        """
+        Execute code in the session's namespace, yielding stdout/stderr events as they are written.
+        """
+        worker, message = self.checkout(session_id, code, options)
+        yield from worker.stream(message, timeout=timeout)
+
+    def reset(self, session_id):
+        with self.lock:
+            worker = self.session_workers.pop(session_id, None)
+            self.last_used.pop(session_id, None)
+        if worker is not None and session_id in worker.sessions:
+            worker.sessions.discard(session_id)
+            worker.request({"type": "reset", "session_id": session_id}, timeout=5)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = WorkerPool()
+            atexit.register(_default_pool.close)
+        return _default_pool
+
+# ! Kernels ===================================================================
+
+
+class KernelManager:
+    """
+    Dedicated, stateful kernels (one worker process each) keyed by session id.
+
+    Kernels keep their variables between calls. Idle kernels are evicted least recently used first once there are
+    more than `max_kernels` or their combined memory exceeds `max_memory`.
+    """
+
+    def __init__(self, max_kernels=8, max_memory=4 * 1024 * 1024 * 1024, memory_limit=1024 * 1024 * 1024):
+        """
+        :param max_kernels: int, max number of live kernels
+        :param max_memory: int, max combined resident memory of all kernels in bytes
+        :param memory_limit: int, max address space per kernel in bytes
+        """
+        self.context = get_context()
+        self.max_kernels = max_kernels
+        self.max_memory = max_memory
+        self.memory_limit = memory_limit
+        self.kernels = OrderedDict()  # session id -> Worker, least recently used first
+        self.lock = threading.Lock()
+
+    def __contains__(self, session_id):
+        return session_id in self.kernels
+
+    def get(self, session_id):
+        with self.lock:
+            kernel = self.kernels.get(session_id)
+            if kernel is None:
+                kernel = Worker(self.context, self.memory_limit)
+                self.kernels[session_id] = kernel
+            self.kernels.move_to_end(session_id)
+        self.evict(keep=session_id)
+        return kernel
+
+    def memory_usage(self):
+        return sum(kernel.memory_usage() for kernel in list(self.kernels.values()))
+
+    def evict(self, keep=None):
+        """
+        Close idle kernels, least recently used first, until the kernel count and memory are under their limits.
+        """
+        while len(self.kernels) > self.max_kernels or self.memory_usage() > self.max_memory:
+            with self.lock:
+                idle = [
+                    session_id for session_id, kernel in self.kernels.items()
+                    if session_id != keep and not kernel.lock.locked()
+                ]
+                if not idle:
+                    return
+                kernel = self.kernels.pop(idle[0])
+            print(f"Evicting kernel for session {idle[0]}")
+            kernel.close()
+
+    def stream(self, session_id, code, timeout=30, options=None):
+        """
+        Execute code in the session's kernel, yielding {"type": "stream", "name": "stdout"|"stderr", "text": ...}
+        events as output is written and a final {"type": "result", ...} event.
+        """
+        kernel = self.get(session_id)
+        yield from kernel.stream({"type": "exec", "session_id": session_id, "code": code, "options": options}, timeout=timeout)
+        self.evict(keep=session_id)
+
+    def astream(self, session_id, code, timeout=30, options=None):
+        """
+        Async version of stream().
+        """
+        return iterate_in_thread(self.stream(session_id, code, timeout=timeout, options=options))
+
+    def execute(self, session_id, code, timeout=30, options=None):
+        return collect(self.stream(session_id, code, timeout=timeout, options=options))
+
+    def close_session(self, session_id):
+        with self.lock:
+            kernel = self.kernels.pop(session_id, None)
+        if kernel is not None:
+            kernel.close()
+
+    def close(self):
+        for session_id in list(self.kernels):
+            self.close_session(session_id)
+
+# ! Code Executor =============================================================
+
+
 class CodeExecutor:
-    def __init__(self, output_dir='output'):
+    def __init__(self, output_dir='output', session_id=None, pool=None, timeout=30, figure_formats=("png",), thumbnail_width=None):
+        """
+        :param output_dir: str, where plots are saved
+        :param session_id: str, executions with the same session id share variables (by default every execution
+            runs in a fresh namespace that is dropped after it)
+        :param pool: WorkerPool, defaults to a shared pool
+        :param timeout: float, wall-clock limit per execution in seconds
+        :param figure_formats: tuple, formats matplotlib figures are rendered to ("png", "svg")
+        :param thumbnail_width: int, also render PNG thumbnails this many pixels wide (None to skip)
+        """
         self.output = None
+        self.figures = []
         self.output_dir = output_dir
+        self.session_id = session_id
+        self.pool = pool
+        self.timeout = timeout
+        self.options = {"figure_formats": tuple(figure_formats), "thumbnail_width": thumbnail_width}
         os.makedirs(output_dir, exist_ok=True)
 
     def execute_code(self, code):
-        self.output = execute_code(code)
+        pool = self.pool or get_default_pool()
+        result = pool.execute(self.session_id, code, timeout=self.timeout, options=self.options)
+        self.output = result["output"]
+        if result["error"]:
+            self.output += f"Error: {result['error']}"
+        self.figures = result["figures"]
+        return self
+
+    def stream_code(self, code):
+        """
+        Execute code, yielding stdout/stderr events as they are written. The final event is the "result".
+        """
+        pool = self.pool or get_default_pool()
+        output = ""
+        for event in pool.stream(self.session_id, code, timeout=self.timeout, options=self.options):
+            if event["type"] == "stream":
+                output += event["text"]
+            else:
+                self.output = output + (f"Error: {event['error']}" if event["error"] else "")
+                self.figures = event["figures"]
+            yield event
+
+    def reset(self):
+        if self.session_id is not None:
+            (self.pool or get_default_pool()).reset(self.session_id)
         return self
 
     def get_output(self):
         return self.output
 
-    def save_matplotlib_plot(self, code):
-        file_path = os.path.join(self.output_dir, f'{random_6_digit_id()}.png')
-        exec(code)
-        plt.savefig(file_path)
-        plt.close()
+    def get_figures(self, kind=None, fmt=None):
+        return [
+            figure for figure in self.figures
+            if (kind is None or figure["kind"] == kind) and (fmt is None or figure["format"] == fmt)
+        ]
+
+    def save_figure(self, figure, thumbnail=False):
+        """
+        Write a figure to the output dir under its content hash. Identical figures are only written once.
+        """
+        data = figure["thumbnail"] if thumbnail else figure["data"]
+        ext = "png" if thumbnail else figure["format"]
+        suffix = "_thumb" if thumbnail else ""
+        file_path = os.path.join(self.output_dir, f'{figure["hash"][:16]}{suffix}.{ext}')
+        if not os.path.exists(file_path):
+            with open(file_path, "wb") as f:
+                f.write(data)
         return file_path
 
+    def save_figures(self):
+        """
+        Save every figure (and thumbnail) from the last execution, returning the file paths.
+        """
+        paths = []
+        for figure in self.figures:
+            paths.append(self.save_figure(figure))
+            if figure["thumbnail"] is not None:
+                paths.append(self.save_figure(figure, thumbnail=True))
+        return paths
+
+    def save_matplotlib_plot(self, code):
+        """
+        Execute the code once and save the first matplotlib figure it produced.
+        """
+        figures = self.execute_code(code).get_figures(kind="matplotlib")
+        if not figures:
+            return None
+        return self.save_figure(figures[0])
+
     def save_plotly_plot(self, code):
-        file_path = os.path.join(self.output_dir, f'{random_6_digit_id()}.html')
-        fig = exec(code)
-        pio.write_html(fig, file_path)
-        return file_path
\ No newline at end of file
+        """
+        Execute the code once and save the first plotly figure it produced as html.
+        """
+        figures = self.execute_code(code).get_figures(kind="plotly")
+        if not figures:
+            return None
+        return self.save_figure(figures[0])
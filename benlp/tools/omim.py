@@ -3,10 +3,20 @@ import os
 import sys
 load_dotenv(".env")
 
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 from pydantic import BaseModel, Field
 from typing import List, Optional, Union
 
+from ..cache import DiskCache, Coalescer, make_key, DEFAULT_CACHE_DIR
+from ..metrics import span, SEARCH_LATENCY
+from ..resilience import Policy, CircuitOpenError, DeadlineExceeded
+
 class EntryParams(BaseModel):
     mim_number: Union[int, List[int]]
     include: List[str] = [
@@ -64,37 +74,161 @@ class GeneMapParams(BaseModel):
     limit: int = 10
     phenotype_exists: bool = None
 
+# the API rejects entry/clinicalSynopsis requests with more than 20 mim numbers
+MAX_MIM_NUMBERS_PER_REQUEST = 20
+
+
+def batched(items, batch_size):
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket limiting how many requests are sent per second.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: float, requests per second
+        :param burst: int, max requests sent back to back (defaults to rate)
+        """
+        self.rate = rate
+        self.capacity = burst or max(int(rate), 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
 class OMIM:
-    def __init__(self):
+    """
+    OMIM API client.
+
+    Requests go through one pooled keep-alive session. Responses are cached on disk (keyed by the normalized request
+    params, without the API key) since entries rarely change, and concurrent identical lookups share a single
+    in-flight request.
+    """
+
+    def __init__(self, base_url="https://api.omim.org/api", cache_dir=os.path.join(DEFAULT_CACHE_DIR, "omim"),
+                 cache_ttl=7 * 24 * 60 * 60, pool_size=16, timeout=30, rate_limit=4, max_workers=4, mirror=None):
+        """
+        :param base_url: str, the API base url (point it at a local stub for tests)
+        :param cache_dir: str, where responses are cached (None to disable caching)
+        :param cache_ttl: float, seconds before a cached response expires
+        :param pool_size: int, max keep-alive connections
+        :param timeout: float, request timeout in seconds
+        :param rate_limit: float, max requests per second sent to the API (cache hits don't count)
+        :param max_workers: int, max concurrent requests for the bulk methods
+        :param mirror: OMIMMirror, a local mirror that is queried before the live API
+        """
         self.api_key = os.environ.get("OMIM_API_KEY")
-        self.base_url = "https://api.omim.org/api"
+        self.base_url = base_url
         self.tool_desctption = "OMIM API"
+        self.timeout = timeout
+        # retries with backoff (honoring Retry-After) and a breaker so a down API fails fast
+        self.policy = Policy("omim", attempts=3, deadline=3 * timeout, timeout=timeout, timeout_arg="timeout")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.cache = DiskCache(cache_dir, ttl=cache_ttl, name="omim") if cache_dir else None
+        self.coalescer = Coalescer()
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.max_workers = max_workers
+        self.mirror = mirror
+
+    @staticmethod
+    def normalize_params(params):
+        """
+        Drop unset params and join lists, so equivalent requests get the same cache key.
+        """
+        normalized = {}
+        for key, value in params.items():
+            if value is None or value == [] or value == "":
+                continue
+            if isinstance(value, list):
+                value = ",".join(map(str, value))
+            normalized[key] = value
+        return normalized
+
+    def get(self, path, params):
+        """
+        GET an API path, going through the cache and coalescing identical in-flight requests.
+
+        :return: dict, the json response, or None if the request failed
+        """
+        params = self.normalize_params(params)
+        key = make_key(path, params)
+
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        def request(timeout):
+            # every attempt, including retries, goes through the rate limiter
+            self.rate_limiter.acquire()
+            response = self.session.get(
+                f"{self.base_url}/{path}",
+                params={**params, "format": "json", "apiKey": self.api_key},
+                timeout=timeout,
+            )
+            response.raise_for_status()
+            return response.json()
+
+        def fetch():
+            try:
+                with span("omim.request", path=path), SEARCH_LATENCY.time(kind="omim"):
+                    data = self.policy.call(request)
+            except (requests.exceptions.RequestException, CircuitOpenError, DeadlineExceeded) as e:
+                print(f"Error: {e}")
+                return None
+            if self.cache is not None:
+                self.cache.set(key, data)
+            return data
+
+        return self.coalescer.run(key, fetch)
+
+    def close(self):
+        self.session.close()
 
     def fetch_entry(self, entry_params: EntryParams):
         mim_numbers = entry_params.mim_number
         if not isinstance(mim_numbers, list):
             mim_numbers = [mim_numbers]
-        mim_numbers_str = ",".join(map(str, mim_numbers))
 
-        include_str = "&include=" + ",".join(entry_params.include)
+        if self.mirror is not None:
+            res = self.mirror.fetch_entry(mim_numbers, include=entry_params.include, exclude=entry_params.exclude)
+            if res is not None:
+                return res
 
-        exclude_str = ""
-        if entry_params.exclude:
-            exclude_str = "&exclude=" + ",".join(entry_params.exclude)
-
-        try:
-            url = f"{self.base_url}/entry?mimNumber={mim_numbers_str}{include_str}{exclude_str}&format=json&apiKey={self.api_key}"
-            response = requests.get(url)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
-            return None
+        params = {
+            "mimNumber": mim_numbers,
+            "include": entry_params.include,
+            "exclude": entry_params.exclude,
+        }
+        return self.get("entry", params)
 
     def search_entry(self, entry_search_params: EntrySearchParams):
+        if self.mirror is not None:
+            res = self.mirror.search_entry(entry_search_params)
+            if res is not None:
+                return res
+
         params = {
-            "format": "json",
-            "apiKey": self.api_key,
             "search": entry_search_params.search,
             "filter": entry_search_params.filter,
             "fields": entry_search_params.fields,
@@ -103,44 +237,30 @@ class OMIM:
             "start": entry_search_params.start,
             "limit": entry_search_params.limit,
             "retrieve": entry_search_params.retrieve,
-            "include": ",".join(entry_search_params.include),
-            "exclude": ",".join(entry_search_params.exclude),
+            "include": entry_search_params.include,
+            "exclude": entry_search_params.exclude,
         }
-
-        try:
-            url = f"{self.base_url}/entry/search"
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
-            return None
+        return self.get("entry/search", params)
 
     def fetch_clinical_synopsis(self, clinical_synopsis_params: ClinicalSynopsisParams):
         mim_numbers = clinical_synopsis_params.mim_number
         if not isinstance(mim_numbers, list):
             mim_numbers = [mim_numbers]
-        mim_numbers_str = ",".join(map(str, mim_numbers))
-
-        include_str = "&include=" + ",".join(clinical_synopsis_params.include)
 
-        exclude_str = ""
-        if clinical_synopsis_params.exclude:
-            exclude_str = "&exclude=" + ",".join(clinical_synopsis_params.exclude)
-
-        try:
-            url = f"{self.base_url}/clinicalSynopsis?mimNumber={mim_numbers_str}{include_str}{exclude_str}&format=json&apiKey={self.api_key}"
-            response = requests.get(url)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
-            return None
+        params = {
+            "mimNumber": mim_numbers,
+            "include": clinical_synopsis_params.include,
+            "exclude": clinical_synopsis_params.exclude,
+        }
+        return self.get("clinicalSynopsis", params)
 
     def fetch_gene_map(self, gene_map_params: GeneMapParams):
+        if self.mirror is not None:
+            res = self.mirror.fetch_gene_map(gene_map_params)
+            if res is not None:
+                return res
+
         params = {
-            "format": "json",
-            "apiKey": self.api_key,
             "sequenceID": gene_map_params.sequence_id,
             "mimNumber": gene_map_params.mim_number,
             "chromosome": gene_map_params.chromosome,
@@ -149,12 +269,123 @@ class OMIM:
             "limit": gene_map_params.limit,
             "phenotypeExists": gene_map_params.phenotype_exists,
         }
+        return self.get("geneMap", params)
 
-        try:
-            url = f"{self.base_url}/geneMap"
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
-            return None
\ No newline at end of file
+    # ! Bulk ==================================================================
+
+    def fetch_batches(self, path, mim_numbers, include, exclude, list_key, item_key, batch_size):
+        """
+        Split mim numbers into API sized batches and fetch them concurrently (under the rate limit).
+
+        :return: list, the items from every batch, in batch order
+        """
+        batches = batched(list(mim_numbers), min(batch_size, MAX_MIM_NUMBERS_PER_REQUEST))
+
+        def fetch(batch):
+            return self.get(path, {"mimNumber": batch, "include": include, "exclude": exclude})
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            responses = list(executor.map(fetch, batches))
+
+        items = []
+        for response in responses:
+            if response is not None:
+                items += [item[item_key] for item in response["omim"][list_key]]
+        return items
+
+    def fetch_entries(self, mim_numbers: List[int], include: List[str] = None, exclude: List[str] = None, batch_size=MAX_MIM_NUMBERS_PER_REQUEST):
+        """
+        Fetch any number of entries, batching the mim numbers.
+        """
+        include = include if include is not None else EntryParams.__fields__["include"].default
+        return self.fetch_batches("entry", mim_numbers, include, exclude or [], "entryList", "entry", batch_size)
+
+    def fetch_clinical_synopses(self, mim_numbers: List[int], include: List[str] = None, exclude: List[str] = None, batch_size=MAX_MIM_NUMBERS_PER_REQUEST):
+        """
+        Fetch any number of clinical synopses, batching the mim numbers.
+        """
+        include = include if include is not None else ClinicalSynopsisParams.__fields__["include"].default
+        return self.fetch_batches("clinicalSynopsis", mim_numbers, include, exclude or [], "clinicalSynopsisList", "clinicalSynopsis", batch_size)
+
+    async def iter_entries(self, mim_numbers: List[int], include: List[str] = None, exclude: List[str] = None, batch_size=MAX_MIM_NUMBERS_PER_REQUEST):
+        """
+        Async generator over entries for any number of mim numbers. Batches are fetched concurrently (under the rate
+        limit) and their entries are yielded as each batch arrives, not in batch order.
+        """
+        include = include if include is not None else EntryParams.__fields__["include"].default
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def fetch(batch):
+            async with semaphore:
+                return await asyncio.to_thread(self.get, "entry", {"mimNumber": batch, "include": include, "exclude": exclude or []})
+
+        batches = batched(list(mim_numbers), min(batch_size, MAX_MIM_NUMBERS_PER_REQUEST))
+        for next_response in asyncio.as_completed([fetch(batch) for batch in batches]):
+            response = await next_response
+            if response is None:
+                continue
+            for item in response["omim"]["entryList"]:
+                yield item["entry"]
+
+    async def iter_pages(self, path, params, response_key, list_key, item_key, page_size):
+        """
+        Walk a paginated endpoint, yielding items as each page arrives. The next page is requested while the current
+        one is being consumed.
+        """
+        start = params.get("start") or 0
+
+        def fetch(page_start):
+            return self.get(path, {**params, "start": page_start, "limit": page_size})
+
+        pending = asyncio.ensure_future(asyncio.to_thread(fetch, start))
+        while pending is not None:
+            response = await pending
+            pending = None
+            if response is None:
+                return
+            page = response["omim"][response_key]
+            items = page.get(list_key, [])
+            total = page.get("totalResults", 0)
+
+            start += page_size
+            if items and start < total:
+                pending = asyncio.ensure_future(asyncio.to_thread(fetch, start))
+
+            try:
+                for item in items:
+                    yield item[item_key]
+            except GeneratorExit:
+                if pending is not None:
+                    pending.cancel()
+                raise
+
+    def iter_search_entries(self, entry_search_params: EntrySearchParams, page_size=20):
+        """
+        Async generator over every entry matching a search, walking the pagination.
+        """
+        params = {
+            "search": entry_search_params.search,
+            "filter": entry_search_params.filter,
+            "fields": entry_search_params.fields,
+            "sort": entry_search_params.sort,
+            "operator": entry_search_params.operator,
+            "start": entry_search_params.start,
+            "retrieve": entry_search_params.retrieve,
+            "include": entry_search_params.include,
+            "exclude": entry_search_params.exclude,
+        }
+        return self.iter_pages("entry/search", params, "searchResponse", "entryList", "entry", page_size)
+
+    def iter_gene_map(self, gene_map_params: GeneMapParams, page_size=100):
+        """
+        Async generator over every gene map record matching the params, walking the pagination.
+        """
+        params = {
+            "sequenceID": gene_map_params.sequence_id,
+            "mimNumber": gene_map_params.mim_number,
+            "chromosome": gene_map_params.chromosome,
+            "chromosomeSort": gene_map_params.chromosome_sort,
+            "start": gene_map_params.start,
+            "phenotypeExists": gene_map_params.phenotype_exists,
+        }
+        return self.iter_pages("geneMap", params, "listResponse", "geneMapList", "geneMap", page_size)
@@ -0,0 +1,446 @@
+import asyncio
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from .omim import OMIM, EntryParams, GeneMapParams, EntrySearchParams
+from ..metrics import SEARCH_LATENCY
+
+CHROMOSOMES = [str(i) for i in range(1, 23)] + ["X", "Y"]
+
+# entry searches match the full text, the mirror can only answer them when it holds every entry's text
+SEARCH_SECTIONS = ("text",)
+
+# the only search settings the mirror's full text ranking can stand in for
+DEFAULT_SEARCH_FIELDS = EntrySearchParams.__fields__["fields"].default
+DEFAULT_SEARCH_SORT = EntrySearchParams.__fields__["sort"].default
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    mim_number INTEGER PRIMARY KEY,
+    title TEXT,
+    data TEXT,
+    includes TEXT
+);
+CREATE TABLE IF NOT EXISTS gene_map (
+    sequence_id INTEGER PRIMARY KEY,
+    mim_number INTEGER,
+    chromosome TEXT,
+    location TEXT,
+    gene_symbols TEXT,
+    phenotypes TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS gene_map_mim_number ON gene_map (mim_number);
+CREATE INDEX IF NOT EXISTS gene_map_chromosome ON gene_map (chromosome);
+CREATE TABLE IF NOT EXISTS gene_symbols (
+    symbol TEXT COLLATE NOCASE,
+    sequence_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS gene_symbols_symbol ON gene_symbols (symbol);
+CREATE TABLE IF NOT EXISTS synced (
+    scope TEXT PRIMARY KEY,
+    includes TEXT,
+    updated REAL
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (mim_number UNINDEXED, title, text);
+CREATE VIRTUAL TABLE IF NOT EXISTS gene_map_fts USING fts5 (sequence_id UNINDEXED, gene_symbols, location, phenotypes);
+"""
+
+
+def collect_text(value) -> List[str]:
+    """
+    Collect every string in a nested OMIM response, for full text indexing.
+    """
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        return [text for item in value.values() for text in collect_text(item)]
+    if isinstance(value, list):
+        return [text for item in value for text in collect_text(item)]
+    return []
+
+
+def fts_query(search: str) -> str:
+    # quote every term so user input can't break the FTS5 query syntax
+    terms = re.findall(r"\w+", search)
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+class OMIMMirror:
+    """
+    A local SQLite (FTS5) mirror of OMIM entries and gene map records for offline, sub-millisecond lookups.
+
+    Indexes mim number, gene symbol, chromosome and location, and the full text of titles and phenotypes. Lookup
+    methods return responses shaped like the live API's, or None when the mirror can't answer so the caller can fall
+    back to the API. Entries remember which `include` sections they were fetched with, so a request for sections the
+    mirror doesn't hold (e.g. text for an entry loaded from mimTitles.txt) goes to the API.
+
+    Searches and chromosome listings are only answered when a completed load or sync covered everything they could
+    match (the "entries" catalog, the whole "gene_map" or one "gene_map:<chromosome>"), so a partial sync never
+    passes for the full result set.
+    """
+
+    def __init__(self, path=os.path.join("data", "omim_mirror.db")):
+        """
+        :param path: str, the SQLite database file (":memory:" for an in-memory mirror)
+        """
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+            columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(entries)")]
+            if "includes" not in columns:
+                # mirrors created before entries tracked their sections, their entries count as titles only
+                self.conn.execute("ALTER TABLE entries ADD COLUMN includes TEXT")
+            try:
+                self.conn.executescript(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                # sqlite built without FTS5, fall back to LIKE queries
+                self.fts = False
+
+    def close(self):
+        self.conn.close()
+
+    # ! Synced scopes =========================================================
+
+    def mark_synced(self, scope: str, include: Iterable[str] = ()) -> None:
+        """
+        Record that a load or sync of a whole scope finished.
+
+        :param scope: str, "entries" (every OMIM entry), "gene_map" or "gene_map:<chromosome>"
+        :param include: list, the entry sections the scope was loaded with
+        """
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO synced VALUES (?, ?, ?)",
+                              (scope, json.dumps(sorted(set(include))), time.time()))
+
+    def covers(self, scope: str, include: Iterable[str] = ()) -> bool:
+        """
+        Whether a completed load or sync of the scope holds every requested section.
+        """
+        rows = self.query("SELECT includes FROM synced WHERE scope = ?", (scope,))
+        if not rows:
+            return False
+        stored = set(json.loads(rows[0]["includes"]))
+        return "all" in stored or set(include) <= stored
+
+    # ! Loading ===============================================================
+
+    def add_entries(self, entries: Iterable[Dict], include: Iterable[str] = ()) -> int:
+        """
+        Insert or replace entries (the "entry" objects from the API).
+
+        :param include: list, the `include` sections the entries were fetched with (none for titles only)
+        """
+        includes = json.dumps(sorted(set(include)))
+        count = 0
+        with self.lock, self.conn:
+            for entry in entries:
+                mim_number = int(entry["mimNumber"])
+                title = entry.get("titles", {}).get("preferredTitle", "")
+                self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                  (mim_number, title, json.dumps(entry), includes))
+                if self.fts:
+                    self.conn.execute("DELETE FROM entries_fts WHERE mim_number = ?", (mim_number,))
+                    self.conn.execute("INSERT INTO entries_fts VALUES (?, ?, ?)", (mim_number, title, " ".join(collect_text(entry))))
+                count += 1
+        return count
+
+    def add_gene_map(self, records: Iterable[Dict]) -> int:
+        """
+        Insert or replace gene map records (the "geneMap" objects from the API).
+        """
+        count = 0
+        with self.lock, self.conn:
+            for record in records:
+                sequence_id = int(record["sequenceID"])
+                symbols = record.get("geneSymbols", "")
+                phenotypes = "; ".join(
+                    item["phenotypeMap"].get("phenotype", "") for item in record.get("phenotypeMapList", [])
+                )
+                location = record.get("cytoLocation", "") or record.get("computedCytoLocation", "")
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO gene_map VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (sequence_id, record.get("mimNumber"), str(record.get("chromosomeSymbol", record.get("chromosome", ""))),
+                     location, symbols, phenotypes, json.dumps(record)),
+                )
+                self.conn.execute("DELETE FROM gene_symbols WHERE sequence_id = ?", (sequence_id,))
+                self.conn.executemany(
+                    "INSERT INTO gene_symbols VALUES (?, ?)",
+                    [(symbol.strip(), sequence_id) for symbol in symbols.split(",") if symbol.strip()],
+                )
+                if self.fts:
+                    self.conn.execute("DELETE FROM gene_map_fts WHERE sequence_id = ?", (sequence_id,))
+                    self.conn.execute("INSERT INTO gene_map_fts VALUES (?, ?, ?, ?)", (sequence_id, symbols, location, phenotypes))
+                count += 1
+        return count
+
+    def load_genemap2(self, fpath: str) -> int:
+        """
+        Load the genemap2.txt bulk download. Rows are converted to the API's geneMap shape.
+        """
+        def records():
+            columns = None
+            sequence_id = 0
+            with open(fpath, newline="") as f:
+                for row in csv.reader(f, delimiter="\t"):
+                    if not row:
+                        continue
+                    if row[0].startswith("#"):
+                        # the last comment line before the data is the header
+                        if row[0].lstrip("# ").startswith("Chromosome"):
+                            columns = [column.lstrip("# ").strip() for column in row]
+                        continue
+                    if columns is None:
+                        continue
+                    values = dict(zip(columns, row))
+                    # genemap2 has no sequence ids, derive a stable one from the row position
+                    sequence_id += 1
+                    yield {
+                        "sequenceID": sequence_id,
+                        "mimNumber": int(values["MIM Number"]) if values.get("MIM Number") else None,
+                        "chromosomeSymbol": values.get("Chromosome", "").replace("chr", ""),
+                        "cytoLocation": values.get("Cyto Location", ""),
+                        "computedCytoLocation": values.get("Computed Cyto Location", ""),
+                        "geneSymbols": values.get("Gene Symbols", ""),
+                        "geneName": values.get("Gene Name", ""),
+                        "approvedGeneSymbols": values.get("Approved Gene Symbol", ""),
+                        "phenotypeMapList": [
+                            {"phenotypeMap": {"phenotype": phenotype.strip()}}
+                            for phenotype in values.get("Phenotypes", "").split(";") if phenotype.strip()
+                        ],
+                    }
+
+        count = self.add_gene_map(records())
+        self.mark_synced("gene_map")
+        print(f"Loaded {count} gene map records from {fpath}")
+        return count
+
+    def load_mim_titles(self, fpath: str) -> int:
+        """
+        Load the mimTitles.txt bulk download as minimal entries (number and titles). It lists every entry, but
+        without their text, so searches still go to the API.
+        """
+        def entries():
+            with open(fpath, newline="") as f:
+                for row in csv.reader(f, delimiter="\t"):
+                    if not row or row[0].startswith("#") or len(row) < 3:
+                        continue
+                    yield {
+                        "mimNumber": int(row[1]),
+                        "prefix": row[0],
+                        "titles": {
+                            "preferredTitle": row[2],
+                            "alternativeTitles": row[3] if len(row) > 3 else "",
+                            "includedTitles": row[4] if len(row) > 4 else "",
+                        },
+                    }
+
+        count = self.add_entries(entries())
+        self.mark_synced("entries")
+        print(f"Loaded {count} entries from {fpath}")
+        return count
+
+    async def sync_gene_map(self, omim: OMIM, chromosomes: List[str] = CHROMOSOMES, batch_size=500) -> int:
+        """
+        Pull the full gene map from the API (one paginated walk per chromosome) into the mirror.
+        """
+        count = 0
+        for chromosome in chromosomes:
+            batch = []
+            async for record in omim.iter_gene_map(GeneMapParams(chromosome=chromosome)):
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    count += await asyncio.to_thread(self.add_gene_map, batch)
+                    batch = []
+            count += await asyncio.to_thread(self.add_gene_map, batch)
+            await asyncio.to_thread(self.mark_synced, f"gene_map:{chromosome}")
+            print(f"Synced chromosome {chromosome}, {count} gene map records total")
+        if set(CHROMOSOMES) <= set(map(str, chromosomes)):
+            await asyncio.to_thread(self.mark_synced, "gene_map")
+        return count
+
+    async def sync_entries(self, omim: OMIM, mim_numbers: List[int], include: List[str] = None, batch_size=500,
+                           complete=False) -> int:
+        """
+        Pull full entries for the given mim numbers from the API into the mirror.
+
+        :param include: list, the sections to fetch (the API client's defaults if None), only requests for these
+            are answered from the mirror
+        :param complete: bool, the mim numbers are the whole catalog (e.g. every number in mimTitles.txt), so once the
+            sync finishes searches can be answered from the mirror (searches match the full text, so only if include
+            has "text")
+        """
+        include = include if include is not None else EntryParams.__fields__["include"].default
+        count = 0
+        batch = []
+        async for entry in omim.iter_entries(mim_numbers, include=include):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                count += await asyncio.to_thread(self.add_entries, batch, include)
+                batch = []
+        count += await asyncio.to_thread(self.add_entries, batch, include)
+        if complete:
+            await asyncio.to_thread(self.mark_synced, "entries", include)
+        print(f"Synced {count} entries")
+        return count
+
+    # ! Lookups ===============================================================
+
+    def query(self, sql, params=()):
+        with self.lock, SEARCH_LATENCY.time(kind="omim_mirror"):
+            return self.conn.execute(sql, params).fetchall()
+
+    def get_entry_rows(self, mim_numbers: List[int]) -> List[sqlite3.Row]:
+        placeholders = ",".join("?" * len(mim_numbers))
+        rows = self.query(f"SELECT mim_number, data, includes FROM entries WHERE mim_number IN ({placeholders})",
+                          mim_numbers)
+        by_number = {row["mim_number"]: row for row in rows}
+        return [by_number[number] for number in mim_numbers if number in by_number]
+
+    def get_entries(self, mim_numbers: List[int]) -> List[Dict]:
+        return [json.loads(row["data"]) for row in self.get_entry_rows(mim_numbers)]
+
+    def entry_match(self, search: str):
+        """
+        :return: tuple, the FROM/WHERE clause matching a search and its params, or None if nothing can match
+        """
+        if self.fts:
+            query = fts_query(search)
+            if not query:
+                return None
+            return "entries_fts f JOIN entries e ON e.mim_number = f.mim_number WHERE entries_fts MATCH ?", (query,)
+        return "entries e WHERE e.title LIKE ? OR e.data LIKE ?", (f"%{search}%", f"%{search}%")
+
+    def search_entry_rows(self, search: str, start=0, limit=10) -> List[sqlite3.Row]:
+        match = self.entry_match(search)
+        if match is None:
+            return []
+        clause, params = match
+        order = "ORDER BY rank" if self.fts else "ORDER BY e.mim_number"
+        return self.query(f"SELECT e.data, e.includes FROM {clause} {order} LIMIT ? OFFSET ?", (*params, limit, start))
+
+    def search_entries(self, search: str, start=0, limit=10) -> List[Dict]:
+        return [json.loads(row["data"]) for row in self.search_entry_rows(search, start=start, limit=limit)]
+
+    def count_entries(self, search: str) -> int:
+        match = self.entry_match(search)
+        if match is None:
+            return 0
+        clause, params = match
+        return self.query(f"SELECT COUNT(*) FROM {clause}", params)[0][0]
+
+    def lookup_gene(self, symbol: str) -> List[Dict]:
+        rows = self.query(
+            "SELECT g.data FROM gene_symbols s JOIN gene_map g ON g.sequence_id = s.sequence_id WHERE s.symbol = ?",
+            (symbol,),
+        )
+        return [json.loads(row["data"]) for row in rows]
+
+    def search_gene_map(self, search: str, limit=10) -> List[Dict]:
+        """
+        Full text search over gene symbols, locations and phenotypes.
+        """
+        if not self.fts:
+            rows = self.query(
+                "SELECT data FROM gene_map WHERE gene_symbols LIKE ? OR phenotypes LIKE ? LIMIT ?",
+                (f"%{search}%", f"%{search}%", limit),
+            )
+        else:
+            rows = self.query(
+                "SELECT g.data FROM gene_map_fts f JOIN gene_map g ON g.sequence_id = f.sequence_id "
+                "WHERE gene_map_fts MATCH ? ORDER BY rank LIMIT ?",
+                (fts_query(search), limit),
+            )
+        return [json.loads(row["data"]) for row in rows]
+
+    # ! API shaped responses (None = not answerable from the mirror) ==========
+
+    @staticmethod
+    def holds(row: sqlite3.Row, include: Iterable[str]) -> bool:
+        """
+        Whether an entry row was stored with every requested section.
+        """
+        stored = set(json.loads(row["includes"] or "[]"))
+        return "all" in stored or set(include) <= stored
+
+    def fetch_entry(self, mim_numbers: List[int], include: Iterable[str] = (), exclude: Iterable[str] = ()) -> Optional[Dict]:
+        if exclude:
+            return None
+        rows = self.get_entry_rows(mim_numbers)
+        if len(rows) < len(mim_numbers) or not all(self.holds(row, include) for row in rows):
+            return None
+        return {"omim": {"entryList": [{"entry": json.loads(row["data"])} for row in rows]}}
+
+    def search_entry(self, params: EntrySearchParams) -> Optional[Dict]:
+        if (params.filter or params.operator or params.retrieve or params.exclude
+                or params.fields not in (None, DEFAULT_SEARCH_FIELDS) or params.sort not in (None, DEFAULT_SEARCH_SORT)):
+            # search features the mirror doesn't support
+            return None
+        if not self.covers("entries", [*SEARCH_SECTIONS, *params.include]):
+            # the totals and rankings would only cover what happens to be synced
+            return None
+        total = self.count_entries(params.search)
+        if not total:
+            return None
+        rows = self.search_entry_rows(params.search, start=params.start, limit=params.limit)
+        if not all(self.holds(row, params.include) for row in rows):
+            return None
+        return {"omim": {"searchResponse": {
+            "search": params.search,
+            "startIndex": params.start,
+            "endIndex": params.start + len(rows) - 1,
+            "totalResults": total,
+            "entryList": [{"entry": json.loads(row["data"])} for row in rows],
+        }}}
+
+    def fetch_gene_map(self, params: GeneMapParams) -> Optional[Dict]:
+        if params.chromosome_sort is not None:
+            return None
+        full = self.covers("gene_map")
+        if params.sequence_id is not None:
+            where, values = "sequence_id = ?", [params.sequence_id]
+        elif params.mim_number is not None:
+            mim_numbers = params.mim_number if isinstance(params.mim_number, list) else [params.mim_number]
+            where, values = f"mim_number IN ({','.join('?' * len(mim_numbers))})", list(mim_numbers)
+            if not full:
+                # without the whole gene map, only answer when every requested number is held
+                found = self.query(f"SELECT COUNT(DISTINCT mim_number) FROM gene_map WHERE {where}", values)[0][0]
+                if found < len(set(mim_numbers)):
+                    return None
+        elif params.chromosome is not None:
+            where, values = "chromosome = ?", [str(params.chromosome)]
+            if not (full or self.covers(f"gene_map:{params.chromosome}")):
+                return None
+        else:
+            return None
+        if params.phenotype_exists:
+            # filtered before paging, so pages stay full
+            where += " AND phenotypes != ''"
+
+        total = self.query(f"SELECT COUNT(*) FROM gene_map WHERE {where}", values)[0][0]
+        if not total:
+            return None
+        rows = self.query(f"SELECT data FROM gene_map WHERE {where} ORDER BY sequence_id LIMIT ? OFFSET ?",
+                          (*values, params.limit, params.start))
+        records = [json.loads(row["data"]) for row in rows]
+        return {"omim": {"listResponse": {
+            "startIndex": params.start,
+            "endIndex": params.start + len(records) - 1,
+            "totalResults": total,
+            "geneMapList": [{"geneMap": record} for record in records],
+        }}}
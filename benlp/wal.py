@@ -0,0 +1,316 @@
+import fcntl
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from .index import VectorIndex
+
+WAL_MAGIC = b"BENLPWAL"
+# magic, format version, lsn of the checkpoint the log starts after
+HEADER = struct.Struct("<8sIQ")
+# payload length, lsn, crc32 of lsn + payload
+RECORD = struct.Struct("<IQI")
+WAL_VERSION = 1
+CHECKPOINT_VERSION = 1
+
+# ! Log =======================================================================
+
+
+class WriteAheadLog:
+    """
+    An append-only log of pickled records, each framed with its length, log sequence number (lsn) and a crc32.
+
+    Appends are written straight to the file (O_APPEND) and fsynced in batches: after sync_every records or
+    sync_interval seconds, whichever comes first, or on sync(). A crash can lose the unsynced tail but never
+    corrupts the log, a torn or partial last record is detected by its length/crc and cut off on replay.
+    """
+
+    def __init__(self, path: str, base_lsn=0, sync_every=64, sync_interval=0.05):
+        """
+        :param path: str, the log file, created if it doesn't exist
+        :param base_lsn: int, lsn of the checkpoint a new log starts after
+        :param sync_every: int, records between fsyncs (1 to fsync every append)
+        :param sync_interval: float, max seconds a record stays unsynced (checked on the next append)
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.fd = None
+        self.base_lsn = 0
+        self.offset = 0  # where the next record is read from
+        if not os.path.exists(path):
+            self.create(path, base_lsn)
+        self.open()
+
+    @staticmethod
+    def create(path: str, base_lsn: int) -> None:
+        # written to a temp file and renamed so a reader never sees a log without its header
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(WAL_MAGIC, WAL_VERSION, base_lsn))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        fsync_dir(path)
+
+    def open(self) -> None:
+        self.close()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+        header = os.pread(self.fd, HEADER.size, 0)
+        magic, version, base_lsn = HEADER.unpack(header)
+        if magic != WAL_MAGIC or version != WAL_VERSION:
+            raise ValueError(f"{self.path} is not a version {WAL_VERSION} write-ahead log")
+        self.base_lsn = base_lsn
+        self.offset = HEADER.size
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def replaced(self) -> bool:
+        """
+        Whether the file at path is no longer the one that's open (another process checkpointed and started a new log).
+        """
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.fd).st_ino
+        except FileNotFoundError:
+            return True
+
+    def read(self) -> Iterator[Tuple[int, object]]:
+        """
+        Yield (lsn, record) for every complete record after the last one read. Stops at a torn tail, which
+        truncate_tail() cuts off.
+        """
+        size = os.fstat(self.fd).st_size
+        buffer = os.pread(self.fd, size - self.offset, self.offset) if size > self.offset else b""
+        position = 0
+        while position + RECORD.size <= len(buffer):
+            length, lsn, crc = RECORD.unpack_from(buffer, position)
+            start = position + RECORD.size
+            payload = buffer[start:start + length]
+            if len(payload) < length or zlib.crc32(payload, zlib.crc32(struct.pack("<Q", lsn))) != crc:
+                break
+            position = start + length
+            self.offset += RECORD.size + length
+            yield lsn, pickle.loads(payload)
+
+    def truncate_tail(self) -> int:
+        """
+        Cut off anything after the last complete record, returning the number of bytes dropped.
+        """
+        dropped = os.fstat(self.fd).st_size - self.offset
+        if dropped > 0:
+            os.ftruncate(self.fd, self.offset)
+            os.fsync(self.fd)
+        return dropped
+
+    def append(self, lsn: int, record) -> None:
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        crc = zlib.crc32(payload, zlib.crc32(struct.pack("<Q", lsn)))
+        data = RECORD.pack(len(payload), lsn, crc) + payload
+        os.write(self.fd, data)
+        self.offset += len(data)
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        if self.unsynced:
+            os.fsync(self.fd)
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def size(self) -> int:
+        return os.fstat(self.fd).st_size
+
+
+def fsync_dir(path: str) -> None:
+    # makes a rename durable
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# ! Index Store ===============================================================
+
+
+class IndexStore:
+    """
+    A VectorIndex persisted as a checkpoint (the pickle at path) plus a write-ahead log of the mutations since.
+
+    Each mutation appends one record instead of rewriting the whole index. Once the log passes checkpoint_bytes the
+    index is pickled to a temp file and renamed over the checkpoint, then the log starts over, so opening an index
+    loads the checkpoint and replays a short log. Mutations take an exclusive file lock and first apply records
+    other processes appended, so several ingestion workers can feed one index.
+    """
+
+    def __init__(self, path: str, checkpoint_bytes=64 << 20, sync_every=64, sync_interval=0.05,
+                 index_options: Optional[Dict] = None):
+        """
+        :param path: str, the checkpoint path, the log and lock file live next to it
+        :param checkpoint_bytes: int, log size that triggers a checkpoint
+        :param sync_every: int, records between fsyncs
+        :param sync_interval: float, max seconds a record stays unsynced
+        :param index_options: dict, VectorIndex options (metric, dtype, ...) for a new index
+        """
+        self.path = path
+        self.index_options = index_options or {}
+        self.wal_path = f"{path}.wal"
+        self.checkpoint_bytes = checkpoint_bytes
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.RLock()
+        self.lock_fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        self.index: Optional[VectorIndex] = None
+        self.lsn = 0  # last applied record
+        self.wal: Optional[WriteAheadLog] = None
+        with self.locked():
+            self.load()
+
+    @contextmanager
+    def locked(self):
+        with self.lock:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def load(self) -> None:
+        started = time.perf_counter()
+        self.index, self.lsn = self.read_checkpoint()
+        if self.wal is not None:
+            self.wal.close()
+        self.wal = WriteAheadLog(self.wal_path, base_lsn=self.lsn, sync_every=self.sync_every,
+                                 sync_interval=self.sync_interval)
+        replayed = self.catch_up()
+        dropped = self.wal.truncate_tail()
+        if dropped:
+            print(f"Dropped a torn {dropped} byte record from the end of {self.wal_path}")
+        print(f"Index loaded from checkpoint at lsn {self.lsn - replayed} and {replayed} log records in "
+              f"{time.perf_counter() - started:.2f}s")
+
+    def read_checkpoint(self) -> Tuple[VectorIndex, int]:
+        if not os.path.exists(self.path):
+            return VectorIndex(**self.index_options), 0
+        with open(self.path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if isinstance(checkpoint, dict) and checkpoint.get("version") == CHECKPOINT_VERSION:
+            return checkpoint["index"], checkpoint["lsn"]
+        # indexes saved before the log: a pickled list of documents or a bare VectorIndex
+        if isinstance(checkpoint, list):
+            return VectorIndex(checkpoint, **self.index_options), 0
+        return checkpoint, 0
+
+    def catch_up(self) -> int:
+        """
+        Apply the records appended since the last read, following the log across other processes' checkpoints.
+        Call with the file lock held.
+
+        :return: int, records applied
+        """
+        applied = 0
+        while True:
+            for lsn, record in self.wal.read():
+                if lsn > self.lsn:
+                    self.apply(record)
+                    self.lsn = lsn
+                    applied += 1
+            if not self.wal.replaced():
+                return applied
+            # the old log is drained, continue in the new one
+            self.wal.open()
+            if self.wal.base_lsn > self.lsn:
+                # missed records that are only in the new checkpoint now
+                self.load()
+                return applied
+
+    def apply(self, record: Tuple[str, object]) -> None:
+        op, arg = record
+        if op == "add":
+            self.index.add_document(arg)
+        elif op == "upsert":
+            self.index.upsert_document(arg)
+        elif op == "delete":
+            self.index.delete_document(arg)
+        else:
+            raise ValueError(f"Unknown log record {op}")
+
+    def log(self, op: str, arg) -> bool:
+        with self.locked():
+            self.catch_up()
+            # a writer that crashed mid-append left a torn record, appending behind it would hide this record (and
+            # every later one) from replay, so cut it off first
+            dropped = self.wal.truncate_tail()
+            if dropped:
+                print(f"Dropped a torn {dropped} byte record from the end of {self.wal_path}")
+            if op == "add" and str(arg["id"]) in self.index:
+                return False
+            if op == "delete" and str(arg) not in self.index:
+                return False
+            if op == "upsert" and self.index.is_indexed_at(arg):
+                return False
+            self.lsn += 1
+            self.wal.append(self.lsn, (op, arg))
+            self.apply((op, arg))
+            if self.wal.size() > self.checkpoint_bytes:
+                self.checkpoint()
+        return True
+
+    # ! Mutations =============================================================
+
+    def add_document(self, doc_dict: Dict) -> bool:
+        return self.log("add", doc_dict)
+
+    def upsert_document(self, doc_dict: Dict) -> bool:
+        return self.log("upsert", doc_dict)
+
+    def delete_document(self, doc_id) -> bool:
+        return self.log("delete", str(doc_id))
+
+    def refresh(self) -> int:
+        """
+        Apply what other processes logged since this one last wrote, returning the number of records.
+        """
+        with self.locked():
+            return self.catch_up()
+
+    def sync(self) -> None:
+        with self.lock:
+            self.wal.sync()
+
+    def checkpoint(self) -> None:
+        """
+        Write the whole index to a temp file, fsync it and rename it over the checkpoint, then start a new log.
+        """
+        with self.locked():
+            self.catch_up()
+            self.wal.sync()
+            started = time.perf_counter()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"version": CHECKPOINT_VERSION, "lsn": self.lsn, "index": self.index}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            fsync_dir(self.path)
+            # a crash before the new log replaces the old one just replays records the checkpoint already has
+            WriteAheadLog.create(self.wal_path, self.lsn)
+            self.wal.open()
+            print(f"Index checkpointed at lsn {self.lsn} in {time.perf_counter() - started:.2f}s")
+
+    def close(self) -> None:
+        with self.lock:
+            self.wal.sync()
+            self.wal.close()
+            os.close(self.lock_fd)
@@ -0,0 +1,118 @@
+"""
+Measure the overhead the API key middleware adds to a streamed response. Run from the server folder:
+    python bench_middleware.py --requests 2000 --chunks 100
+
+Drives an in-process ASGI app that streams SSE chunks like /chat/stream, bare, behind APIKeyMiddleware and behind
+the old BaseHTTPMiddleware based check, and reports the mean time to the first chunk and to the end of the stream.
+For an end to end number, run loadtest.py against the server with and without API_KEYS set (pass --api-key).
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from middleware import APIKeyMiddleware, TokenBucket, hash_api_key
+
+API_KEY = "benchmark-key"
+
+
+def make_stream_app(num_chunks):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream")]})
+        for idx in range(num_chunks):
+            await send({"type": "http.response.body", "body": b'data: {"content": "token"}\n\n', "more_body": True})
+            await asyncio.sleep(0)  # yield like a real upstream stream would
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    return app
+
+
+class LegacyAPIKeyMiddleware(BaseHTTPMiddleware):
+    # the previous implementation, for comparison
+    async def dispatch(self, request, call_next):
+        if request.headers.get("X-API-KEY") != API_KEY:
+            return JSONResponse(content={"error": "Invalid API key"}, status_code=400)
+        return await call_next(request)
+
+
+async def one_request(app):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/chat/stream", "raw_path": b"/chat/stream", "query_string": b"", "root_path": "",
+        "headers": [(b"x-api-key", API_KEY.encode()), (b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 8000),
+    }
+    received = False
+    disconnected = asyncio.Event()
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    start = time.perf_counter()
+    first_chunk = None
+    status = None
+
+    async def send(message):
+        nonlocal first_chunk, status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and first_chunk is None:
+            first_chunk = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    disconnected.set()
+    assert status == 200, status
+    return first_chunk, time.perf_counter() - start
+
+
+async def bench(name, app, num_requests):
+    for _ in range(min(100, num_requests)):  # warm up
+        await one_request(app)
+    first_chunks, totals = [], []
+    for _ in range(num_requests):
+        first_chunk, total = await one_request(app)
+        first_chunks.append(first_chunk)
+        totals.append(total)
+    result = {
+        "name": name,
+        "first_chunk_us": sum(first_chunks) / len(first_chunks) * 1e6,
+        "total_us": sum(totals) / len(totals) * 1e6,
+    }
+    print(f"{name:>12} first chunk {result['first_chunk_us']:8.1f}us   total {result['total_us']:8.1f}us")
+    return result
+
+
+async def main(args):
+    stream_app = make_stream_app(args.chunks)
+    # a quota high enough that the benchmark never hits it
+    api_keys = {hash_api_key(API_KEY): TokenBucket(rate=1e9, burst=10 ** 9)}
+    apps = {
+        "none": stream_app,
+        "asgi": APIKeyMiddleware(stream_app, api_keys=api_keys),
+        "base_http": LegacyAPIKeyMiddleware(stream_app),
+    }
+    results = [await bench(name, app, args.requests) for name, app in apps.items()]
+
+    baseline = results[0]["total_us"]
+    for result in results[1:]:
+        print(f"{result['name']:>12} overhead {result['total_us'] - baseline:8.1f}us per request")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=100, help="SSE chunks per response")
+    parser.add_argument("--output", default=None, help="write results to this json file")
+    asyncio.run(main(parser.parse_args()))
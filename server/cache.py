@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+from sse_starlette.sse import EventSourceResponse
+
+from benlp.cache import DiskCache, make_key, DEFAULT_CACHE_DIR
+from benlp.metrics import record_cache
+
+# ! Stream Cache -------------------------------------
+
+
+def hash_content(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class Broadcast:
+    """
+    One in-flight generation. Every subscriber replays the items produced so far and then waits for new ones, so
+    concurrent identical requests share a single upstream stream.
+    """
+
+    def __init__(self):
+        self.items: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+
+    def publish(self, item: str):
+        self.items.append(item)
+        self.notify()
+
+    def notify(self):
+        # wake everyone waiting, then arm a fresh event for the next item
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        idx = 0
+        while True:
+            while idx < len(self.items):
+                yield self.items[idx]
+                idx += 1
+            if self.error is not None:
+                raise self.error
+            if self.done:
+                return
+            await self.changed.wait()
+
+
+class StreamCache:
+    """
+    Caches finished SSE streams by key, in memory (LRU) and on disk so other workers and restarts can reuse them.
+    Cached streams are replayed at full speed, identical in-flight requests are coalesced onto one generation.
+    """
+
+    def __init__(self, max_entries=256, cache_dir=os.path.join(DEFAULT_CACHE_DIR, "server"), ttl=7 * 24 * 3600):
+        """
+        :param max_entries: int, streams kept in memory
+        :param cache_dir: str, where streams are persisted (None for memory only)
+        :param ttl: float, seconds before a persisted stream expires
+        """
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.disk = DiskCache(cache_dir, ttl=ttl, name="server_streams") if cache_dir else None
+        self.inflight: Dict[str, Broadcast] = {}
+        self.tasks = set()
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        items = self.memory.get(key)
+        if items is not None:
+            self.memory.move_to_end(key)
+            record_cache("server_streams_memory", True)
+            return items
+        record_cache("server_streams_memory", False)
+        if self.disk is not None:
+            # disk reads (and unpickling) block, keep them off the event loop
+            items = await run_in_threadpool(self.disk.get, key)
+            if items is not None:
+                self.remember(key, items)
+        return items
+
+    def remember(self, key: str, items: List[str]):
+        self.memory[key] = items
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    async def set(self, key: str, items: List[str]):
+        self.remember(key, items)
+        if self.disk is not None:
+            await run_in_threadpool(self.disk.set, key, items)
+
+    async def produce(self, key: str, broadcast: Broadcast, producer: Callable[[], AsyncIterator[str]]):
+        try:
+            async for item in producer():
+                broadcast.publish(item)
+            # only complete streams are cached
+            await self.set(key, broadcast.items)
+        except BaseException as e:
+            broadcast.error = e
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            broadcast.done = True
+            self.inflight.pop(key, None)
+            broadcast.notify()
+
+    def lookup(self, key: str, producer: Callable[[], AsyncIterator[str]], items: Optional[List[str]] = None):
+        """
+        :param items: list, the stream get() returned for the key, if any
+        :return: tuple, (async iterator over the stream items, "hit", "coalesced" or "miss")
+        """
+        if items is None:
+            # a generation may have finished while get() was reading the disk
+            items = self.memory.get(key)
+        if items is not None:
+            async def replay():
+                for item in items:
+                    yield item
+            return replay(), "hit"
+
+        broadcast = self.inflight.get(key)
+        if broadcast is not None:
+            return broadcast.subscribe(), "coalesced"
+
+        broadcast = self.inflight[key] = Broadcast()
+        # the generation runs in its own task so it finishes (and gets cached) even if the first client disconnects
+        task = asyncio.create_task(self.produce(key, broadcast, producer))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return broadcast.subscribe(), "miss"
+
+
+async def cached_stream_response(request: Request, key_parts: tuple, producer: Callable[[], AsyncIterator[str]]):
+    """
+    Serve a deterministic SSE endpoint through the app's StreamCache, with an ETag derived from the cache key.
+
+    :param key_parts: tuple, everything the output depends on (content hash, model, messages, params)
+    :param producer: function returning an async iterator of the stream items, only called on a miss
+    """
+    cache: StreamCache = request.app.state.stream_cache
+    key = make_key(*key_parts)
+    etag = f'"{key[:32]}"'
+
+    items = await cache.get(key)
+    if request.headers.get("if-none-match") == etag and items is not None:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    stream, status = cache.lookup(key, producer, items)
+    return EventSourceResponse(stream, media_type="text/event-stream", headers={"ETag": etag, "X-Cache": status})
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends
+import json
+
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sse_starlette.sse import EventSourceResponse
 
 from pydantic import BaseModel
 
 from benlp.document import JupyterSimple
-from benlp.llms import Chat
+
+from cache import cached_stream_response, hash_content
 
 
 router = APIRouter()
@@ -20,22 +24,22 @@ async def endpoint_get_chain():
     """
     return {"message": "Hello World!"}
 
+MODEL = "gpt-3.5-turbo-16k"
+PARAMS = {"temperature": 0.7, "max_tokens": 2000}
+
 @router.post("/jupyterdocs")
-async def endpoint_post_jupyterdocs(request):
+async def endpoint_post_jupyterdocs(request: Request):
     fpath = "/Users/beneverman/Documents/Coding/benlp_v1/data/test/lp_solver.ipynb"
-    doc = JupyterSimple(fpath)
+    # reading and parsing the notebook blocks, keep it off the event loop
+    doc = await run_in_threadpool(JupyterSimple, fpath)
     prompt = doc.create_prompt()
-    chat = Chat(model="gpt-3.5-turbo-16k", stream=True)
-    response = chat(prompt)
+    messages = [{"role": "system", "content": "You are a helpful assistant."}, {"role": "user", "content": prompt}]
+    llm = request.app.state.llm
 
     async def event_stream():
-        full_message = ""
-        for item in response:
-            yield str(item)
-
-            content = item['choices'][0]['delta'].get('content') # use get method to avoid key error on empty delts
-            # use this to avoid adding None to the string (which would cause an error)
-            if content:
-                full_message += content
-    
-    return EventSourceResponse(event_stream(), media_type="text/event-stream")
\ No newline at end of file
+        async for item in llm.stream(messages, model=MODEL, **PARAMS):
+            yield json.dumps(item)
+
+    # the prompt is built from the notebook, so hashing it covers the file contents
+    key_parts = ("chain/jupyterdocs", hash_content(prompt.encode("utf-8")), MODEL, messages, PARAMS)
+    return await cached_stream_response(request, key_parts, event_stream)
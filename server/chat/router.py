@@ -1,11 +1,11 @@
-from fastapi import APIRouter, Depends
+import json
+
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 
 from models import ChatRequest
 
-from benlp.llms import ChatServer
-
 router = APIRouter()
 
 # routes -------------------------------------
@@ -22,27 +22,19 @@ async def endpoint_get_chat():
     return {"message": message}
 
 @router.post("/stream")
-def endpoint_post_chat(req : ChatRequest):
+async def endpoint_post_chat(req : ChatRequest, request: Request):
     # parse the request
     messages = [message.dict(exclude_none=True) for message in req.messages] # convert to dict instead of pydantic model, and remove None values
-    print(messages)
     max_tokens = req.max_tokens
     temperature = req.temperature
     model = req.model
 
-    # run the chat
-    chat = ChatServer()
-    response = chat(messages, max_tokens=max_tokens, temperature=temperature, model=model, stream=True)
+    # run the chat on the shared async client (created in the app lifespan)
+    llm = request.app.state.llm
 
     # return the response
     async def event_stream():
-        full_message = ""
-        for item in response:
-            yield str(item)
-
-            content = item['choices'][0]['delta'].get('content') # use get method to avoid key error on empty delts
-            # use this to avoid adding None to the string (which would cause an error)
-            if content:
-                full_message += content
+        async for item in llm.stream(messages, max_tokens=max_tokens, temperature=temperature, model=model):
+            yield json.dumps(item)
     
-    return EventSourceResponse(event_stream(), media_type="text/event-stream")
\ No newline at end of file
+    return EventSourceResponse(event_stream(), media_type="text/event-stream")
@@ -5,5 +5,7 @@ import openai
 load_dotenv("../.env")
 OPENAI_API_KEY = os.environ.get('OPENAI-API-KEY')
 MY_API_KEY = os.environ.get('MY_API_KEY')
+# comma separated "<sha256 of key>[:<requests per second>[:<burst>]]" entries, hash a key with `python middleware.py <key>`
+API_KEYS = os.environ.get('API_KEYS', '')
 
 openai.api_key = OPENAI_API_KEY
\ No newline at end of file
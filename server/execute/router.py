@@ -0,0 +1,48 @@
+import base64
+import json
+import uuid
+
+from fastapi import APIRouter
+from sse_starlette.sse import EventSourceResponse
+
+from models import CodeRequest
+
+from benlp.tools.code_executor import KernelManager
+
+
+router = APIRouter()
+
+# one kernel per session, idle kernels are evicted LRU when over the count/memory limits
+kernels = KernelManager()
+
+# routes -------------------------------------
+
+@router.post("/sessions")
+async def endpoint_post_session():
+    return {"session_id": uuid.uuid4().hex}
+
+@router.post("/sessions/{session_id}/stream")
+async def endpoint_post_code_stream(session_id: str, req: CodeRequest):
+    async def event_stream():
+        async for event in kernels.astream(session_id, req.code, timeout=req.timeout):
+            if event["type"] == "stream":
+                yield {"event": event["name"], "data": event["text"]}
+            else:
+                figures = [
+                    {
+                        "kind": figure["kind"],
+                        "format": figure["format"],
+                        "hash": figure["hash"],
+                        "data": base64.b64encode(figure["data"]).decode("ascii"),
+                        "thumbnail": base64.b64encode(figure["thumbnail"]).decode("ascii") if figure["thumbnail"] else None,
+                    }
+                    for figure in event["figures"]
+                ]
+                yield {"event": "result", "data": json.dumps({"error": event["error"], "figures": figures})}
+
+    return EventSourceResponse(event_stream(), media_type="text/event-stream")
+
+@router.delete("/sessions/{session_id}")
+async def endpoint_delete_session(session_id: str):
+    kernels.close_session(session_id)
+    return {"message": f"Session {session_id} closed."}
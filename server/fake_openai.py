@@ -0,0 +1,182 @@
+"""
+A local stand-in for the OpenAI chat, completion and embedding endpoints, for load tests, benchmarks and fault
+injection. Run from the server folder:
+    uvicorn fake_openai:app --port 8001
+and point the server (or benlp, via OPENAI_API_BASE) at it with OPENAI_API_BASE=http://localhost:8001/v1
+
+Env (all can also be changed at runtime with POST /fake/config, e.g. {"error_rate": 0.5}):
+    FAKE_OPENAI_LATENCY: mean seconds before the first token (default 0.3)
+    FAKE_OPENAI_LATENCY_DIST: constant, uniform, exponential or lognormal (default constant)
+    FAKE_OPENAI_LATENCY_SIGMA: spread for uniform (+/- fraction of the mean) and lognormal (default 0.5)
+    FAKE_OPENAI_TOKENS_PER_SECOND: streaming rate (default 50)
+    FAKE_OPENAI_TOKENS: tokens per response (default 100)
+    FAKE_OPENAI_EMBEDDING_LATENCY: seconds per embedding request (default 0.05)
+    FAKE_OPENAI_EMBEDDING_DIM: embedding size (default 1536)
+    FAKE_OPENAI_ERROR_RATE: fraction of requests that fail (default 0)
+    FAKE_OPENAI_ERROR_STATUS: status of injected errors (default 429)
+    FAKE_OPENAI_RETRY_AFTER: Retry-After header on injected errors, seconds (default unset)
+    FAKE_OPENAI_STREAM_ERROR_RATE: fraction of streams cut off halfway (default 0)
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CONFIG = {
+    "latency": float(os.environ.get("FAKE_OPENAI_LATENCY", 0.3)),
+    "latency_dist": os.environ.get("FAKE_OPENAI_LATENCY_DIST", "constant"),
+    "latency_sigma": float(os.environ.get("FAKE_OPENAI_LATENCY_SIGMA", 0.5)),
+    "tokens_per_second": float(os.environ.get("FAKE_OPENAI_TOKENS_PER_SECOND", 50)),
+    "tokens": int(os.environ.get("FAKE_OPENAI_TOKENS", 100)),
+    "embedding_latency": float(os.environ.get("FAKE_OPENAI_EMBEDDING_LATENCY", 0.05)),
+    "embedding_dim": int(os.environ.get("FAKE_OPENAI_EMBEDDING_DIM", 1536)),
+    "error_rate": float(os.environ.get("FAKE_OPENAI_ERROR_RATE", 0)),
+    "error_status": int(os.environ.get("FAKE_OPENAI_ERROR_STATUS", 429)),
+    "retry_after": os.environ.get("FAKE_OPENAI_RETRY_AFTER"),
+    "stream_error_rate": float(os.environ.get("FAKE_OPENAI_STREAM_ERROR_RATE", 0)),
+}
+STATS = {"requests": 0, "errors": 0}
+
+app = FastAPI()
+
+
+def sample_latency(mean):
+    dist = CONFIG["latency_dist"]
+    sigma = CONFIG["latency_sigma"]
+    if mean <= 0 or dist == "constant":
+        return max(mean, 0)
+    if dist == "uniform":
+        return random.uniform(mean * (1 - sigma), mean * (1 + sigma))
+    if dist == "exponential":
+        return random.expovariate(1 / mean)
+    if dist == "lognormal":
+        # parametrized so the mean stays `mean`, with a long right tail
+        return random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+    raise ValueError(f"Unknown latency distribution {dist}")
+
+
+def injected_error():
+    STATS["requests"] += 1
+    if random.random() >= CONFIG["error_rate"]:
+        return None
+    STATS["errors"] += 1
+    headers = {"Retry-After": str(CONFIG["retry_after"])} if CONFIG["retry_after"] is not None else {}
+    return JSONResponse(
+        {"error": {"message": "Injected error", "type": "server_error", "code": CONFIG["error_status"]}},
+        status_code=CONFIG["error_status"],
+        headers=headers,
+    )
+
+
+def fake_embedding(text):
+    # deterministic per text, so search benchmarks get stable results
+    rng = random.Random(hashlib.sha1(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(CONFIG["embedding_dim"])]
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector]
+
+
+def make_chunk(completion_id, model, delta, finish_reason=None):
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    error = injected_error()
+    if error is not None:
+        return error
+    model = body.get("model", "gpt-3.5-turbo")
+    num_tokens = min(CONFIG["tokens"], body.get("max_tokens") or CONFIG["tokens"])
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    latency = sample_latency(CONFIG["latency"])
+
+    if not body.get("stream"):
+        await asyncio.sleep(latency + num_tokens / CONFIG["tokens_per_second"])
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "token " * num_tokens}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": num_tokens, "total_tokens": 10 + num_tokens},
+        })
+
+    cut_off = random.random() < CONFIG["stream_error_rate"]
+
+    async def event_stream():
+        await asyncio.sleep(latency)
+        yield f"data: {json.dumps(make_chunk(completion_id, model, {'role': 'assistant', 'content': ''}))}\n\n"
+        for idx in range(num_tokens):
+            if cut_off and idx == num_tokens // 2:
+                # drop the connection mid-stream
+                raise ConnectionResetError("Injected stream error")
+            await asyncio.sleep(1 / CONFIG["tokens_per_second"])
+            yield f"data: {json.dumps(make_chunk(completion_id, model, {'content': 'token '}))}\n\n"
+        yield f"data: {json.dumps(make_chunk(completion_id, model, {}, 'stop'))}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.post("/v1/completions")
+async def completions(request: Request):
+    body = await request.json()
+    error = injected_error()
+    if error is not None:
+        return error
+    num_tokens = min(CONFIG["tokens"], body.get("max_tokens") or CONFIG["tokens"])
+    await asyncio.sleep(sample_latency(CONFIG["latency"]) + num_tokens / CONFIG["tokens_per_second"])
+    return JSONResponse({
+        "id": f"cmpl-{uuid.uuid4().hex}",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": body.get("model", "text-davinci-003"),
+        "choices": [{"index": 0, "text": "token " * num_tokens, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": num_tokens, "total_tokens": 10 + num_tokens},
+    })
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    error = injected_error()
+    if error is not None:
+        return error
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(sample_latency(CONFIG["embedding_latency"]))
+    return JSONResponse({
+        "object": "list",
+        "model": body.get("model", "text-embedding-ada-002"),
+        "data": [{"object": "embedding", "index": idx, "embedding": fake_embedding(text)} for idx, text in enumerate(inputs)],
+        "usage": {"prompt_tokens": sum(len(text.split()) for text in inputs), "total_tokens": sum(len(text.split()) for text in inputs)},
+    })
+
+
+@app.get("/fake/config")
+async def get_config():
+    return {"config": CONFIG, "stats": STATS}
+
+
+@app.post("/fake/config")
+async def set_config(request: Request):
+    # change latency/error settings mid-run, e.g. to inject an outage
+    updates = await request.json()
+    unknown = set(updates) - set(CONFIG)
+    if unknown:
+        return JSONResponse({"error": f"Unknown settings {sorted(unknown)}"}, status_code=400)
+    CONFIG.update(updates)
+    return {"config": CONFIG}
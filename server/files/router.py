@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends
+import hashlib
+import json
+
+from fastapi import APIRouter, Depends, Request
 from fastapi.responses import StreamingResponse
 from fastapi import File, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from sse_starlette.sse import EventSourceResponse
 
 from pydantic import BaseModel
 
 from benlp.document import JupyterSimpleServer
-from benlp.llms import Chat
+from benlp.docgen import NotebookDocumenter
+
+from cache import cached_stream_response
 
 
 router = APIRouter()
@@ -14,20 +20,24 @@ router = APIRouter()
 # routes -------------------------------------
 
 @router.post("/jupyter")
-async def endpoint_post_jupyterdocs(file : UploadFile = File(...)):
-    doc = JupyterSimpleServer(file.file.read())
-    prompt = doc.create_prompt()
-    chat = Chat(model="gpt-3.5-turbo-16k", stream=True)
-    response = chat(prompt)
+async def endpoint_post_jupyterdocs(request: Request, file : UploadFile = File(...)):
+    # hash the upload in chunks, then parse it straight from the spooled file so big notebooks aren't held in memory
+    content_hash = hashlib.sha256()
+    while chunk := await file.read(1 << 20):
+        content_hash.update(chunk)
+    await file.seek(0)
+    # parsing is CPU bound, keep it off the event loop
+    doc = await run_in_threadpool(JupyterSimpleServer, file.file)
+    sources = [c['source'] for c in doc.code_cells]
+    llm = request.app.state.llm
+
+    # batches are documented concurrently, the merged docs are what streams back
+    documenter = NotebookDocumenter(model="gpt-3.5-turbo-16k", temperature=0.7)
 
     async def event_stream():
-        full_message = ""
-        for item in response:
-            yield str(item)
-
-            content = item['choices'][0]['delta'].get('content') # use get method to avoid key error on empty delts
-            # use this to avoid adding None to the string (which would cause an error)
-            if content:
-                full_message += content
-    
-    return EventSourceResponse(event_stream(), media_type="text/event-stream")
\ No newline at end of file
+        async for item in documenter.astream(llm, sources):
+            yield json.dumps(item)
+
+    # the same notebook with the same documenter settings replays the cached docs
+    key_parts = ("files/jupyter", content_hash.hexdigest(), documenter.config())
+    return await cached_stream_response(request, key_parts, event_stream)
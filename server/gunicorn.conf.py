@@ -0,0 +1,24 @@
+# Multi-worker deployment profile. Run from the server folder:
+#   gunicorn -c gunicorn.conf.py main:app
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+
+# the app is async and IO bound (waiting on the LLM), so one event loop per core is enough
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# streamed completions can take minutes, don't let the arbiter kill workers mid-stream
+timeout = int(os.environ.get("WORKER_TIMEOUT", 300))
+graceful_timeout = 30
+keepalive = 30
+
+# recycle workers now and then to cap slow memory growth, jittered so they don't all restart at once
+max_requests = int(os.environ.get("MAX_REQUESTS", 10000))
+max_requests_jitter = 1000
+
+# load the app in each worker (not the arbiter) so every worker gets its own LLM client in the lifespan
+preload_app = False
+
+accesslog = "-"
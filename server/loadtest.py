@@ -0,0 +1,103 @@
+"""
+Load test the /chat/stream endpoint. Start the fake OpenAI endpoint and the server first:
+    uvicorn fake_openai:app --port 8001
+    OPENAI_API_BASE=http://localhost:8001/v1 gunicorn -c gunicorn.conf.py main:app
+then:
+    python loadtest.py --url http://localhost:8000/chat/stream --concurrency 1 10 50 100 200
+
+Reports p50/p99 time to first token and total latency at each concurrency level, and the concurrent stream capacity
+(the highest level with no errors and p99 time to first token under --slo).
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    idx = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[idx]
+
+
+async def one_stream(session, url, payload, headers):
+    start = time.perf_counter()
+    ttft = None
+    async with session.post(url, json=payload, headers=headers) as response:
+        response.raise_for_status()
+        async for line in response.content:
+            if ttft is None and line.startswith(b"data:"):
+                ttft = time.perf_counter() - start
+    return ttft, time.perf_counter() - start
+
+
+async def run_level(url, concurrency, num_requests, payload, headers):
+    ttfts, latencies, errors = [], [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def worker():
+            nonlocal errors
+            async with semaphore:
+                try:
+                    ttft, latency = await one_stream(session, url, payload, headers)
+                    ttfts.append(ttft if ttft is not None else latency)
+                    latencies.append(latency)
+                except Exception:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(num_requests)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": errors,
+        "ttft_p50": percentile(ttfts, 50),
+        "ttft_p99": percentile(ttfts, 99),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+        "streams_per_second": len(latencies) / elapsed,
+    }
+
+
+async def main(args):
+    payload = {"messages": [{"role": "user", "content": "Hello!"}], "max_tokens": args.max_tokens}
+    headers = {"X-API-KEY": args.api_key} if args.api_key else {}
+
+    results = []
+    print(f"{'conc':>6} {'errors':>7} {'ttft p50':>9} {'ttft p99':>9} {'lat p50':>8} {'lat p99':>8} {'streams/s':>10}")
+    for concurrency in args.concurrency:
+        num_requests = max(args.requests, concurrency)
+        result = await run_level(args.url, concurrency, num_requests, payload, headers)
+        results.append(result)
+        print(f"{concurrency:>6} {result['errors']:>7} {result['ttft_p50']:>9.3f} {result['ttft_p99']:>9.3f} "
+              f"{result['latency_p50']:>8.3f} {result['latency_p99']:>8.3f} {result['streams_per_second']:>10.1f}")
+
+    capacity = 0
+    for result in results:
+        if result["errors"] == 0 and result["ttft_p99"] <= args.slo:
+            capacity = max(capacity, result["concurrency"])
+    print(f"Concurrent stream capacity (p99 ttft <= {args.slo}s, no errors): {capacity}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "capacity": capacity}, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000/chat/stream")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--max-tokens", type=int, default=100)
+    parser.add_argument("--slo", type=float, default=1.0, help="p99 time to first token target in seconds")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--output", default=None, help="write results to this json file")
+    asyncio.run(main(parser.parse_args()))
@@ -1,23 +1,53 @@
 from fastapi import FastAPI
 
 from typing import List
+import os
 import time
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from middleware import APIKeyMiddleware
+from fastapi.responses import PlainTextResponse
+from middleware import APIKeyMiddleware, MetricsMiddleware, load_api_keys
 from fastapi import Depends
+from config import OPENAI_API_KEY
+from cache import StreamCache
+
+from benlp.llms import ChatClientAsync
+from benlp.metrics import REGISTRY, get_trace
 
 # ! Import Routers -------------------------------------
 from chat import router as chat_router
 from chain import router as chain_router
 from files import router as files_router
+from execute import router as execute_router
 
 # ! START CONFIG ------------------------------------
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one pooled async LLM client per worker process, shared by every request
+    app.state.llm = ChatClientAsync(
+        api_key=OPENAI_API_KEY or os.environ.get("OPENAI_API_KEY"),
+        api_base=os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1"),
+        max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", 100)),
+    )
+    await app.state.llm.start()
+    # finished doc generations, replayed for identical uploads
+    app.state.stream_cache = StreamCache(max_entries=int(os.environ.get("STREAM_CACHE_ENTRIES", 256)))
+    yield
+    await app.state.llm.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # ! Middleware -------------------------------------
 
 # this middleware has to be added before the CORS middleware as to not block the CORS preflight request
-# app.add_middleware(APIKeyMiddleware)
+# it is pure ASGI, so it doesn't buffer the SSE streams like the old BaseHTTPMiddleware version did
+API_KEY_QUOTAS = load_api_keys()
+if API_KEY_QUOTAS:
+    app.add_middleware(APIKeyMiddleware, api_keys=API_KEY_QUOTAS)
+    print(f"API key middleware added ({len(API_KEY_QUOTAS)} keys)")
+else:
+    print("WARNING: no API keys configured (set API_KEYS or MY_API_KEY), the API is open to anyone who can reach it")
 
 origins = [
     "*"
@@ -32,10 +62,14 @@ app.add_middleware(
 )
 print("CORS middleware added")
 
+# added last so it is outermost and times everything, including the CORS handling
+app.add_middleware(MetricsMiddleware)
+
 # https://stackoverflow.com/questions/59965872/how-to-solve-no-attribute-routes-in-fastapi
 app.include_router(chat_router.router, prefix="/chat", tags=["chat"])
 app.include_router(chain_router.router, prefix="/chain", tags=["chain"])
 app.include_router(files_router.router, prefix="/files", tags=["files"])
+app.include_router(execute_router.router, prefix="/execute", tags=["execute"])
 
 # ! START ROUTES -------------------------------------
 
@@ -45,4 +79,13 @@ async def get_index():
 
 @app.get("/test")
 async def get_test():
-    return {"message": "Test successful!"}
\ No newline at end of file
+    return {"message": "Test successful!"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus text format, metrics are per worker process
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces/{trace_id}")
+async def get_trace_spans(trace_id: str):
+    return {"trace_id": trace_id, "spans": get_trace(trace_id)}
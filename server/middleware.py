@@ -1,24 +1,175 @@
-from fastapi import Request
 from fastapi.responses import JSONResponse
-import os
-from dotenv import load_dotenv
-from starlette.middleware.base import BaseHTTPMiddleware
-from config import MY_API_KEY
+import hashlib
+import hmac
+import sys
+import threading
+import time
+from config import MY_API_KEY, API_KEYS
 
-# ! Load Environment Variables -------------------------------------
+from benlp.metrics import span, HTTP_REQUESTS, HTTP_LATENCY
+
+# ! API Keys -------------------------------------
+
+DEFAULT_RATE = 5  # requests per second
+DEFAULT_BURST = 20
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class TokenBucket:
+    """
+    Non-blocking token bucket, `take` either spends a token or returns how long until one is available.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+def load_api_keys(spec: str = API_KEYS, plain_key: str = MY_API_KEY):
+    """
+    Parse the API_KEYS config into {key hash: TokenBucket}. MY_API_KEY, if set, is hashed and added with the
+    default quota so existing deployments keep working.
+    """
+    keys = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        parts = entry.split(":")
+        rate = float(parts[1]) if len(parts) > 1 else DEFAULT_RATE
+        burst = int(parts[2]) if len(parts) > 2 else DEFAULT_BURST
+        keys[parts[0].lower()] = TokenBucket(rate, burst)
+    if plain_key:
+        keys.setdefault(hash_api_key(plain_key), TokenBucket(DEFAULT_RATE, DEFAULT_BURST))
+    return keys
 
-def check_api_key(api_key: str):
-    if api_key is None:
-        return JSONResponse(content={"error": "Missing API Key"}, status_code=400)
-    elif api_key != MY_API_KEY:
-        return JSONResponse(content={"error": "Invalid API key"}, status_code=400)
 
 # https://stackoverflow.com/questions/62882830/fastapi-middleware-on-different-folder-not-working
-class APIKeyMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        api_key = request.headers.get("X-API-KEY")
-        check = check_api_key(api_key)
-        if check:
-            return check
-        response = await call_next(request)
-        return response
\ No newline at end of file
+class APIKeyMiddleware:
+    """
+    Pure ASGI API key check. Unlike BaseHTTPMiddleware it never wraps or buffers the response, the downstream app
+    sends straight to the server, so SSE streams are untouched and the per-request cost is one sha256 and a few
+    compares. Keys are stored hashed and compared in constant time, each key has its own token bucket quota.
+    CORS preflight (OPTIONS) requests pass through, they don't carry the key.
+    """
+
+    def __init__(self, app, api_keys=None, header: str = "x-api-key", public_paths=("/", "/test", "/metrics")):
+        """
+        :param api_keys: dict, key sha256 hex digest -> TokenBucket (defaults to the API_KEYS config)
+        :param header: str, the request header holding the key
+        :param public_paths: tuple, exact paths that don't need a key (by default the health checks, / and /test,
+            and /metrics so Prometheus can scrape without a key)
+        """
+        self.app = app
+        self.api_keys = load_api_keys() if api_keys is None else api_keys
+        if not self.api_keys:
+            print("No API keys configured (set API_KEYS or MY_API_KEY), every request will be rejected")
+        self.key_hashes = [key_hash.encode() for key_hash in self.api_keys]
+        self.header = header.lower().encode("latin-1")
+        self.public_paths = set(public_paths)
+
+    def check(self, api_key: bytes):
+        """
+        :return: str, the matching key hash or None
+        """
+        digest = hashlib.sha256(api_key).hexdigest().encode()
+        match = None
+        # compare against every key without short circuiting so timing doesn't depend on which key matched
+        for key_hash in self.key_hashes:
+            if hmac.compare_digest(digest, key_hash):
+                match = key_hash.decode()
+        return match
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in self.public_paths:
+            return await self.app(scope, receive, send)
+
+        api_key = None
+        for name, value in scope.get("headers", []):
+            if name == self.header:
+                api_key = value
+                break
+
+        if api_key is None:
+            response = JSONResponse(content={"error": "Missing API Key"}, status_code=401)
+            return await response(scope, receive, send)
+
+        key_hash = self.check(api_key)
+        if key_hash is None:
+            response = JSONResponse(content={"error": "Invalid API key"}, status_code=401)
+            return await response(scope, receive, send)
+
+        wait = self.api_keys[key_hash].take()
+        if wait:
+            response = JSONResponse(content={"error": "Rate limit exceeded"}, status_code=429,
+                                    headers={"Retry-After": str(max(1, round(wait)))})
+            return await response(scope, receive, send)
+
+        await self.app(scope, receive, send)
+
+# ! Metrics and Tracing -------------------------------------
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (so streamed responses aren't buffered) that opens a root span per request, returns its
+    trace id in the X-Trace-Id header and records request counts and durations. The duration runs until the response
+    body is finished, so for SSE routes it covers the whole stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        start = time.perf_counter()
+
+        # continue the caller's trace if it sent one
+        trace_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-trace-id":
+                trace_id = value.decode("latin-1")
+                break
+
+        with span("http.request", trace_id=trace_id, method=method, path=scope["path"]) as root:
+            async def send_wrapper(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-trace-id", root.trace_id.encode())]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # label by the route template rather than the raw path to keep the label set small
+                route = scope.get("route")
+                path = getattr(route, "path", None) or "unmatched"
+                root.set(status=status)
+                HTTP_REQUESTS.inc(method=method, path=path, status=status)
+                HTTP_LATENCY.observe(time.perf_counter() - start, method=method, path=path)
+
+
+if __name__ == "__main__":
+    # print the hash to put in API_KEYS for a key
+    print(hash_api_key(sys.argv[1]))
@@ -15,4 +15,7 @@ class ChatRequest(BaseModel):
     messages: List[Message]
     max_tokens: Optional[int] = 2048
     temperature: Optional[float] = 0
-    model: Optional[str] = "gpt-3.5-turbo-16k"
\ No newline at end of file
+    model: Optional[str] = "gpt-3.5-turbo-16k"
+class CodeRequest(BaseModel):
+    code: str
+    timeout: Optional[float] = 30
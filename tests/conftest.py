@@ -0,0 +1,86 @@
+"""
+Shared fixtures. Local servers (the fake OpenAI server in server/fake_openai.py, HTTP stubs) run in-process on a
+free port, so tests can change their settings and read their counters directly.
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+import tiktoken
+import uvicorn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(ROOT, "server")
+sys.path.insert(0, ROOT)
+sys.path.insert(1, SERVER_DIR)
+
+import fake_openai as fake_openai_app  # noqa: E402
+
+from benlp.catalog import chunk_id, content_hash  # noqa: E402
+
+DEFAULT_CONFIG = dict(fake_openai_app.CONFIG)
+
+
+def make_doc(name, embeddings, fpath=None):
+    """
+    A document dict like Document.to_dict returns, with one chunk per embedding and an id hashed from its texts.
+    """
+    texts = [f"{name} chunk {idx}" for idx in range(len(embeddings))]
+    doc_id = content_hash("".join(texts))
+    return {
+        "id": doc_id,
+        "fpath": fpath or f"/docs/{name}.txt",
+        "fname": name,
+        "ext": "txt",
+        "metadata": {},
+        "data": [{"id": chunk_id(doc_id, idx), "text": text, "embedding": list(map(float, embedding))}
+                 for idx, (text, embedding) in enumerate(zip(texts, embeddings))],
+    }
+
+
+def tiktoken_available() -> bool:
+    # tiktoken downloads its encodings on first use, without a network or a cached copy token counting can't run
+    try:
+        tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return False
+    return True
+
+
+requires_tiktoken = pytest.mark.skipif(not tiktoken_available(), reason="tiktoken encodings can't be loaded")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def fake_openai_server():
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(fake_openai_app.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise TimeoutError("fake OpenAI server didn't start")
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/v1"
+    server.should_exit = True
+    thread.join(timeout=10)
+
+
+@pytest.fixture
+def fake_openai(fake_openai_server):
+    """
+    The fake server's api base, with fast responses and no errors, and its settings and counters reset after.
+    """
+    fake_openai_app.CONFIG.update(DEFAULT_CONFIG, latency=0, tokens=1, tokens_per_second=1000, embedding_latency=0)
+    fake_openai_app.STATS.update(requests=0, errors=0)
+    yield fake_openai_server
+    fake_openai_app.CONFIG.update(DEFAULT_CONFIG)
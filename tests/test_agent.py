@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import requires_tiktoken
+
+import benlp.agent
+from benlp.agent import BaseAgent
+
+pytestmark = requires_tiktoken
+
+
+class EndlessTaskStream:
+    """
+    Stands in for Chat: streams a task list with the given tasks, then keeps the stream open with whitespace for 10s.
+    """
+
+    def __init__(self, names):
+        self.names = names
+        self.closed = threading.Event()
+
+    def chat(self, message):
+        def chunks():
+            try:
+                tasks = ", ".join(f'{{"name": "{name}", "instruction": "do {name}"}}' for name in self.names)
+                yield {"choices": [{"delta": {"function_call": {"arguments": f"[{tasks}, "}}}]}
+                # long enough that only a stop ends it in time, bounded so a regression fails instead of hanging
+                for _ in range(1000):
+                    time.sleep(0.01)
+                    yield {"choices": [{"delta": {"function_call": {"arguments": " "}}}]}
+            finally:
+                self.closed.set()
+        return chunks()
+
+
+class FakeRuntime:
+    """
+    Finishes "quick" tasks right away, fails "broken" ones and keeps "slow" ones going until stopped.
+    """
+
+    def __init__(self, stopped):
+        self.stopped = stopped
+
+    def run(self, prompt, stop=None):
+        if prompt == "broken":
+            raise RuntimeError("task failed")
+        if prompt == "slow":
+            while not stop.is_set():
+                time.sleep(0.01)
+            self.stopped.append(prompt)
+        return {"answer": prompt, "transcript": "", "steps": [], "tokens": 0}
+
+
+@pytest.fixture
+def make_agent(tmp_path, monkeypatch):
+    # the agent keeps its data next to the working directory
+    (tmp_path / "work").mkdir()
+    monkeypatch.chdir(tmp_path / "work")
+
+    def make(names, objective_met=False):
+        stream = EndlessTaskStream(names)
+        monkeypatch.setattr(benlp.agent, "Chat", lambda *args, **kwargs: stream.chat)
+        agent = BaseAgent("objective", config={"eval_every": 1, "max_concurrency": 4})
+        agent.stopped = []
+        agent.build_prompt = lambda task: task["name"]
+        agent.get_runtime = lambda: FakeRuntime(agent.stopped)
+
+        async def evaluate():
+            return objective_met
+        agent.evaluate_objective_async = evaluate
+        return agent, stream
+    return make
+
+
+def test_meeting_the_objective_stops_generation_and_running_tasks(make_agent):
+    agent, stream = make_agent(["slow", "quick"], objective_met=True)
+    start = time.monotonic()
+    stats = asyncio.run(agent.run_async())
+    assert time.monotonic() - start < 5
+    assert stream.closed.is_set()
+    assert agent.stopped == ["slow"]
+    assert stats["tasks_completed"] == 1
+
+
+def test_a_failed_task_stops_the_run(make_agent):
+    agent, stream = make_agent(["slow", "broken"])
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="task failed"):
+        asyncio.run(agent.run_async())
+    assert time.monotonic() - start < 5
+    assert stream.closed.is_set()
+    assert agent.stopped == ["slow"]
@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import make_doc
+
+from benlp.catalog import ID_LENGTH, Catalog, chunk_id, content_hash, file_hash
+from benlp.document import Document
+
+
+def test_ids_hash_contents(tmp_path):
+    path_a, path_b = tmp_path / "a.txt", tmp_path / "b.txt"
+    path_a.write_text("same contents")
+    path_b.write_text("same contents")
+    assert file_hash(str(path_a)) == file_hash(str(path_b)) == content_hash("same contents")
+    assert len(content_hash("x")) == ID_LENGTH
+    assert Document(str(path_a)).id == Document(str(path_b)).id
+    assert chunk_id("abc", 0) == "abc-1"
+
+
+def test_same_document_is_stored_once():
+    catalog = Catalog()
+    doc = make_doc("a", [[0.0], [1.0]])
+    row = catalog.add(doc)
+    assert catalog.add(dict(doc, fpath="/elsewhere/a.txt")) == row
+    assert len(catalog) == 1
+    assert catalog.get(doc["id"])["fpath"] == "/docs/a.txt"
+
+
+def test_chunks_locate_their_document():
+    catalog = Catalog()
+    docs = [make_doc(name, [[0.0]] * 3) for name in "ab"]
+    for doc in docs:
+        catalog.add(doc)
+    assert catalog.locate(docs[1]["data"][2]["id"]) == (docs[1]["id"], 2)
+    assert list(catalog.chunk_range(docs[1]["id"])) == [3, 4, 5]
+    with pytest.raises(KeyError):
+        catalog.locate("missing-1")
+
+
+def test_remove_and_compact():
+    catalog = Catalog()
+    docs = [make_doc(name, [[0.0]] * 2) for name in "abc"]
+    for doc in docs:
+        catalog.add(doc)
+    assert catalog.remove(docs[0]["id"])
+    assert not catalog.remove(docs[0]["id"])
+    assert docs[0]["id"] not in catalog
+    with pytest.raises(KeyError):
+        catalog.locate(docs[0]["data"][0]["id"])
+
+    compacted = catalog.compacted()
+    assert len(compacted.doc_ids) == len(compacted) == 2
+    assert compacted.locate(docs[2]["data"][1]["id"]) == (docs[2]["id"], 1)
+    assert compacted.get(docs[1]["id"])["added"] == catalog.get(docs[1]["id"])["added"]
@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import pytest
+
+from benlp.tools.code_executor import CodeExecutor, KernelManager, WorkerPool
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(num_workers=2, memory_limit=None, max_sessions=2, session_ttl=0.5)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def kernels():
+    kernels = KernelManager(max_kernels=1, memory_limit=None)
+    yield kernels
+    kernels.close()
+
+
+def test_anonymous_executions_are_one_shot(pool, tmp_path):
+    executor = CodeExecutor(pool=pool, output_dir=str(tmp_path))
+    assert executor.execute_code("x = 1\nprint(x)").get_output() == "1\n"
+    assert "NameError" in executor.execute_code("print(x)").get_output()
+    assert pool.session_workers == {}
+    assert all(not worker.sessions for worker in pool.workers)
+
+
+def test_named_sessions_keep_variables(pool, tmp_path):
+    executor = CodeExecutor(session_id="a", pool=pool, output_dir=str(tmp_path))
+    executor.execute_code("x = 1")
+    assert executor.execute_code("print(x)").get_output() == "1\n"
+    executor.reset()
+    assert "NameError" in executor.execute_code("print(x)").get_output()
+
+
+def test_least_recently_used_sessions_expire(pool):
+    for session_id in ("a", "b", "c"):
+        pool.execute(session_id, f"{session_id} = 1")
+    assert list(pool.last_used) == ["b", "c"]
+    assert sum(len(worker.sessions) for worker in pool.workers) == 2
+    # a session used again after it expired starts over
+    assert "NameError" in pool.execute("a", "print(a)")["error"]
+    assert pool.execute("c", "print(c)")["output"] == "1\n"
+
+
+def test_idle_sessions_expire(pool):
+    pool.execute("a", "a = 1")
+    time.sleep(0.6)
+    pool.execute("b", "b = 1")
+    assert list(pool.last_used) == ["b"]
+    assert "NameError" in pool.execute("a", "print(a)")["error"]
+
+# ! Kernels ===================================================================
+
+
+def test_output_streams_while_the_code_runs(kernels):
+    arrivals = []
+    code = "import time\nprint('start', flush=True)\ntime.sleep(0.5)\nprint('end')"
+    for event in kernels.stream("a", code):
+        arrivals.append((time.monotonic(), event))
+    assert [event["text"] for _, event in arrivals if event["type"] == "stream"] == ["start\n", "end\n"]
+    first, result = arrivals[0][0], arrivals[-1][0]
+    assert arrivals[-1][1]["type"] == "result" and result - first > 0.3
+
+
+def test_kernels_keep_state_until_evicted(kernels):
+    kernels.execute("a", "x = 1")
+    assert kernels.execute("a", "print(x)")["output"] == "1\n"
+    kernels.execute("b", "y = 2")
+    assert "a" not in kernels and "b" in kernels
+    assert "NameError" in kernels.execute("a", "print(x)")["error"]
+
+
+def test_timed_out_kernels_restart_empty(kernels):
+    kernels.execute("a", "x = 1")
+    result = kernels.execute("a", "while True: pass", timeout=1)
+    assert result["error"].startswith("TimeoutError")
+    assert "NameError" in kernels.execute("a", "print(x)")["error"]
+
+
+def test_async_streams(kernels):
+    async def collect():
+        return [event async for event in kernels.astream("a", "print(1)\nprint(2)")]
+    events = asyncio.run(collect())
+    assert "".join(event["text"] for event in events if event["type"] == "stream") == "1\n2\n"
+    assert events[-1]["type"] == "result" and events[-1]["error"] is None
+
+
+def test_executor_streams_and_keeps_the_output(pool, tmp_path):
+    executor = CodeExecutor(session_id="a", pool=pool, output_dir=str(tmp_path))
+    events = list(executor.stream_code("print('hi')\nraise ValueError('bad')"))
+    assert events[0] == {"type": "stream", "name": "stdout", "text": "hi\n"}
+    assert executor.get_output().startswith("hi\nError: ") and "ValueError: bad" in executor.get_output()
+
+# ! Figures ===================================================================
+
+PLOT = "import matplotlib.pyplot as plt\nplt.plot([1, 2, 3])"
+
+
+def test_figures_are_rendered_once_per_format(pool, tmp_path):
+    executor = CodeExecutor(pool=pool, output_dir=str(tmp_path), figure_formats=("png", "svg"), thumbnail_width=80)
+    figures = executor.execute_code(PLOT).get_figures(kind="matplotlib")
+    assert [figure["format"] for figure in figures] == ["png", "svg"]
+    assert figures[0]["data"].startswith(b"\x89PNG") and b"<svg" in figures[1]["data"]
+    assert figures[0]["thumbnail"].startswith(b"\x89PNG") and len(figures[0]["thumbnail"]) < len(figures[0]["data"])
+    # figures are closed after they are captured
+    assert executor.execute_code("print(1)").get_figures() == []
+
+
+def test_identical_figures_are_saved_once(pool, tmp_path):
+    executor = CodeExecutor(pool=pool, output_dir=str(tmp_path))
+    first = executor.save_matplotlib_plot(PLOT)
+    assert executor.save_matplotlib_plot(PLOT) == first
+    assert sorted(path.name for path in tmp_path.iterdir()) == [first.split("/")[-1]]
+    assert executor.save_matplotlib_plot("x = 1") is None
+
+
+def test_plotly_figures_are_returned_once_per_session(pool, tmp_path):
+    pytest.importorskip("plotly")
+    executor = CodeExecutor(session_id="a", pool=pool, output_dir=str(tmp_path))
+    path = executor.save_plotly_plot("import plotly.graph_objects as go\nfig = go.Figure(go.Bar(y=[1, 2]))")
+    assert path.endswith(".html") and "plotly" in open(path).read()
+    # still in the namespace, but already returned
+    assert executor.execute_code("y = 1").get_figures(kind="plotly") == []
@@ -0,0 +1,88 @@
+import pytest
+
+from conftest import requires_tiktoken
+
+import benlp.context
+from benlp.context import AgentContext
+
+pytestmark = requires_tiktoken
+
+
+class FakeSummarizer:
+    """
+    Stands in for Chat: records each summary prompt and answers with a short summary.
+    """
+
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, *args, **kwargs):
+        def chat(prompt):
+            self.prompts.append(prompt)
+            return {"response": f"summary {len(self.prompts)}", "tokens": 10}
+        return chat
+
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    fake = FakeSummarizer()
+    monkeypatch.setattr(benlp.context, "Chat", fake)
+    return fake
+
+
+def memory_items(count, words=40):
+    return [f"step {idx}: " + "observation " * words for idx in range(count)]
+
+
+def test_memory_under_the_threshold_is_kept(summarizer):
+    context = AgentContext(max_tokens=10000)
+    memory = memory_items(3)
+    assert context.compact_memory(memory) == memory
+    assert summarizer.prompts == []
+
+
+def test_older_memory_is_summarized_once(summarizer):
+    context = AgentContext(max_tokens=1000, keep_recent=2)
+    memory = memory_items(6)
+    compacted = context.compact_memory(memory)
+    assert compacted[-2:] == memory[-2:]
+    assert all(item.startswith("summary") for item in compacted[:-2])
+    calls = len(summarizer.prompts)
+    assert calls == 4 and context.summary_tokens == 40
+
+    # the next turn only summarizes the item that aged out of the recent window
+    memory.append("step 6: " + "observation " * 40)
+    context.compact_memory(memory)
+    assert len(summarizer.prompts) == calls + 1
+
+
+def test_summaries_that_dont_fit_are_merged(summarizer):
+    context = AgentContext(max_tokens=1000, keep_recent=1)
+    memory = memory_items(5)
+    recent_tokens = context.count(memory[-1])
+    # room for the recent item and about one summary
+    budget = recent_tokens + context.count("summary 1") + 1
+    compacted = context.compact_memory(memory, budget)
+    assert len(compacted) == 2 and compacted[-1] == memory[-1]
+    # merge prompts hold earlier summaries, not the raw memory
+    assert "summary 1\n\nsummary 2" in summarizer.prompts[4]
+
+
+def test_unused_budget_rolls_over_and_the_last_item_is_truncated(summarizer):
+    context = AgentContext(max_tokens=1000, shares={"memory": 0.5, "chunks": 0.25, "examples": 0.25})
+    chunks = [f"chunk {idx} " + "text " * 100 for idx in range(10)]
+    built = context.build(["short note"], chunks=chunks, examples=["an example"])
+    assert built["memory"] == ["short note"]
+    chunk_tokens = sum(context.count(chunk) for chunk in built["chunks"])
+    # the chunks use the memory share the note didn't need
+    assert 250 < chunk_tokens <= 750 - context.count("short note")
+    assert built["chunks"][-1] != chunks[len(built["chunks"]) - 1]
+    assert built["examples"] == ["an example"]
+
+
+def test_packing_keeps_the_newest_memory(summarizer):
+    context = AgentContext(max_tokens=1000, compaction_threshold=10)
+    memory = memory_items(20)
+    packed = context.build(memory)["memory"]
+    assert packed and packed[-1] == memory[-1]
+    assert sum(context.count(item) for item in packed) <= 450
@@ -0,0 +1,66 @@
+import pytest
+
+from conftest import requires_tiktoken
+
+from benlp.docgen import NotebookDocumenter, batch_cells
+from benlp.utils import TokenUtil
+
+pytestmark = requires_tiktoken
+
+
+class RecordingChat:
+    """
+    Stands in for ChatServer, answering every call with a short doc and recording the output budgets.
+    """
+
+    def __init__(self):
+        self.max_tokens = []
+
+    def __call__(self, messages, max_tokens, stream, **kwargs):
+        self.max_tokens.append(max_tokens)
+        content = f"docs {len(self.max_tokens)}"
+        if stream:
+            return iter([{"choices": [{"delta": {"content": content}}]}])
+        return {"choices": [{"message": {"content": content}}]}
+
+
+@pytest.mark.parametrize("model", ["gpt-3.5-turbo", "gpt-4", "gpt-3.5-turbo-16k", "gpt-4-32k"])
+def test_default_budgets_fit_the_context(model):
+    documenter = NotebookDocumenter(model=model, api_key="fake-key")
+    assert documenter.reduce_input_tokens >= documenter.map_max_tokens
+
+
+def test_16k_model_keeps_the_single_call_budget():
+    documenter = NotebookDocumenter(model="gpt-3.5-turbo-16k", api_key="fake-key")
+    assert (documenter.batch_tokens, documenter.map_max_tokens, documenter.reduce_max_tokens) == (4000, 2048, 4000)
+
+
+def test_budgets_over_the_context_raise():
+    with pytest.raises(ValueError, match="reduce_max_tokens"):
+        NotebookDocumenter(model="gpt-3.5-turbo", reduce_max_tokens=4000, api_key="fake-key")
+    with pytest.raises(ValueError, match="batch_tokens"):
+        NotebookDocumenter(model="gpt-3.5-turbo", batch_tokens=4000, api_key="fake-key")
+
+
+def test_batches_keep_order_and_split_big_cells():
+    token_util = TokenUtil("gpt-3.5-turbo")
+    big = "".join(f"x_{idx} = {idx}\n" for idx in range(200))
+    batches = batch_cells(["a = 1", "", big, "b = 2"], token_util, 100)
+    assert "".join(piece for batch in batches for piece in batch) == "a = 1" + big + "b = 2"
+    assert all(sum(token_util.get_tokens(piece) for piece in batch) <= 100 or len(batch) == 1 for batch in batches)
+
+
+def test_single_batch_streams_one_call():
+    documenter = NotebookDocumenter(api_key="fake-key")
+    documenter.chat = RecordingChat()
+    assert documenter.document(["a = 1", "b = a + 1"]) == "docs 1"
+    assert documenter.chat.max_tokens == [2048]
+
+
+def test_batches_are_mapped_then_merged():
+    documenter = NotebookDocumenter(batch_tokens=10, api_key="fake-key")
+    documenter.chat = RecordingChat()
+    sources = [f"value_{idx} = {idx} * {idx} + {idx}" for idx in range(5)]
+    docs = documenter.document(sources)
+    assert documenter.chat.max_tokens == [2048] * 5 + [4000]
+    assert docs == "docs 6"
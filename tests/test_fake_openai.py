@@ -0,0 +1,46 @@
+import statistics
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import fake_openai_app
+
+
+@pytest.fixture
+def client(fake_openai):
+    # the fake_openai fixture resets the settings and counters around each test
+    return TestClient(fake_openai_app.app)
+
+
+def test_injected_errors(client):
+    client.post("/fake/config", json={"error_rate": 1, "error_status": 503, "retry_after": "2"})
+    response = client.post("/v1/chat/completions", json={"messages": []})
+    assert response.status_code == 503 and response.headers["retry-after"] == "2"
+    assert client.get("/fake/config").json()["stats"] == {"requests": 1, "errors": 1}
+
+
+def test_unknown_settings_are_rejected(client):
+    assert client.post("/fake/config", json={"latencyy": 1}).status_code == 400
+
+
+def test_embeddings_are_deterministic(client):
+    client.post("/fake/config", json={"embedding_dim": 8})
+    first = client.post("/v1/embeddings", json={"input": ["a", "b"]}).json()["data"]
+    second = client.post("/v1/embeddings", json={"input": "a"}).json()["data"]
+    assert len(first[0]["embedding"]) == 8
+    assert first[0]["embedding"] == second[0]["embedding"] != first[1]["embedding"]
+
+
+def test_streams_send_the_configured_tokens(client):
+    client.post("/fake/config", json={"tokens": 3})
+    response = client.post("/v1/chat/completions", json={"messages": [], "stream": True})
+    lines = [line for line in response.text.splitlines() if line.startswith("data:")]
+    # the role chunk, a chunk per token, the finish chunk and [DONE]
+    assert len(lines) == 6 and lines[-1] == "data: [DONE]"
+
+
+@pytest.mark.parametrize("dist", ["constant", "uniform", "exponential", "lognormal"])
+def test_latency_distributions_keep_the_mean(fake_openai, dist):
+    fake_openai_app.CONFIG.update(latency_dist=dist, latency_sigma=0.5)
+    samples = [fake_openai_app.sample_latency(1.0) for _ in range(5000)]
+    assert min(samples) >= 0 and statistics.fmean(samples) == pytest.approx(1.0, rel=0.1)
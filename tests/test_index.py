@@ -0,0 +1,109 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from conftest import make_doc
+
+from benlp.catalog import Catalog
+from benlp.index import VectorIndex
+from benlp.wal import IndexStore
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def random_doc(name, rng, chunks=3, fpath=None):
+    return make_doc(name, rng.standard_normal((chunks, 8)), fpath=fpath)
+
+
+def brute_force(docs, query, top_k):
+    rows = [(chunk["id"], np.asarray(chunk["embedding"])) for doc in docs for chunk in doc["data"]]
+    query = np.asarray(query) / np.linalg.norm(query)
+    scores = [(float(vector @ query / np.linalg.norm(vector)), chunk_id) for chunk_id, vector in rows]
+    return [chunk_id for _, chunk_id in sorted(scores, reverse=True)[:top_k]]
+
+
+def test_add_and_delete(rng):
+    index = VectorIndex()
+    docs = [random_doc(f"d{idx}", rng) for idx in range(3)]
+    for doc in docs:
+        assert index.add_document(doc)
+    assert not index.add_document(docs[0])
+    assert len(index) == 3
+
+    assert index.delete_document(docs[1]["id"])
+    assert not index.delete_document(docs[1]["id"])
+    assert docs[1]["id"] not in index
+    hits = index.search(docs[1]["data"][0]["embedding"], top_k=9)
+    assert not {hit["id"] for hit in hits} & {chunk["id"] for chunk in docs[1]["data"]}
+
+
+def test_upsert_replaces_the_document_at_the_same_path(rng):
+    index = VectorIndex()
+    old = random_doc("draft", rng, fpath="/docs/report.txt")
+    new = random_doc("final", rng, fpath="/docs/report.txt")
+    assert index.upsert_document(old)
+    assert not index.upsert_document(old)
+    assert index.upsert_document(new)
+    assert old["id"] not in index and new["id"] in index
+    assert len(index) == 1
+
+
+def test_upsert_moves_unchanged_content_to_its_new_path(rng):
+    index = VectorIndex()
+    doc = random_doc("notes", rng, fpath="/docs/old.txt")
+    index.upsert_document(doc)
+    moved = dict(doc, fpath="/docs/new.txt")
+    assert index.upsert_document(moved)
+    assert len(index) == 1
+    assert index.catalog.get(doc["id"])["fpath"] == "/docs/new.txt"
+
+
+def test_store_only_logs_upserts_that_change_the_index(tmp_path, rng):
+    store = IndexStore(str(tmp_path / "index.pkl"))
+    doc = random_doc("notes", rng, fpath="/docs/old.txt")
+    assert store.upsert_document(doc)
+    lsn = store.lsn
+    assert not store.upsert_document(doc)
+    assert store.lsn == lsn
+    assert store.upsert_document(dict(doc, fpath="/docs/new.txt"))
+    store.close()
+
+    reopened = IndexStore(str(tmp_path / "index.pkl"))
+    assert reopened.index.catalog.get(doc["id"])["fpath"] == "/docs/new.txt"
+    reopened.close()
+
+
+def test_search_matches_brute_force_across_segments_and_compaction(rng):
+    index = VectorIndex(compaction_threshold=0.3, max_segments=4)
+    docs = [random_doc(f"d{idx}", rng) for idx in range(12)]
+    for doc in docs:
+        index.add_document(doc)
+    for doc in docs[::3]:
+        index.delete_document(doc["id"])
+    live = [doc for idx, doc in enumerate(docs) if idx % 3]
+
+    query = rng.standard_normal(8)
+    assert [hit["id"] for hit in index.search(query, top_k=5)] == brute_force(live, query, 5)
+    index.compact(wait=True)
+    stats = index.stats()
+    assert stats["segments"] == 1 and stats["tombstones"] == 0
+    assert [hit["id"] for hit in index.search(query, top_k=5)] == brute_force(live, query, 5)
+
+
+def test_pickle_round_trip_is_compacted(rng):
+    index = VectorIndex(metric="l2")
+    docs = [random_doc(f"d{idx}", rng) for idx in range(3)]
+    for doc in docs:
+        index.add_document(doc)
+    index.delete_document(docs[0]["id"])
+
+    loaded = pickle.loads(pickle.dumps(index))
+    assert loaded.metric == "l2"
+    assert loaded.stats()["segments"] == 1
+    assert loaded.stats()["tombstones"] == 0
+    query = docs[2]["data"][1]["embedding"]
+    assert loaded.search(query, top_k=1)[0]["id"] == docs[2]["data"][1]["id"]
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from benlp.metrics import (HTTP_REQUESTS, REGISTRY, Counter, Histogram, add_hook, get_trace, record_span,
+                           remove_hook, span)
+from middleware import MetricsMiddleware
+
+
+@pytest.fixture
+def metrics():
+    """
+    Metrics made in a test, taken out of the shared registry after.
+    """
+    made = []
+
+    def make(kind, name, labels=(), **kwargs):
+        metric = kind(f"test_{name}", f"test {name}", labels, **kwargs)
+        made.append(metric)
+        return metric
+    yield make
+    for metric in made:
+        REGISTRY.metrics.pop(metric.name, None)
+
+
+@pytest.fixture
+def events():
+    received = []
+    add_hook(received.append)
+    yield received
+    remove_hook(received.append)
+
+# ! Metrics ===================================================================
+
+
+def test_counters_and_histograms_render_as_prometheus_text(metrics):
+    requests = metrics(Counter, "requests", ("status",))
+    requests.inc(status=200)
+    requests.inc(2, status=200)
+    requests.inc(status=500)
+    latency = metrics(Histogram, "latency", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+
+    text = REGISTRY.render()
+    assert "# TYPE test_requests counter" in text
+    assert 'test_requests{status="200"} 3' in text and 'test_requests{status="500"} 1' in text
+    assert 'test_latency_bucket{le="0.1"} 1' in text and 'test_latency_bucket{le="1"} 2' in text
+    assert 'test_latency_bucket{le="+Inf"} 3' in text
+    assert "test_latency_sum 5.55" in text and "test_latency_count 3" in text
+
+
+def test_hooks_see_observations_and_spans_and_failures_are_contained(metrics, events):
+    def broken(event):
+        raise RuntimeError("hook broke")
+    add_hook(broken)
+    try:
+        counter = metrics(Counter, "hooked")
+        with span("work") as current:
+            counter.inc()
+    finally:
+        remove_hook(broken)
+    assert counter.get() == 1
+    metric, finished = events
+    assert metric == {"type": "metric", "name": "test_hooked", "value": 1, "labels": {}, "trace_id": current.trace_id}
+    assert finished["type"] == "span" and finished["name"] == "work" and finished["duration"] >= 0
+
+# ! Tracing ===================================================================
+
+
+def test_spans_nest_across_threads_and_record_errors():
+    async def scenario():
+        with span("request") as root:
+            def in_thread():
+                with span("search"):
+                    record_span("llm.stream", 0.0, 0.5, chunks=3)
+            await asyncio.to_thread(in_thread)
+            with pytest.raises(ValueError):
+                with span("failing"):
+                    raise ValueError("bad")
+        return root
+
+    root = asyncio.run(scenario())
+    spans = {s["name"]: s for s in get_trace(root.trace_id)}
+    assert set(spans) == {"request", "search", "llm.stream", "failing"}
+    assert spans["search"]["parent_id"] == root.span_id
+    assert spans["llm.stream"]["parent_id"] == spans["search"]["span_id"]
+    assert spans["llm.stream"]["attrs"] == {"chunks": 3} and spans["llm.stream"]["duration"] == 0.5
+    assert spans["failing"]["error"] == "ValueError('bad')"
+
+
+def test_server_requests_are_traced_and_counted_by_route():
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        with span("lookup"):
+            return {"id": item_id}
+
+    client = TestClient(MetricsMiddleware(app))
+    before = HTTP_REQUESTS.get(method="GET", path="/items/{item_id}", status=200)
+    response = client.get("/items/1")
+    client.get("/items/2", headers={"X-Trace-Id": "caller-trace"})
+
+    trace_id = response.headers["x-trace-id"]
+    spans = {s["name"]: s for s in get_trace(trace_id)}
+    assert spans["lookup"]["parent_id"] == spans["http.request"]["span_id"]
+    assert spans["http.request"]["attrs"]["status"] == 200
+    # the caller's trace id is continued
+    assert [s["name"] for s in get_trace("caller-trace")] == ["lookup", "http.request"]
+    assert HTTP_REQUESTS.get(method="GET", path="/items/{item_id}", status=200) == before + 2
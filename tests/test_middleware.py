@@ -0,0 +1,58 @@
+import importlib
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from middleware import APIKeyMiddleware, TokenBucket, hash_api_key, load_api_keys
+
+
+def make_app(api_keys, **kwargs):
+    app = FastAPI()
+
+    @app.get("/private")
+    async def private():
+        return {"ok": True}
+
+    @app.get("/metrics")
+    async def metrics():
+        return {"ok": True}
+
+    return APIKeyMiddleware(app, api_keys=api_keys, **kwargs)
+
+
+def test_keys_are_checked_by_hash():
+    client = TestClient(make_app({hash_api_key("secret"): TokenBucket(100, 100)}))
+    assert client.get("/private", headers={"X-API-KEY": "secret"}).status_code == 200
+    assert client.get("/private", headers={"X-API-KEY": "wrong"}).json() == {"error": "Invalid API key"}
+    assert client.get("/private").json() == {"error": "Missing API Key"}
+
+
+def test_public_paths_and_preflight_skip_the_check():
+    client = TestClient(make_app({hash_api_key("secret"): TokenBucket(100, 100)}))
+    assert client.get("/metrics").status_code == 200
+    assert client.options("/private").status_code != 401
+
+
+def test_quota_per_key():
+    client = TestClient(make_app({hash_api_key("secret"): TokenBucket(0.5, 2)}))
+    statuses = [client.get("/private", headers={"X-API-KEY": "secret"}).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+
+def test_load_api_keys_parses_quotas():
+    key_hash = hash_api_key("a")
+    keys = load_api_keys(f"{key_hash.upper()}:2:7, ", plain_key="b")
+    assert keys[key_hash].rate == 2 and keys[key_hash].burst == 7
+    assert hash_api_key("b") in keys
+    assert load_api_keys("", plain_key=None) == {}
+
+
+def test_key_check_is_only_installed_with_keys(monkeypatch):
+    import main
+
+    def key_check_installed(keys):
+        monkeypatch.setattr("middleware.load_api_keys", lambda: keys)
+        return any(middleware.cls is APIKeyMiddleware for middleware in importlib.reload(main).app.user_middleware)
+
+    assert key_check_installed({hash_api_key("secret"): TokenBucket(1, 1)})
+    assert not key_check_installed({})
@@ -0,0 +1,68 @@
+import io
+import json
+
+import pytest
+
+from benlp.document import JupyterSimple, JupyterSimpleServer
+from benlp.notebook import parse_notebook
+
+NOTEBOOK = {
+    "cells": [
+        {"cell_type": "markdown", "source": ["# Title\n", "text"]},
+        {"cell_type": "code", "source": ["x = 1\n", "print(x)"], "outputs": [
+            {"output_type": "stream", "text": ["1\n"]},
+            {"output_type": "display_data", "data": {"image/png": "aGVsbG8=" * 100, "text/plain": ["<Figure>"]}},
+        ]},
+    ],
+}
+
+
+@pytest.fixture
+def notebook_path(tmp_path):
+    path = tmp_path / "notebook.ipynb"
+    path.write_text(json.dumps(NOTEBOOK))
+    return str(path)
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_cells_are_joined_and_images_stripped(notebook_path, streaming):
+    cells = parse_notebook(path=notebook_path, streaming=streaming)
+    assert [cell["source"] for cell in cells] == ["# Title\ntext", "x = 1\nprint(x)"]
+    outputs = cells[1]["outputs"]
+    assert outputs[0]["text"] == "1\n"
+    assert outputs[1]["data"] == {"image/png": "<image/png output omitted>", "text/plain": "<Figure>"}
+
+    kept = parse_notebook(path=notebook_path, streaming=streaming, strip_images=False)
+    assert kept[1]["outputs"][1]["data"]["image/png"] == NOTEBOOK["cells"][1]["outputs"][1]["data"]["image/png"]
+
+
+def test_contents_as_text_bytes_or_file_match_the_path(notebook_path):
+    expected = parse_notebook(path=notebook_path)
+    text = json.dumps(NOTEBOOK)
+    assert parse_notebook(contents=text) == expected
+    assert parse_notebook(contents=text.encode("utf-8")) == expected
+    f = io.BytesIO(text.encode("utf-8"))
+    assert parse_notebook(contents=f) == expected
+    # a file passed in belongs to the caller and stays open
+    assert not f.closed
+
+
+def test_contents_are_never_read_as_a_path(notebook_path):
+    with pytest.raises(Exception) as info:
+        parse_notebook(contents=notebook_path)
+    assert not isinstance(info.value, (FileNotFoundError, PermissionError))
+    with pytest.raises(Exception):
+        JupyterSimpleServer(notebook_path)
+
+
+def test_exactly_one_source(notebook_path):
+    with pytest.raises(ValueError):
+        parse_notebook()
+    with pytest.raises(ValueError):
+        parse_notebook(path=notebook_path, contents=b"{}")
+
+
+def test_jupyter_simple_reads_paths_and_the_server_version_contents(notebook_path):
+    assert len(JupyterSimple(notebook_path).code_cells) == 1
+    with open(notebook_path, "rb") as f:
+        assert len(JupyterSimpleServer(f).code_cells) == 1
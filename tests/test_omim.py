@@ -0,0 +1,225 @@
+"""
+The OMIM client against a local HTTP stub: connection reuse, the TTL cache, request coalescing, rate limiting,
+retries, batching and pagination.
+"""
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from benlp.resilience import get_breaker
+from benlp.tools.omim import OMIM, EntrySearchParams
+
+
+class StubOMIM:
+    """
+    Answers every GET with a small entry response (or what `respond(path, params)` returns) after `delay` seconds.
+    Statuses queued in `failures` (with an optional Retry-After) are returned first, one per request.
+    """
+
+    def __init__(self):
+        self.requests = []  # (arrival time, client address, path, params)
+        self.failures = []  # (status, retry after or None)
+        self.delay = 0
+        self.respond = None
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                with stub.lock:
+                    stub.requests.append((time.monotonic(), self.client_address, url.path, parse_qs(url.query)))
+                    failure = stub.failures.pop(0) if stub.failures else None
+                time.sleep(stub.delay)
+                if failure is not None:
+                    status, retry_after = failure
+                    body = json.dumps({"error": "stub failure"}).encode("utf-8")
+                    self.send_response(status)
+                    if retry_after is not None:
+                        self.send_header("Retry-After", str(retry_after))
+                else:
+                    response = {"omim": {"entryList": [{"entry": {"mimNumber": 100100}}]}}
+                    if stub.respond is not None:
+                        response = stub.respond(url.path, parse_qs(url.query))
+                    body = json.dumps(response).encode("utf-8")
+                    self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    stub = StubOMIM()
+    # the breaker is shared by every OMIM client, don't let failures leak between tests
+    get_breaker("omim").record_success()
+    yield stub
+    stub.close()
+    get_breaker("omim").record_success()
+
+
+def make_client(stub, **kwargs):
+    options = {"base_url": stub.url, "cache_dir": None, "rate_limit": 1000}
+    return OMIM(**{**options, **kwargs})
+
+
+def test_connection_reuse(stub):
+    omim = make_client(stub)
+    for mim_number in range(5):
+        assert omim.get("entry", {"mimNumber": [mim_number]}) is not None
+    assert len(stub.requests) == 5
+    assert len({address for _, address, _, _ in stub.requests}) == 1
+    omim.close()
+
+
+def test_request_params(stub):
+    omim = make_client(stub)
+    omim.get("entry", {"mimNumber": [100100, 100200], "include": ["text"], "exclude": []})
+    _, _, path, params = stub.requests[0]
+    assert path == "/api/entry"
+    assert params["mimNumber"] == ["100100,100200"]
+    assert params["include"] == ["text"]
+    assert params["format"] == ["json"]
+    assert "exclude" not in params
+
+
+def test_cache_hit_and_expiry(stub, tmp_path):
+    omim = make_client(stub, cache_dir=str(tmp_path), cache_ttl=0.3)
+    first = omim.get("entry", {"mimNumber": [100100]})
+    # equivalent params share the cache entry
+    assert omim.get("entry", {"mimNumber": [100100], "exclude": []}) == first
+    assert len(stub.requests) == 1
+    assert omim.cache.hits == 1
+
+    time.sleep(0.4)
+    assert omim.get("entry", {"mimNumber": [100100]}) == first
+    assert len(stub.requests) == 2
+
+
+def test_concurrent_identical_requests_coalesce(stub):
+    stub.delay = 0.3
+    omim = make_client(stub)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: omim.get("entry", {"mimNumber": [100100]}), range(8)))
+    assert all(result == results[0] for result in results)
+    assert len(stub.requests) == 1
+
+
+def test_rate_limit(stub):
+    omim = make_client(stub, rate_limit=20)
+    for mim_number in range(30):
+        omim.get("entry", {"mimNumber": [mim_number]})
+    arrivals = [arrival for arrival, _, _, _ in stub.requests]
+    # a burst of 20, then 20 per second
+    assert arrivals[-1] - arrivals[0] >= 0.45
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retries_transient_errors(stub, status):
+    stub.failures = [(status, 0.1), (status, 0)]
+    omim = make_client(stub)
+    start = time.monotonic()
+    assert omim.get("entry", {"mimNumber": [100100]}) is not None
+    assert len(stub.requests) == 3
+    # Retry-After is honored
+    assert time.monotonic() - start >= 0.1
+
+
+def test_client_errors_are_not_retried(stub):
+    stub.failures = [(404, None)]
+    omim = make_client(stub)
+    assert omim.get("entry", {"mimNumber": [100100]}) is None
+    assert len(stub.requests) == 1
+
+
+def test_gives_up_after_attempts(stub):
+    stub.failures = [(503, 0)] * 5
+    omim = make_client(stub)
+    assert omim.get("entry", {"mimNumber": [100100]}) is None
+    assert len(stub.requests) == omim.policy.attempts
+
+
+# ! Bulk ======================================================================
+
+
+def echo_entries(path, params):
+    return {"omim": {"entryList": [{"entry": {"mimNumber": int(number)}}
+                                   for number in params["mimNumber"][0].split(",")]}}
+
+
+def search_pages(total):
+    def respond(path, params):
+        start, limit = int(params["start"][0]), int(params["limit"][0])
+        entries = [{"entry": {"mimNumber": number}} for number in range(start, min(start + limit, total))]
+        return {"omim": {"searchResponse": {"totalResults": total, "entryList": entries}}}
+    return respond
+
+
+def test_mim_numbers_are_fetched_in_batches(stub):
+    stub.respond = echo_entries
+    omim = make_client(stub)
+    mim_numbers = list(range(100000, 100045))
+    entries = omim.fetch_entries(mim_numbers)
+    assert [entry["mimNumber"] for entry in entries] == mim_numbers
+    assert sorted(len(params["mimNumber"][0].split(",")) for _, _, _, params in stub.requests) == [5, 20, 20]
+    # batches never exceed what the API accepts
+    omim.fetch_entries(mim_numbers, batch_size=100)
+    assert len(stub.requests) == 6
+
+
+def test_batches_stream_as_they_arrive(stub):
+    stub.respond = echo_entries
+    omim = make_client(stub)
+    mim_numbers = list(range(100000, 100045))
+
+    async def collect():
+        return [entry["mimNumber"] async for entry in omim.iter_entries(mim_numbers, batch_size=10)]
+    assert sorted(asyncio.run(collect())) == mim_numbers
+    assert len(stub.requests) == 5
+
+
+def test_search_pages_are_walked(stub):
+    stub.respond = search_pages(45)
+    omim = make_client(stub)
+
+    async def collect():
+        pages = omim.iter_search_entries(EntrySearchParams(search="marfan"), page_size=20)
+        return [entry["mimNumber"] async for entry in pages]
+    assert asyncio.run(collect()) == list(range(45))
+    assert [params["start"] for _, _, _, params in stub.requests] == [["0"], ["20"], ["40"]]
+
+
+def test_stopping_early_skips_the_remaining_pages(stub):
+    stub.respond = search_pages(1000)
+    omim = make_client(stub)
+
+    async def first():
+        pages = omim.iter_search_entries(EntrySearchParams(search="marfan"), page_size=20)
+        async for entry in pages:
+            break
+        await pages.aclose()
+        return entry["mimNumber"]
+    assert asyncio.run(first()) == 0
+    # at most the prefetched second page was requested
+    assert len(stub.requests) <= 2
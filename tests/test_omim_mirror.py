@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from benlp.tools.omim import EntrySearchParams, GeneMapParams
+from benlp.tools.omim_mirror import OMIMMirror
+
+DEFAULT_INCLUDE = EntrySearchParams.__fields__["include"].default
+
+
+def entry(mim_number, title, **sections):
+    return {"mimNumber": mim_number, "prefix": "#", "titles": {"preferredTitle": title}, **sections}
+
+
+@pytest.fixture
+def mirror():
+    mirror = OMIMMirror(":memory:")
+    # title stubs, like load_mim_titles
+    mirror.add_entries([entry(100000 + idx, f"MUSCULAR DYSTROPHY TYPE {idx}") for idx in range(25)])
+    # a fully synced entry
+    mirror.add_entries([entry(300377, "DYSTROPHIN", clinicalSynopsis={"inheritance": "X-linked"})],
+                       include=DEFAULT_INCLUDE)
+    mirror.add_gene_map([
+        {"sequenceID": idx, "mimNumber": 200000 + idx, "chromosomeSymbol": "1", "geneSymbols": f"GENE{idx}",
+         "phenotypeMapList": [{"phenotypeMap": {"phenotype": "Disease"}}] if idx % 3 == 0 else []}
+        for idx in range(1, 31)
+    ])
+    yield mirror
+    mirror.close()
+
+
+def test_fetch_entry_only_answers_held_sections(mirror):
+    assert mirror.fetch_entry([100001]) is not None
+    assert mirror.fetch_entry([100001], include=["text"]) is None
+    assert mirror.fetch_entry([100001], include=DEFAULT_INCLUDE) is None
+    response = mirror.fetch_entry([300377], include=DEFAULT_INCLUDE)
+    assert response["omim"]["entryList"][0]["entry"]["clinicalSynopsis"]
+    assert mirror.fetch_entry([300377], include=["text"]) is None
+    assert mirror.fetch_entry([300377], include=[], exclude=["dates"]) is None
+    # missing numbers go to the API
+    assert mirror.fetch_entry([100001, 999999]) is None
+
+
+def test_searches_fall_through_until_the_catalog_is_synced(mirror):
+    params = EntrySearchParams(search="muscular dystrophy", include=[])
+    # partial loads, and a complete catalog of titles only, can't stand in for a full text search
+    assert mirror.search_entry(params) is None
+    mirror.mark_synced("entries")
+    assert mirror.search_entry(params) is None
+    mirror.mark_synced("entries", include=["text"])
+    assert mirror.search_entry(params) is not None
+    assert mirror.search_entry(EntrySearchParams(search="muscular dystrophy")) is None
+
+
+def test_search_entry_counts_all_matches(mirror):
+    mirror.mark_synced("entries", include=["text", *DEFAULT_INCLUDE])
+    params = EntrySearchParams(search="muscular dystrophy", start=10, limit=10, include=[])
+    response = mirror.search_entry(params)["omim"]["searchResponse"]
+    assert response["totalResults"] == 25
+    assert len(response["entryList"]) == 10
+    assert response["startIndex"] == 10 and response["endIndex"] == 19
+
+
+def test_search_entry_falls_through_for_unsupported_params(mirror):
+    mirror.mark_synced("entries", include=["text"])
+    assert mirror.search_entry(EntrySearchParams(search="dystrophy", include=[])) is not None
+    # title stubs don't hold the default sections
+    mirror.mark_synced("entries", include=["text", *DEFAULT_INCLUDE])
+    assert mirror.search_entry(EntrySearchParams(search="dystrophy")) is None
+    for override in ({"sort": "number asc"}, {"fields": "title"}, {"retrieve": "geneMap"}, {"exclude": ["dates"]},
+                     {"filter": "prefix:#"}):
+        assert mirror.search_entry(EntrySearchParams(search="dystrophy", include=[], **override)) is None
+    assert mirror.search_entry(EntrySearchParams(search="nothing matches this", include=[])) is None
+
+
+def test_gene_map_listings_need_a_synced_chromosome(mirror):
+    assert mirror.fetch_gene_map(GeneMapParams(chromosome="1")) is None
+    # lookups by number only need the requested records
+    assert mirror.fetch_gene_map(GeneMapParams(mim_number=[200001, 200002])) is not None
+    assert mirror.fetch_gene_map(GeneMapParams(mim_number=[200001, 999999])) is None
+    mirror.mark_synced("gene_map:1")
+    assert mirror.fetch_gene_map(GeneMapParams(chromosome="1")) is not None
+    assert mirror.fetch_gene_map(GeneMapParams(chromosome="2")) is None
+
+
+def test_gene_map_filters_before_paging(mirror):
+    mirror.mark_synced("gene_map")
+    response = mirror.fetch_gene_map(GeneMapParams(chromosome="1", phenotype_exists=True, limit=5))
+    page = response["omim"]["listResponse"]
+    assert page["totalResults"] == 10
+    assert len(page["geneMapList"]) == 5
+    assert all(item["geneMap"]["phenotypeMapList"] for item in page["geneMapList"])
+
+    page = mirror.fetch_gene_map(GeneMapParams(chromosome="1", start=25, limit=10))["omim"]["listResponse"]
+    assert page["totalResults"] == 30
+    assert len(page["geneMapList"]) == 5
+    assert mirror.fetch_gene_map(GeneMapParams(chromosome="1", chromosome_sort=5)) is None
+
+
+class FakeOMIM:
+    """
+    Streams canned records like OMIM.iter_gene_map/iter_entries, failing partway when asked to.
+    """
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+
+    async def iter_gene_map(self, params):
+        for idx in range(3):
+            if self.fail_after is not None and idx >= self.fail_after:
+                raise ConnectionError("API went away")
+            yield {"sequenceID": 1000 * len(params.chromosome) + idx, "mimNumber": 400000 + idx,
+                   "chromosomeSymbol": params.chromosome, "geneSymbols": f"SYNC{idx}"}
+
+    async def iter_entries(self, mim_numbers, include):
+        for mim_number in mim_numbers:
+            yield entry(mim_number, f"SYNCED {mim_number}", text="full text")
+
+
+def test_only_finished_syncs_are_recorded():
+    mirror = OMIMMirror(":memory:")
+    with pytest.raises(ConnectionError):
+        asyncio.run(mirror.sync_gene_map(FakeOMIM(fail_after=2), chromosomes=["X"]))
+    assert not mirror.covers("gene_map:X")
+
+    asyncio.run(mirror.sync_gene_map(FakeOMIM(), chromosomes=["X"]))
+    assert mirror.covers("gene_map:X") and not mirror.covers("gene_map")
+
+    asyncio.run(mirror.sync_entries(FakeOMIM(), [1, 2], include=["text"]))
+    assert not mirror.covers("entries")
+    asyncio.run(mirror.sync_entries(FakeOMIM(), [1, 2], include=["text"], complete=True))
+    assert mirror.search_entry(EntrySearchParams(search="synced", include=["text"]))["omim"]["searchResponse"][
+        "totalResults"] == 2
+    mirror.close()
@@ -0,0 +1,50 @@
+import pytest
+
+from benlp.parsers import OutputParserError, parse_bool, parse_json, repair_json
+
+
+def test_repairs_python_literals_and_trailing_commas():
+    assert parse_json('```json\n[{"done": True, "result": None, "failed": False,},]\n```') == [
+        {"done": True, "result": None, "failed": False}
+    ]
+
+
+def test_leaves_string_values_alone():
+    text = '[{"instruction": "None of the above, True or False?", "quote": "say \\"None\\", ]", "ok": True,}]'
+    assert parse_json(text) == [
+        {"instruction": "None of the above, True or False?", "quote": 'say "None", ]', "ok": True}
+    ]
+    assert '"None of the above, True or False?"' in repair_json(text)
+
+
+def test_truncated_output_is_closed():
+    assert parse_json('[{"name": "a", "deps": ["b"') == [{"name": "a", "deps": ["b"]}]
+
+
+def test_single_quoted_literals():
+    assert parse_json("{'name': 'a', 'deps': []}") == {"name": "a", "deps": []}
+
+
+@pytest.mark.parametrize("text", ["not json at all", "[" * 100000, '{"a": {1, [2]}}', "{[1]: 2}"])
+def test_unparseable_output_raises_parser_error(text):
+    with pytest.raises(OutputParserError):
+        parse_json(text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("True", True),
+    ("false", False),
+    ("True. There are no further tasks.", True),
+    ("Yes, nothing else is needed, no", True),
+    ("No, the summary is still missing. Once it's written this will be true.", False),
+    ("Answer: FALSE", False),
+    ("**Yes**", True),
+])
+def test_parse_bool_takes_the_first_answer(text, expected):
+    assert parse_bool(text) is expected
+
+
+@pytest.mark.parametrize("text", ["", "maybe", "It is not known yet", "Notable progress, but untrue so far"])
+def test_parse_bool_without_an_answer_raises(text):
+    with pytest.raises(OutputParserError):
+        parse_bool(text)
@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+from conftest import requires_tiktoken
+
+from benlp.react import ReActRuntime, code_tool, find_action, omim_tool
+from benlp.tools.code_executor import WorkerPool
+
+
+class ScriptedChat:
+    """
+    Stands in for ChatServer, streaming each scripted reply a few characters at a time.
+    """
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.streams = []
+
+    def __call__(self, messages, stream, **kwargs):
+        reply = self.replies.pop(0)
+        sent = []
+
+        def chunks():
+            for idx in range(0, len(reply), 4):
+                sent.append(reply[idx:idx + 4])
+                yield {"choices": [{"delta": {"content": reply[idx:idx + 4]}}]}
+        response = chunks()
+        self.streams.append((response, sent))
+        return response
+
+
+def test_find_action_waits_for_balanced_brackets():
+    assert find_action("Thought: run it\nAction: Code[print([1, 2]") is None
+    tool, arg, end = find_action("Thought: run it\nAction: Code[print([1, 2])]\nmore")
+    assert (tool, arg) == ("Code", "print([1, 2])")
+    assert find_action("Action: Finish[done]")[:2] == ("Finish", "done")
+    assert find_action("no action here") is None
+
+
+@requires_tiktoken
+def test_runtime_stops_the_stream_at_the_action():
+    runtime = ReActRuntime(tools={"Echo": lambda arg: arg.upper()}, api_key="fake-key")
+    runtime.chat = ScriptedChat([
+        "Thought: echo it\nAction: Echo[hi]\nObservation: made up by the model, never read",
+        "Thought: done\nAction: Finish[HI]",
+    ])
+    result = runtime.run("Shout hi")
+    assert result["answer"] == "HI"
+    assert result["steps"] == [{"tool": "Echo", "input": "hi", "observation": "HI"}]
+    assert "made up" not in result["transcript"]
+    first_stream, sent = runtime.chat.streams[0]
+    assert "never read" not in "".join(sent)
+    # the generator was closed, not left suspended
+    assert first_stream.gi_frame is None
+
+
+@requires_tiktoken
+def test_unknown_tools_and_errors_become_observations():
+    def broken(arg):
+        raise RuntimeError("tool broke")
+    runtime = ReActRuntime(tools={"Broken": broken}, max_observation_chars=20, api_key="fake-key")
+    assert runtime.dispatch("Broken", "x") == "Error: tool broke"
+    assert runtime.dispatch("Missing", "x").startswith("Unknown action Missing")
+    runtime.tools["long"] = lambda arg: "x" * 50
+    assert runtime.dispatch("Long", "") == "x" * 20 + "..."
+
+
+def test_code_tool_runs_on_the_given_pool():
+    pool = WorkerPool(num_workers=1, memory_limit=None)
+    try:
+        fresh = code_tool(pool=pool)["function"]
+        assert fresh("print(1 + 1)") == "2\n"
+        assert fresh("x = 1") == "Code executed with no output."
+        assert "NameError" in fresh("print(x)")
+
+        session = code_tool(session_id="react", pool=pool)["function"]
+        session("y = 2")
+        assert session("print(y)") == "2\n"
+    finally:
+        pool.close()
+
+
+def test_omim_tool_builds_one_client(monkeypatch):
+    created = []
+
+    class FakeOMIM:
+        def __init__(self):
+            created.append(self)
+            self.queries = []
+
+        def search_entry(self, params):
+            self.queries.append(params.search)
+            return {"entries": [params.search]}
+
+    monkeypatch.setattr("benlp.tools.omim.OMIM", FakeOMIM)
+    search = omim_tool()["function"]
+    assert search("marfan") == '{"entries": ["marfan"]}'
+    search("cystic fibrosis")
+    assert len(created) == 1 and created[0].queries == ["marfan", "cystic fibrosis"]
+
+
+@requires_tiktoken
+def test_runtime_returns_once_stopped():
+    stop = threading.Event()
+
+    def stop_now(arg):
+        stop.set()
+        return "stopping"
+    runtime = ReActRuntime(tools={"Stop": stop_now}, api_key="fake-key")
+    runtime.chat = ScriptedChat(["Action: Stop[now]", "Action: Finish[never reached]"])
+    result = runtime.run("Stop", stop=stop)
+    assert result["answer"] is None
+    assert len(runtime.chat.streams) == 1
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import openai
+import pytest
+
+from benlp.rerank import LLMReranker, Reranker, get_reranker
+
+
+class ScriptedReranker(Reranker):
+    """
+    Scores passages by a lookup table, recording which passages each call was sent.
+    """
+
+    def __init__(self, table, delay=0, **kwargs):
+        super().__init__(**kwargs)
+        self.table = table
+        self.delay = delay
+        self.calls = []
+
+    def score(self, query, texts, timeout):
+        self.calls.append(texts)
+        time.sleep(self.delay)
+        return [self.table[text] for text in texts]
+
+    async def ascore(self, query, texts, timeout):
+        self.calls.append(texts)
+        await asyncio.sleep(self.delay)
+        return [self.table[text] for text in texts]
+
+
+def candidates(*texts):
+    # first stage order, best similarity first
+    return [{"id": text, "text": text, "similarity": 1 - idx / 10} for idx, text in enumerate(texts)]
+
+
+def test_candidates_are_reordered_by_score():
+    reranker = ScriptedReranker({"a": 1, "b": 9, "c": 5, "d": 5})
+    results = reranker.rerank("query", candidates("a", "b", "c", "d"), top_k=3)
+    assert [result["id"] for result in results] == ["b", "c", "d"]
+    assert results[0]["rerank_score"] == 9.0
+    assert reranker.calls == [["a", "b", "c", "d"]]
+
+
+def test_only_uncached_candidates_are_scored():
+    reranker = ScriptedReranker({"a": 1, "b": 9, "c": 5})
+    reranker.rerank("query", candidates("a", "b"))
+    results = reranker.rerank("query", candidates("a", "b", "c"))
+    assert reranker.calls == [["a", "b"], ["c"]]
+    assert [result["id"] for result in results] == ["b", "c", "a"]
+    # another query scores afresh
+    reranker.rerank("other query", candidates("a"))
+    assert reranker.calls[-1] == ["a"]
+
+
+def test_skipped_when_the_deadline_is_too_close():
+    reranker = ScriptedReranker({"a": 1, "b": 9}, default_latency=1.0)
+    results = reranker.rerank("query", candidates("a", "b"), deadline=time.monotonic() + 0.1)
+    assert [result["id"] for result in results] == ["a", "b"] and "rerank_score" not in results[0]
+    assert reranker.calls == []
+
+
+def test_bad_scores_keep_the_search_order():
+    reranker = ScriptedReranker({"a": 1, "b": 9})
+    reranker.score = lambda query, texts, timeout: [5]
+    results = reranker.rerank("query", candidates("a", "b"))
+    assert [result["id"] for result in results] == ["a", "b"]
+    # nothing was cached, the next search asks again
+    assert reranker.cache.scores == {}
+
+
+def test_async_scoring_is_cut_off_at_the_deadline():
+    reranker = ScriptedReranker({"a": 1, "b": 9}, delay=2, default_latency=0.01)
+    start = time.monotonic()
+    results = asyncio.run(reranker.arerank("query", candidates("a", "b"), deadline=start + 0.2))
+    assert time.monotonic() - start < 1
+    assert [result["id"] for result in results] == ["a", "b"]
+
+
+def test_llm_scores_come_from_one_batched_call(monkeypatch):
+    sent = []
+
+    def create(**kwargs):
+        sent.append(kwargs)
+        return {"choices": [{"message": {"content": "Scores: [2, 8]"}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}
+    monkeypatch.setattr(openai.ChatCompletion, "create", create)
+    reranker = LLMReranker(max_chunk_chars=5, api_key="fake-key")
+    results = reranker.rerank("query", candidates("first passage", "second passage"))
+    assert [result["id"] for result in results] == ["second passage", "first passage"]
+    assert len(sent) == 1
+    prompt = sent[0]["messages"][-1]["content"]
+    assert "[1] first\n\n[2] secon" in prompt and "2 numbers" in prompt
+
+
+def test_unknown_reranker():
+    assert get_reranker(None) is None
+    with pytest.raises(ValueError):
+        get_reranker("bm25")
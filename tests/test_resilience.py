@@ -0,0 +1,185 @@
+"""
+Fault injection against the fake OpenAI server: retries, deadlines and the circuit breaker.
+"""
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from conftest import fake_openai_app
+
+from benlp.llms import ChatClientAsync
+from benlp.resilience import CircuitOpenError, DeadlineExceeded, Policy
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def make_policy(**kwargs) -> Policy:
+    # breakers are shared by name, a unique name keeps tests apart
+    options = {"attempts": 1, "deadline": 10, "timeout": 5, "min_wait": 0.01, "max_wait": 0.05,
+               "failure_threshold": 2, "recovery_timeout": 0.2}
+    return Policy(f"test-{uuid.uuid4().hex[:8]}", **{**options, **kwargs})
+
+
+def run(coroutine_fn, api_base, policy):
+    async def main():
+        async with ChatClientAsync(api_key="fake-key", api_base=api_base, policy=policy) as client:
+            return await coroutine_fn(client)
+    return asyncio.run(main())
+
+
+def create(client):
+    return client.create(MESSAGES, max_tokens=1)
+
+
+async def open_circuit(client, policy):
+    fake_openai_app.CONFIG["error_rate"] = 1
+    for _ in range(policy.breaker.failure_threshold):
+        with pytest.raises(Exception):
+            await create(client)
+    assert policy.breaker.state == "open"
+
+# ! Retries ===================================================================
+
+
+def test_retries_until_attempts_run_out(fake_openai):
+    fake_openai_app.CONFIG.update(error_rate=1, error_status=503)
+    policy = make_policy(attempts=3, failure_threshold=10)
+    with pytest.raises(Exception) as info:
+        run(create, fake_openai, policy)
+    assert getattr(info.value, "status", None) == 503
+    assert fake_openai_app.STATS["requests"] == 3
+
+
+def test_retry_recovers(fake_openai):
+    fake_openai_app.CONFIG.update(error_rate=1)
+    policy = make_policy(attempts=4, failure_threshold=10)
+
+    async def flaky(client):
+        post = client.post
+
+        async def recover_after_two(payload):
+            if fake_openai_app.STATS["requests"] >= 2:
+                fake_openai_app.CONFIG["error_rate"] = 0
+            return await post(payload)
+        client.post = recover_after_two
+        return await create(client)
+
+    response = run(flaky, fake_openai, policy)
+    assert response["choices"][0]["message"]["content"]
+    assert fake_openai_app.STATS == {"requests": 3, "errors": 2}
+    assert policy.breaker.state == "closed"
+
+
+def test_backoff_honors_retry_after(fake_openai):
+    fake_openai_app.CONFIG.update(error_rate=1, error_status=429, retry_after=0.3)
+    policy = make_policy(attempts=3, failure_threshold=10)
+    start = time.monotonic()
+    with pytest.raises(Exception):
+        run(create, fake_openai, policy)
+    assert time.monotonic() - start >= 0.6
+
+
+def test_client_errors_are_not_retried(fake_openai):
+    fake_openai_app.CONFIG.update(error_rate=1, error_status=400)
+    policy = make_policy(attempts=3)
+    with pytest.raises(Exception):
+        run(create, fake_openai, policy)
+    assert fake_openai_app.STATS["requests"] == 1
+    assert policy.breaker.state == "closed"
+
+# ! Deadline ==================================================================
+
+
+def test_deadline_bounds_slow_calls(fake_openai):
+    fake_openai_app.CONFIG.update(latency=2)
+    policy = make_policy(attempts=5, deadline=0.5, timeout=0.2, failure_threshold=10)
+    start = time.monotonic()
+    with pytest.raises((asyncio.TimeoutError, DeadlineExceeded)):
+        run(create, fake_openai, policy)
+    assert time.monotonic() - start < 1.0
+
+
+def test_deadline_check_does_not_take_the_probe():
+    policy = make_policy()
+    policy.breaker.state = "open"
+    policy.breaker.opened_at = time.monotonic() - 1
+
+    async def never_called():
+        raise AssertionError("attempt ran past its deadline")
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(policy.aattempt(time.monotonic() - policy.deadline - 1, never_called, (), {}))
+    assert policy.breaker.state == "open"
+    with pytest.raises(DeadlineExceeded):
+        policy.attempt(time.monotonic() - policy.deadline - 1, never_called, (), {})
+    assert policy.breaker.state == "open"
+
+# ! Circuit Breaker ===========================================================
+
+
+def test_breaker_opens_and_rejects_without_calling(fake_openai):
+    policy = make_policy()
+
+    async def scenario(client):
+        await open_circuit(client, policy)
+        requests = fake_openai_app.STATS["requests"]
+        with pytest.raises(CircuitOpenError):
+            await create(client)
+        assert fake_openai_app.STATS["requests"] == requests
+
+    run(scenario, fake_openai, policy)
+
+
+def test_breaker_half_open_probe_closes(fake_openai):
+    policy = make_policy()
+
+    async def scenario(client):
+        await open_circuit(client, policy)
+        await asyncio.sleep(policy.breaker.recovery_timeout + 0.05)
+        fake_openai_app.CONFIG["error_rate"] = 0
+        await create(client)
+        assert policy.breaker.state == "closed"
+        await create(client)
+
+    run(scenario, fake_openai, policy)
+
+
+def test_breaker_failed_probe_reopens(fake_openai):
+    policy = make_policy()
+
+    async def scenario(client):
+        await open_circuit(client, policy)
+        await asyncio.sleep(policy.breaker.recovery_timeout + 0.05)
+        with pytest.raises(Exception) as info:
+            await create(client)
+        assert not isinstance(info.value, CircuitOpenError)
+        assert policy.breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            await create(client)
+
+    run(scenario, fake_openai, policy)
+
+
+def test_cancelled_probe_releases_half_open(fake_openai):
+    policy = make_policy()
+
+    async def scenario(client):
+        await open_circuit(client, policy)
+        await asyncio.sleep(policy.breaker.recovery_timeout + 0.05)
+        fake_openai_app.CONFIG.update(error_rate=0, latency=1)
+        probe = asyncio.create_task(create(client))
+        await asyncio.sleep(0.1)
+        assert policy.breaker.state == "half_open"
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert policy.breaker.state == "open"
+
+        # the next call probes again instead of being rejected for good
+        fake_openai_app.CONFIG["latency"] = 0
+        await create(client)
+        assert policy.breaker.state == "closed"
+
+    run(scenario, fake_openai, policy)
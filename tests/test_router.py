@@ -0,0 +1,50 @@
+import uuid
+
+from benlp.llms import Endpoint, ModelRouter
+
+
+def make_endpoint(name, latency=None, samples=0, errors=0):
+    endpoint = Endpoint("gpt-3.5-turbo", name=f"{name}-{uuid.uuid4().hex[:8]}", api_key="fake-key")
+    for _ in range(samples):
+        endpoint.stats.record(latency)
+    for _ in range(errors):
+        endpoint.stats.record(error=True)
+    return endpoint
+
+
+def names(endpoints):
+    return [endpoint.name.split("-")[0] for endpoint in endpoints]
+
+
+def test_cold_fallback_stays_behind_measured_primary():
+    router = ModelRouter([make_endpoint("primary", 0.5, samples=30), make_endpoint("cold")], min_samples=20)
+    assert names(router.ranked()) == ["primary", "cold"]
+
+
+def test_measured_endpoints_reorder_around_cold_ones():
+    router = ModelRouter([
+        make_endpoint("slow", 2.0, samples=30),
+        make_endpoint("cold"),
+        make_endpoint("fast", 0.2, samples=30),
+    ], min_samples=20)
+    assert names(router.ranked()) == ["fast", "cold", "slow"]
+
+
+def test_unhealthy_endpoints_go_last():
+    failing = make_endpoint("failing", 0.1, samples=10, errors=20)
+    router = ModelRouter([failing, make_endpoint("ok", 1.0, samples=30), make_endpoint("cold")], min_samples=20)
+    assert names(router.ranked()) == ["ok", "cold", "failing"]
+
+    broken = make_endpoint("broken")
+    broken.policy.breaker.state = "open"
+    router = ModelRouter([broken, make_endpoint("cold")], min_samples=20)
+    assert names(router.ranked()) == ["cold", "broken"]
+
+
+def test_hedge_delay_falls_back_without_latency_samples():
+    router = ModelRouter([make_endpoint("errors", errors=30)], min_samples=20, default_hedge_delay=1.5)
+    assert router.hedge_delay(router.endpoints[0]) == 1.5
+    router = ModelRouter([make_endpoint("cold")], default_hedge_delay=1.5)
+    assert router.hedge_delay(router.endpoints[0]) == 1.5
+    router = ModelRouter([make_endpoint("measured", 0.3, samples=30)], min_samples=20)
+    assert router.hedge_delay(router.endpoints[0]) == 0.3
@@ -0,0 +1,72 @@
+import asyncio
+import importlib
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import fake_openai_app
+
+from benlp.llms import ChatClientAsync
+
+
+@pytest.fixture
+def app(fake_openai, monkeypatch):
+    """
+    The API server pointed at the fake OpenAI server, without the key check.
+    """
+    import main
+    monkeypatch.setenv("OPENAI_API_BASE", fake_openai)
+    monkeypatch.setattr("middleware.load_api_keys", lambda: {})
+    return importlib.reload(main).app
+
+
+def sse_data(text):
+    return [json.loads(line[len("data:"):]) for line in text.splitlines() if line.startswith("data:")]
+
+# ! ChatClientAsync ===========================================================
+
+
+def test_client_creates_and_streams(fake_openai):
+    fake_openai_app.CONFIG.update(tokens=3)
+
+    async def scenario():
+        async with ChatClientAsync(api_key="fake-key", api_base=fake_openai) as client:
+            response = await client.create([{"role": "user", "content": "hi"}])
+            chunks = [chunk async for chunk in client.stream([{"role": "user", "content": "hi"}])]
+        return response, chunks
+
+    response, chunks = asyncio.run(scenario())
+    assert response["choices"][0]["message"]["content"] == "token " * 3
+    streamed = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+    assert streamed == "token " * 3
+
+
+def test_concurrent_requests_share_the_pooled_session(fake_openai):
+    fake_openai_app.CONFIG.update(latency=0.05)
+
+    async def scenario():
+        async with ChatClientAsync(api_key="fake-key", api_base=fake_openai, max_connections=4) as client:
+            session = client.session
+            await asyncio.gather(*(client.create([{"role": "user", "content": str(idx)}]) for idx in range(12)))
+            assert client.session is session and session.connector.limit == 4
+
+    asyncio.run(scenario())
+    assert fake_openai_app.STATS["requests"] == 12
+
+# ! Server ====================================================================
+
+
+def test_chat_stream_uses_the_lifespan_client(app):
+    fake_openai_app.CONFIG.update(tokens=2)
+    messages = {"messages": [{"role": "user", "content": "hi"}]}
+    with TestClient(app) as client:
+        llm = app.state.llm
+        first = client.post("/chat/stream", json=messages)
+        second = client.post("/chat/stream", json=messages)
+        assert app.state.llm is llm
+    for response in (first, second):
+        chunks = sse_data(response.text)
+        assert "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks) == "token " * 2
+    # the client is closed with the app
+    assert llm.session is None
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from cache import StreamCache, cached_stream_response
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def collect(stream):
+    return [item async for item in stream]
+
+
+def test_streams_persist_to_disk_off_the_event_loop(tmp_path):
+    threads = []
+
+    async def scenario():
+        await StreamCache(cache_dir=str(tmp_path)).set("key", ["a", "b"])
+        cache = StreamCache(cache_dir=str(tmp_path))
+        disk_get = cache.disk.get
+
+        def tracked_get(key):
+            threads.append(threading.current_thread())
+            return disk_get(key)
+        cache.disk.get = tracked_get
+        assert await cache.get("key") == ["a", "b"]
+        # the second read comes from memory
+        assert await cache.get("key") == ["a", "b"]
+        return threading.current_thread()
+
+    loop_thread = run(scenario())
+    assert len(threads) == 1 and threads[0] is not loop_thread
+
+
+def test_identical_requests_share_one_generation():
+    calls = []
+
+    async def producer():
+        calls.append(1)
+        for item in "abc":
+            await asyncio.sleep(0.01)
+            yield item
+
+    async def scenario():
+        cache = StreamCache(cache_dir=None)
+        first, first_status = cache.lookup("key", producer)
+        second, second_status = cache.lookup("key", producer)
+        results = await asyncio.gather(collect(first), collect(second))
+        third, third_status = cache.lookup("key", producer, await cache.get("key"))
+        return [first_status, second_status, third_status], results, await collect(third)
+
+    statuses, results, replay = run(scenario())
+    assert statuses == ["miss", "coalesced", "hit"]
+    assert results == [list("abc")] * 2 and replay == list("abc")
+    assert len(calls) == 1
+
+
+def test_failed_streams_are_not_cached():
+    async def producer():
+        yield "a"
+        raise RuntimeError("upstream failed")
+
+    async def scenario():
+        cache = StreamCache(cache_dir=None)
+        stream, _ = cache.lookup("key", producer)
+        try:
+            await collect(stream)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("the error should reach the subscriber")
+        return await cache.get("key")
+
+    assert run(scenario()) is None
+
+
+def test_cached_response_reads_the_cache_once(tmp_path):
+    app = FastAPI()
+    app.state.stream_cache = cache = StreamCache(cache_dir=str(tmp_path))
+    reads = []
+    cache_get = cache.get
+
+    async def counted_get(key):
+        reads.append(key)
+        return await cache_get(key)
+    cache.get = counted_get
+
+    async def producer():
+        yield "hello"
+
+    @app.get("/stream")
+    async def docs(request: Request):
+        return await cached_stream_response(request, ("docs", 1), producer)
+
+    with TestClient(app) as client:
+        first = client.get("/stream")
+        assert first.headers["x-cache"] == "miss" and "hello" in first.text
+        second = client.get("/stream")
+        assert second.headers["x-cache"] == "hit" and "hello" in second.text
+        not_modified = client.get("/stream", headers={"If-None-Match": first.headers["etag"]})
+        assert not_modified.status_code == 304
+    assert len(reads) == 3
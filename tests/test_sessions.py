@@ -0,0 +1,157 @@
+import openai
+import pytest
+
+from conftest import requires_tiktoken
+
+from benlp.llms import Chat
+from benlp.sessions import TOKENS_PER_MESSAGE, SessionStore
+
+pytestmark = requires_tiktoken
+
+
+@pytest.fixture
+def store():
+    return SessionStore(max_sessions=2)
+
+
+@pytest.fixture
+def sent(fake_openai, monkeypatch):
+    """
+    Point openai at the fake server and record the messages of every chat request.
+    """
+    requests = []
+    create = openai.ChatCompletion.create
+
+    def recording_create(*args, **kwargs):
+        requests.append([dict(message) for message in kwargs["messages"]])
+        return create(*args, **kwargs)
+    monkeypatch.setattr(openai, "api_base", fake_openai)
+    # Chat sets the global key, put it back after
+    monkeypatch.setattr(openai, "api_key", openai.api_key)
+    monkeypatch.setattr(openai.ChatCompletion, "create", recording_create)
+    return requests
+
+
+def add_turns(store, session, turns, words=20):
+    for idx in range(turns):
+        session.messages.append(store.make_message("user", f"question {idx} " + "word " * words))
+        session.messages.append(store.make_message("assistant", f"answer {idx}"))
+
+# ! SessionStore ==============================================================
+
+
+def test_least_recently_used_sessions_leave_memory(store):
+    first = store.get("a")
+    store.get("b")
+    store.get("a")
+    store.get("c")
+    assert list(store.sessions) == ["a", "c"]
+    assert store.get("a") is first
+
+
+def test_evicted_sessions_reload_from_sqlite(tmp_path):
+    store = SessionStore(max_sessions=1, path=str(tmp_path / "sessions.db"))
+    session = store.get("a", system_message="Be brief.")
+    add_turns(store, session, 2)
+    store.save(session)
+    store.get("b")
+    assert "a" not in store.sessions
+
+    reloaded = store.get("a")
+    assert reloaded is not session
+    assert reloaded.history() == session.history()
+    assert reloaded.system.content == "Be brief."
+    assert [message.tokens for message in reloaded.messages] == [message.tokens for message in session.messages]
+
+
+def test_trim_drops_to_the_low_water_mark_and_keeps_the_full_history(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"))
+    session = store.get("a")
+    add_turns(store, session, 10)
+    budget = session.tokens() // 2
+    dropped = store.trim(session, budget)
+    assert dropped and session.tokens() <= budget * 0.75
+    assert session.offset == len(dropped)
+    assert len(store.full_history("a")) == 20
+
+    # a reload only brings back the untrimmed messages
+    store.sessions.clear()
+    assert store.get("a").history() == session.history()
+
+
+def test_summary_replaces_the_dropped_messages(store):
+    session = store.get("a")
+    add_turns(store, session, 10)
+    folded = []
+
+    def summarize(previous, text):
+        folded.append(text)
+        return "short summary"
+    budget = session.tokens() // 2
+    dropped = store.trim(session, budget, summarize=summarize)
+    assert folded[0].startswith("user: question 0")
+    assert session.summary.content.endswith("short summary")
+    assert session.summary.tokens == store.count(session.summary.content) + TOKENS_PER_MESSAGE
+    assert session.tokens() == sum(message.tokens for message in session.messages) + session.summary.tokens
+    assert len(dropped) + len(session.messages) == 20
+
+
+def test_unchanged_prefix_is_accounted(store):
+    session = store.get("a", system_message="Be brief.")
+    add_turns(store, session, 1)
+    session.get_messages()
+    first_tokens = session.tokens()
+    session.messages.append(store.make_message("user", "one more"))
+    session.get_messages()
+    assert session.last_prefix_tokens == first_tokens
+
+# ! Chat ======================================================================
+
+
+def test_history_is_sent_untrimmed_by_default(sent, store):
+    chat = Chat(store=store, max_tokens=5, api_key="fake-key")
+    # well over the 4k context, trimming used to be on by default
+    add_turns(store, chat.session, 40, words=120)
+    chat.load_messages()
+    chat("last question")
+    assert len(sent[0]) == 1 + 80 + 1
+
+
+def test_opt_in_trimming_shortens_the_sent_history(sent, store):
+    chat = Chat(store=store, max_tokens=5, api_key="fake-key", max_history_tokens=500)
+    add_turns(store, chat.session, 40, words=50)
+    chat.load_messages()
+    chat("last question")
+    assert sum(store.count(message["content"]) for message in sent[0]) < 500
+    assert sent[0][-1] == {"role": "user", "content": "last question"}
+    assert len(chat.messages) == len(sent[0]) + 1
+
+
+def test_messages_edits_are_sent(sent, store):
+    chat = Chat(store=store, max_tokens=5, api_key="fake-key")
+    chat("hello")
+    history = chat.messages
+    history.append({"role": "user", "content": "an appended note"})
+    del history[1:3]
+    chat("next")
+    assert [message["content"] for message in sent[1]] == ["You are a helpful assistant.", "an appended note", "next"]
+    assert chat.messages is history and len(history) == 4
+
+
+def test_edits_are_persisted(sent, tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"))
+    chat = Chat(session_id="a", store=store, max_tokens=5, api_key="fake-key")
+    chat("hello")
+    chat.messages[1] = {"role": "user", "content": "edited"}
+    chat("again")
+    assert [message["content"] for message in store.full_history("a")][:1] == ["edited"]
+    assert len(store.full_history("a")) == 4
+
+
+def test_resumed_sessions_reject_new_starting_messages(sent, store):
+    chat = Chat(session_id="a", store=store, messages=["first"], max_tokens=5, api_key="fake-key")
+    chat("hello")
+    resumed = Chat(session_id="a", store=store, api_key="fake-key")
+    assert resumed.messages == chat.messages
+    with pytest.raises(ValueError):
+        Chat(session_id="a", store=store, messages=["first"], api_key="fake-key")
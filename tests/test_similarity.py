@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from benlp.similarity import METRICS, merge_top_k, prepare, prepare_query, to_similarity, top_k_rows
+
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(500, 32)), rng.normal(size=32)
+
+
+def brute_force(embeddings, query, metric, k):
+    if metric == "cosine":
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        query = query / np.linalg.norm(query)
+    if metric == "l2":
+        scores = -((embeddings - query) ** 2).sum(axis=1)
+    else:
+        scores = embeddings @ query
+    return list(np.argsort(-scores)[:k]), scores
+
+
+@pytest.mark.parametrize("metric", METRICS)
+def test_blocked_top_k_matches_brute_force(embeddings, metric):
+    vectors, norms = prepare(embeddings[0], metric)
+    query = prepare_query(embeddings[1], metric)
+    expected, scores = brute_force(*embeddings, metric, 10)
+    # small blocks so the heap merges results across many of them
+    result = top_k_rows(vectors, query, 10, metric, norms, rows_per_block=64)
+    assert [row for _, row in result] == expected
+    assert np.allclose([score for score, _ in result], scores[expected], atol=1e-3)
+
+
+@pytest.mark.parametrize("metric", METRICS)
+def test_float16_storage_ranks_like_float32(embeddings, metric):
+    rows = {}
+    for dtype in ("float32", "float16"):
+        vectors, norms = prepare(embeddings[0], metric, dtype)
+        assert vectors.dtype == np.dtype(dtype)
+        query = prepare_query(embeddings[1], metric, dtype)
+        rows[dtype] = [row for _, row in top_k_rows(vectors, query, 5, metric, norms)]
+    assert rows["float16"][:3] == rows["float32"][:3]
+
+
+def test_dead_rows_are_skipped(embeddings):
+    vectors, _ = prepare(embeddings[0])
+    query = prepare_query(embeddings[1])
+    best = [row for _, row in top_k_rows(vectors, query, 3)]
+    alive = np.ones(len(vectors), dtype=bool)
+    alive[best[0]] = False
+    assert [row for _, row in top_k_rows(vectors, query, 3, alive=alive)] == best[1:] + \
+        [row for _, row in top_k_rows(vectors, query, 4)][3:]
+    assert top_k_rows(vectors, query, 3, alive=np.zeros(len(vectors), dtype=bool)) == []
+
+
+def test_merge_and_similarity():
+    merged = merge_top_k([[(0.9, "a"), (0.1, "b")], [(0.5, "c")], []], 2)
+    assert merged == [(0.9, "a"), (0.5, "c")]
+    assert to_similarity(-4.0, "l2") == -2.0
+    assert to_similarity(0.3, "cosine") == 0.3
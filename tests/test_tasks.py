@@ -0,0 +1,52 @@
+import pytest
+
+from benlp.tasks import TaskGraph
+
+
+def names(tasks):
+    return [task["name"] for task in tasks]
+
+
+def test_repeated_names_are_renamed():
+    graph = TaskGraph([{"name": "a"}, {"name": "a"}, {"name": "b", "depends_on": ["a"]}])
+    assert list(graph.tasks) == ["a", "a-2", "b"]
+    assert graph.dependencies["b"] == {"a"}
+
+    graph.add({"name": "a"})
+    assert "a-3" in graph.tasks
+    assert len(graph) == 4
+
+
+def test_missing_dependencies_are_dropped():
+    graph = TaskGraph([{"name": "a", "depends_on": "b, never"}, {"name": "b"}])
+    assert graph.dependencies["a"] == {"b"}
+    assert names(graph.ready(set(), set())) == ["b"]
+
+
+def test_streamed_forward_dependency_waits_for_its_task():
+    graph = TaskGraph()
+    graph.add({"name": "report", "depends_on": ["research"]})
+    assert graph.ready(set(), set()) == []
+
+    graph.add({"name": "research"})
+    assert graph.dependencies["report"] == {"research"}
+    assert names(graph.ready(set(), set())) == ["research"]
+    assert names(graph.ready({"research"}, {"research"})) == ["report"]
+
+
+def test_finish_releases_dependencies_that_never_arrive():
+    graph = TaskGraph()
+    graph.add({"name": "a", "depends_on": ["ghost"]})
+    with pytest.raises(ValueError):
+        graph.levels()
+    graph.finish()
+    assert names(graph.ready(set(), set())) == ["a"]
+
+
+def test_resolving_a_dependency_never_creates_a_cycle():
+    graph = TaskGraph()
+    graph.add({"name": "a", "depends_on": ["b"]})
+    graph.add({"name": "b", "depends_on": ["a"]})
+    graph.check_cycles()
+    assert graph.dependencies == {"a": set(), "b": {"a"}}
+    assert [names(level) for level in graph.levels()] == [["a"], ["b"]]
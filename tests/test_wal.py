@@ -0,0 +1,104 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from conftest import make_doc
+
+from benlp.index import VectorIndex
+from benlp.wal import HEADER, RECORD, IndexStore
+
+
+def random_doc(name, rng, chunks=2):
+    return make_doc(name, rng.standard_normal((chunks, 8)))
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "index.pkl")
+
+
+def test_mutations_survive_reopen(path, rng):
+    store = IndexStore(path)
+    docs = [random_doc(f"d{idx}", rng) for idx in range(3)]
+    for doc in docs:
+        assert store.add_document(doc)
+    assert not store.add_document(docs[0])
+    assert store.delete_document(docs[1]["id"])
+    store.close()
+
+    reopened = IndexStore(path)
+    assert [doc["id"] in reopened.index for doc in docs] == [True, False, True]
+    assert reopened.lsn == 4
+    reopened.close()
+
+
+def test_checkpoint_starts_a_new_log(path, rng):
+    store = IndexStore(path)
+    store.add_document(random_doc("a", rng))
+    store.checkpoint()
+    assert os.path.getsize(f"{path}.wal") == HEADER.size
+    store.add_document(random_doc("b", rng))
+    store.close()
+
+    reopened = IndexStore(path)
+    assert len(reopened.index) == 2
+    reopened.close()
+
+
+def test_torn_tail_is_dropped_on_load(path, rng):
+    store = IndexStore(path)
+    store.add_document(random_doc("a", rng))
+    store.close()
+    with open(f"{path}.wal", "ab") as f:
+        f.write(RECORD.pack(1000, 2, 0) + b"partial")
+
+    reopened = IndexStore(path)
+    assert len(reopened.index) == 1
+    assert os.path.getsize(f"{path}.wal") == reopened.wal.offset
+    reopened.close()
+
+
+def test_crash_mid_append_does_not_hide_later_records(path, rng):
+    crashed, survivor = IndexStore(path), IndexStore(path)
+    docs = [random_doc(f"d{idx}", rng) for idx in range(3)]
+    crashed.add_document(docs[0])
+    # the first worker dies halfway through writing its next record
+    os.write(crashed.wal.fd, RECORD.pack(500, crashed.lsn + 1, 0) + b"x" * 20)
+
+    survivor.add_document(docs[1])
+    survivor.add_document(docs[2])
+    survivor.close()
+
+    reopened = IndexStore(path)
+    assert all(doc["id"] in reopened.index for doc in docs)
+    reopened.close()
+
+
+def test_stores_follow_each_other_across_checkpoints(path, rng):
+    first, second = IndexStore(path, checkpoint_bytes=1), IndexStore(path, checkpoint_bytes=1)
+    docs = [random_doc(f"d{idx}", rng) for idx in range(4)]
+    # every write checkpoints, so the other store has to follow the log across replacements
+    for idx, doc in enumerate(docs):
+        (first if idx % 2 == 0 else second).add_document(doc)
+    first.refresh()
+    second.refresh()
+    assert len(first.index) == len(second.index) == 4
+    first.close()
+    second.close()
+
+
+def test_loads_legacy_list_pickles(path, rng):
+    docs = [random_doc(f"d{idx}", rng) for idx in range(2)]
+    with open(path, "wb") as f:
+        pickle.dump(docs, f)
+    store = IndexStore(path)
+    assert isinstance(store.index, VectorIndex)
+    assert all(doc["id"] in store.index for doc in docs)
+    store.close()